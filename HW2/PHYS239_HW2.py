@@ -7,43 +7,139 @@
 """Michael Randall
 mrandall@ucsd.edu"""
 
-import tkinter as tk
 import math
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.figure import Figure
+import itertools
+import collections
+import hashlib
+import queue
+import threading
+import numpy as np
+
+import instrumentation
+from line_profiles import gaussian_profile
+
+#tkinter and matplotlib are only imported by load_gui_modules when a window is opened,
+#so the calculations can run on machines without a display (see headless_HW2.py)
+tk = None
+FigureCanvasTkAgg = None
+Figure = None
+
+#button label -> (cross section list, initial intensity, source function) for problem 4
+PROBLEM_4_SCENARIOS = {"A": ("low", 0, 1),
+                       "B": ("low", 10, 1),
+                       "C": ("low", 1, 10),
+                       "D": ("high", 10, 1),
+                       "E": ("gauss", 1, 10),
+                       "F": ("gauss", 10, 1)}
+
+#number of solver steps between calls to a progress_callback
+PROGRESS_INTERVAL = 1000
+#number of cells the Euler loop converts to plain floats at a time
+STEP_CHUNK_SIZE = 10000
+
+class CalculationCancelled(Exception):
+    """Raised by a progress_callback to stop a calculation early"""
+
+def load_gui_modules():
+    global tk, FigureCanvasTkAgg, Figure
+    if tk is not None:
+        return
+    
+    import tkinter
+    import matplotlib
+    matplotlib.use("TkAgg")
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as figure_canvas_tk_agg
+    from matplotlib.figure import Figure as figure
+    
+    tk = tkinter
+    FigureCanvasTkAgg = figure_canvas_tk_agg
+    Figure = figure
 
 def convert_parsec_to_cm(number_to_convert):
     return number_to_convert * 3.086E18
 
-def column_density_calculator(depth, density):
+def sample_profile(profile, depth, number_of_cells):
+    """
+    Samples a quantity along the path through an object on equal-size cells
+    
+    params:
+    profile (float, array or callable): value of the quantity. A float is uniform,
+                                        an array gives one value per cell and a callable
+                                        is called with the cell centers in parsec
+    depth (float): Depth of object in parsecs
+    number_of_cells (int): number of cells along the path
+    
+    returns:
+    cell_values (float or numpy array): the float unchanged, otherwise one value per cell
+    """
+    if callable(profile):
+        cell_centers = (np.arange(number_of_cells) + 0.5) * (depth / number_of_cells)
+        return np.broadcast_to(np.asarray(profile(cell_centers), dtype=float), (number_of_cells,))
+    
+    if np.ndim(profile) == 0:
+        return profile
+    
+    cell_values = np.asarray(profile, dtype=float)
+    if cell_values.shape != (number_of_cells,):
+        raise ValueError(f"Profile has shape {cell_values.shape}, expected ({number_of_cells},)")
+    return cell_values
+
+def count_profile_cells(default_number_of_cells, *profiles):
+    """
+    Finds the number of cells implied by a set of profiles. Array profiles set
+    the number of cells and must all have the same length.
+    
+    params:
+    default_number_of_cells (int): number of cells if no profile is an array
+    *profiles (float, array or callable): profiles as accepted by sample_profile
+    
+    returns:
+    number_of_cells (int): number of cells along the path
+    """
+    array_lengths = {len(profile) for profile in profiles
+                     if not callable(profile) and np.ndim(profile) > 0}
+    if len(array_lengths) > 1:
+        raise ValueError(f"Profiles have different lengths {sorted(array_lengths)}")
+    if array_lengths:
+        return array_lengths.pop()
+    return default_number_of_cells
+
+def is_uniform(*profiles):
+    return all(not callable(profile) and np.ndim(profile) == 0 for profile in profiles)
+
+def column_density_calculator(depth, density, number_of_cells=100000):
     """
     Calculates and returns a column density of an object
     
     params:
     depth (float): Depth of object in parsecs
-    density (float): uniform density of object in cm^-3
+    density (float, array or callable): density of object in cm^-3, see sample_profile
+    number_of_cells (int): number of cells a callable density is sampled on
     
     returns:
-    column_densiy (float): column density of object in cm^-3
+    column_densiy (float): column density of object in cm^-2
     """
     
     converted_depth = convert_parsec_to_cm(depth)
     
-    column_density = converted_depth / density
+    if is_uniform(density):
+        column_density = converted_depth * density
+        return column_density
+    
+    number_of_cells = count_profile_cells(number_of_cells, density)
+    density_cells = sample_profile(density, depth, number_of_cells)
+    column_density = float(np.sum(density_cells)) * (converted_depth / number_of_cells)
     return column_density
 
 def cross_section_calculator(optical_depth, depth, density):
     """
     Calculates the cross_section required for a given 
-    optical depth, depth, and uniform density
+    optical depth, depth, and density
     
     params:
     optical_depth (float): optical depth of an object
     depth (float): Depth of object in parsecs
-    density (float): uniform density of object in cm^-3
+    density (float, array or callable): density of object in cm^-3, see sample_profile
     
     returns:
     cross_section (float): cross section implied by the above parameters
@@ -56,49 +152,532 @@ def cross_section_calculator(optical_depth, depth, density):
 
 
 
-def specific_intensity_calculator(initial_intensity, source_function, cross_section, density, depth):
+@instrumentation.timed("specific_intensity_calculator")
+def specific_intensity_calculator(initial_intensity, source_function, cross_section, density, depth,
+                                  method="euler", depths=None, output="profile", decimation=1,
+                                  chunk_size=10000, number_of_steps=100000, progress_callback=None):
+    """
+    Calculates the specific intensity of light passing through an object.
+    The "euler" method applies the radiative transfer function at a number of
+    steps defined by number_of_steps. The "exact" method uses the formal solution
+    on each cell and only evaluates the depths that are asked for.
+    
+    The source function, cross section and density can each be a float, an array
+    with one value per cell, or a callable of depth in parsec (see sample_profile).
+    Arrays set the number of cells, which is also the number of Euler steps.
+    
+    The output modes of the "euler" method are:
+    "profile": every step is kept
+    "final": only the final intensity is kept
+    "decimated": every decimation-th step and the final step are kept
+    "chunks": a generator is returned that yields lists of at most chunk_size steps
+    
+    params:
+    initial_intensity (float): specific radiative intensity entering the object
+    source_function (float, array or callable): radiative source function of the object
+    cross_section (float, array or callable): cross section of interactions in the object in cm^2
+    density (float, array or callable): density of the object in cm^-3
+    depth (float): distance light passes through in object in parsec
+    method (str): "euler" or "exact"
+    depths [float]: depths in parsec to evaluate with the "exact" method, defaults to [depth]
+    output (str): "profile", "final", "decimated" or "chunks"
+    decimation (int): number of steps between kept intensities for the "decimated" output
+    chunk_size (int): number of intensities per chunk for the "chunks" output
+    number_of_steps (int): number of steps or cells when no profile is an array
+    progress_callback (callable): called with the fraction of Euler steps done every
+                                  PROGRESS_INTERVAL steps. It may raise CalculationCancelled to stop
+    
+    returns:
+    intensity_list [float]: list of specific intensities calculated at the kept steps,
+                            or at each of depths for the "exact" method. The last entry
+                            is always the intensity leaving the object.
+    """
+    if output not in ("profile", "final", "decimated", "chunks"):
+        raise ValueError(f"Unknown output '{output}', expected 'profile', 'final', 'decimated' or 'chunks'")
+    
+    number_of_steps = count_profile_cells(number_of_steps, source_function, cross_section, density)
+    
+    if method == "exact":
+        if output == "final":
+            depths = [depth]
+        elif output != "profile":
+            raise ValueError(f"The 'exact' method does not support the '{output}' output")
+        
+        if depths is None:
+            depths = [depth]
+        elif any(query_depth < 0 or query_depth > depth for query_depth in depths):
+            raise ValueError(f"depths must lie between 0 and the object depth {depth} parsec")
+        
+        if is_uniform(source_function, cross_section, density):
+            return exact_intensity_calculator(initial_intensity, source_function, cross_section, density, depths)
+        
+        source_cells, d_optical_depth_cells = build_cells(source_function, cross_section, density,
+                                                          depth, number_of_steps)
+        return [stratified_intensity_calculator(initial_intensity, source_cells, d_optical_depth_cells,
+                                                query_depth / depth * number_of_steps)
+                for query_depth in depths]
+    elif method != "euler":
+        raise ValueError(f"Unknown method '{method}', expected 'euler' or 'exact'")
+    
+    if output == "chunks":
+        return specific_intensity_chunks(initial_intensity, source_function, cross_section, density, depth,
+                                         chunk_size, number_of_steps)
+    if output == "profile":
+        decimation = 1
+    elif output == "final":
+        decimation = number_of_steps
+    elif decimation < 1:
+        raise ValueError("decimation must be at least 1")
+    
+    source_steps, d_optical_depth_steps = build_steps(source_function, cross_section, density,
+                                                      depth, number_of_steps)
+    current_intensity = initial_intensity
+    intensity_list = [initial_intensity] if output != "final" else []
+    steps = zip(source_steps, d_optical_depth_steps)
+    keep_every_step = decimation == 1
+    step = 0
+    with instrumentation.span("specific_intensity_calculator.euler") as run_span:
+        #run up to the next kept intensity or progress report in a loop without any checks
+        while step < number_of_steps:
+            block_end = number_of_steps
+            if progress_callback is not None:
+                block_end = min(block_end, (step // PROGRESS_INTERVAL + 1) * PROGRESS_INTERVAL)
+            if not keep_every_step:
+                block_end = min(block_end, (step // decimation + 1) * decimation)
+            
+            if keep_every_step:
+                for step_source_function, d_optical_depth in itertools.islice(steps, block_end - step):
+                    d_intensity = (step_source_function - current_intensity) * d_optical_depth
+                    current_intensity = current_intensity + d_intensity
+                    intensity_list.append(current_intensity)
+            else:
+                for step_source_function, d_optical_depth in itertools.islice(steps, block_end - step):
+                    d_intensity = (step_source_function - current_intensity) * d_optical_depth
+                    current_intensity = current_intensity + d_intensity
+                if block_end % decimation == 0 or block_end == number_of_steps:
+                    intensity_list.append(current_intensity)
+            
+            step = block_end
+            if progress_callback is not None and step % PROGRESS_INTERVAL == 0:
+                progress_callback(step / number_of_steps)
+        run_span.add_steps(number_of_steps)
+    return intensity_list
+
+def specific_intensity_chunks(initial_intensity, source_function, cross_section, density, depth,
+                              chunk_size=10000, number_of_steps=100000):
     """
-    Calculates the specific intensity of light passing through an object
-    by applying the radiative transfer function at a number of steps defined
-    by number_of_steps.
+    Generates the Euler steps of specific_intensity_calculator in chunks, so
+    a profile can be processed without ever holding all of it in memory.
+    
+    params:
+    initial_intensity (float): specific radiative intensity entering the object
+    source_function (float, array or callable): radiative source function of the object
+    cross_section (float, array or callable): cross section of interactions in the object in cm^2
+    density (float, array or callable): density of the object in cm^-3
+    depth (float): distance light passes through in object in parsec
+    chunk_size (int): maximum number of intensities per chunk
+    number_of_steps (int): number of steps to take when no profile is an array
+    
+    yields:
+    intensity_chunk [float]: the next intensities, starting with initial_intensity
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    
+    number_of_steps = count_profile_cells(number_of_steps, source_function, cross_section, density)
+    source_steps, d_optical_depth_steps = build_steps(source_function, cross_section, density,
+                                                      depth, number_of_steps)
+    current_intensity = initial_intensity
+    intensity_chunk = [initial_intensity]
+    for step_source_function, d_optical_depth in zip(source_steps, d_optical_depth_steps):
+        d_intensity = (step_source_function - current_intensity) * d_optical_depth
+
+        current_intensity = current_intensity + d_intensity
+        
+        if len(intensity_chunk) == chunk_size:
+            yield intensity_chunk
+            intensity_chunk = []
+        intensity_chunk.append(current_intensity)
+    yield intensity_chunk
+
+def exact_intensity_calculator(initial_intensity, source_function, cross_section, density, depths):
+    """
+    Calculates the specific intensity of light at given depths in an object with
+    constant density, cross section and source function using the formal solution
+    I = S + (I0 - S) * exp(-optical_depth). Each depth costs the same no matter how deep it is.
     
     params:
     initial_intensity (float): specific radiative intensity entering the object
     source_function (float): radiative source function of the object
     cross_section (float): cross section of interactions in the object in cm^2
     density (float): density of the object in cm^-3
+    depths [float]: depths in parsec to evaluate the intensity at
+    
+    returns:
+    intensity_list [float]: list of specific intensities, one per depth
+    """
+    intensity_list = []
+    for depth in depths:
+        optical_depth = cross_section * density * convert_parsec_to_cm(depth)
+        intensity = source_function + (initial_intensity - source_function) * math.exp(-optical_depth)
+        intensity_list.append(intensity)
+    return intensity_list
+
+def build_cells(source_function, cross_section, density, depth, number_of_cells):
+    """
+    Samples the source function and optical depth of every cell along the path
+    
+    params:
+    source_function (float, array or callable): radiative source function of the object
+    cross_section (float, array or callable): cross section of interactions in the object in cm^2
+    density (float, array or callable): density of the object in cm^-3
     depth (float): distance light passes through in object in parsec
+    number_of_cells (int): number of cells along the path
     
     returns:
-    intensity_list [float]: list of specific intensities calculated at each step
+    source_cells (float or numpy array): source function of each cell
+    d_optical_depth_cells (float or numpy array): optical depth of each cell
+    """
+    step_size = convert_parsec_to_cm(depth) / number_of_cells
+    
+    source_cells = sample_profile(source_function, depth, number_of_cells)
+    cross_section_cells = sample_profile(cross_section, depth, number_of_cells)
+    density_cells = sample_profile(density, depth, number_of_cells)
+    
+    d_optical_depth_cells = cross_section_cells * density_cells * step_size
+    return source_cells, d_optical_depth_cells
+
+def build_steps(source_function, cross_section, density, depth, number_of_steps):
+    """
+    Same as build_cells but returns iterators of plain floats for the Euler loop
+    """
+    source_cells, d_optical_depth_cells = build_cells(source_function, cross_section, density,
+                                                      depth, number_of_steps)
+    return iterate_cells(source_cells, number_of_steps), iterate_cells(d_optical_depth_cells, number_of_steps)
+
+def iterate_cells(cells, number_of_steps):
+    """
+    Iterates over the cells as plain floats, converting STEP_CHUNK_SIZE of them at
+    a time so an array profile is never held as one Python float per cell
+    
+    params:
+    cells (float or array): value of each cell, or one value for every cell
+    number_of_steps (int): number of cells
+    
+    returns:
+    cell_iterator (iterator): the value of each cell in turn
+    """
+    if np.ndim(cells) == 0:
+        return itertools.repeat(cells, number_of_steps)
+    return itertools.chain.from_iterable(cells[start:start + STEP_CHUNK_SIZE].tolist()
+                                         for start in range(0, len(cells), STEP_CHUNK_SIZE))
+
+def stratified_intensity_calculator(initial_intensity, source_cells, d_optical_depth_cells,
+                                    number_of_cells_crossed=None):
+    """
+    Calculates the specific intensity of light after crossing cells of constant
+    source function and optical depth, in a single vectorized pass. Each cell
+    contributes S * (exp(-optical depth after it) - exp(-optical depth from its start)).
+    
+    params:
+    initial_intensity (float): specific radiative intensity entering the object
+    source_cells (float or array): source function of each cell
+    d_optical_depth_cells (float or array): optical depth of each cell
+    number_of_cells_crossed (float): number of cells crossed, may end partway through a cell.
+                                     Defaults to all of them
+    
+    returns:
+    intensity (float): specific intensity after the crossed cells
+    """
+    source_cells, d_optical_depth_cells = np.broadcast_arrays(np.asarray(source_cells, dtype=float),
+                                                              np.asarray(d_optical_depth_cells, dtype=float))
+    number_of_cells = len(d_optical_depth_cells)
+    if number_of_cells_crossed is None:
+        number_of_cells_crossed = number_of_cells
+    
+    whole_cells = min(int(number_of_cells_crossed), number_of_cells)
+    partial_cell = number_of_cells_crossed - whole_cells
+    source_cells = source_cells[:whole_cells + 1]
+    d_optical_depth_cells = d_optical_depth_cells[:whole_cells + 1].copy()
+    if whole_cells < number_of_cells:
+        d_optical_depth_cells[-1] *= partial_cell
+    
+    optical_depth_from_start = np.cumsum(d_optical_depth_cells[::-1])[::-1]
+    optical_depth_after = np.append(optical_depth_from_start[1:], 0.0)
+    
+    total_optical_depth = optical_depth_from_start[0] if len(optical_depth_from_start) else 0.0
+    intensity = (initial_intensity * np.exp(-total_optical_depth)
+                 + np.sum(source_cells * (np.exp(-optical_depth_after) - np.exp(-optical_depth_from_start))))
+    return float(intensity)
+
+def specific_intensity_calculator_batch(initial_intensity_array, source_function_array,
+                                        cross_section_array, density, depth, method="euler",
+                                        number_of_steps=100000, progress_callback=None):
+    """
+    Calculates the final specific intensity of light passing through an object
+    for many frequency channels at once. Every channel takes the same steps as
+    specific_intensity_calculator, so the results match calling it once per channel.
+    
+    params:
+    initial_intensity_array (array or float): specific radiative intensity entering the object, per channel
+    source_function_array (array or float): radiative source function of the object, per channel
+    cross_section_array (array or float): cross section of interactions in the object in cm^2, per channel
+    density (float): density of the object in cm^-3
+    depth (float): distance light passes through in object in parsec
+    method (str): "euler" or "exact", see specific_intensity_calculator
+    number_of_steps (int): number of steps taken by the "euler" method
+    progress_callback (callable): see specific_intensity_calculator
+    
+    returns:
+    final_intensity_array (numpy array): specific intensity leaving the object, per channel
     """
-    number_of_steps = 100000
     converted_depth = convert_parsec_to_cm(depth)
     step_size = converted_depth / number_of_steps
     
-    d_optical_depth = cross_section * density * step_size
-    intensity_list = [initial_intensity]
-    for step in range(0, number_of_steps):
-        current_intensity = intensity_list[step]
-        d_intensity = (source_function - current_intensity) * d_optical_depth
+    cross_section_array = np.asarray(cross_section_array, dtype=float)
+    initial_intensity_array = np.asarray(initial_intensity_array, dtype=float)
+    source_function_array = np.asarray(source_function_array, dtype=float)
+    
+    if method == "exact":
+        optical_depth = cross_section_array * density * converted_depth
+        return source_function_array + (initial_intensity_array - source_function_array) * np.exp(-optical_depth)
+    elif method != "euler":
+        raise ValueError(f"Unknown method '{method}', expected 'euler' or 'exact'")
+    
+    d_optical_depth = cross_section_array * density * step_size
+    initial_intensity_array, source_function_array, d_optical_depth = np.broadcast_arrays(
+        initial_intensity_array, source_function_array, d_optical_depth)
+    
+    intensity_array = initial_intensity_array.copy()
+    d_intensity = np.empty_like(intensity_array)
+    with instrumentation.span("specific_intensity_calculator_batch.euler") as run_span:
+        for step in range(1, number_of_steps + 1):
+            np.subtract(source_function_array, intensity_array, out=d_intensity)
+            d_intensity *= d_optical_depth
+            intensity_array += d_intensity
+            if progress_callback is not None and step % PROGRESS_INTERVAL == 0:
+                progress_callback(step / number_of_steps)
+        #channel steps, so the rate is comparable between batch sizes
+        run_span.add_steps(number_of_steps * intensity_array.size)
+    return intensity_array
 
-        new_intensity = current_intensity + d_intensity
+class RadiativeTransferCache:
+    """
+    Least recently used cache of solver results, so repeated scenarios
+    are only calculated once. Results are stored read-only. The cache can be
+    shared with BackgroundCalculation worker threads.
+    """
+    
+    def __init__(self, max_size=32):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
         
-        intensity_list.append(new_intensity)
-    return intensity_list
+    def get_or_calculate(self, key, calculate):
+        """
+        Returns the cached result for key, or calls calculate() and caches
+        its result, evicting the least recently used entry if the cache is full
+        """
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                self.results.move_to_end(key)
+                return self.results[key]
+            self.misses += 1
+        
+        result = calculate()
+        if isinstance(result, np.ndarray):
+            result.flags.writeable = False
+        with self.lock:
+            self.results[key] = result
+            if len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+        return result
+    
+    def clear(self):
+        """Empties the cache and resets the counters"""
+        with self.lock:
+            self.results.clear()
+            self.hits = 0
+            self.misses = 0
+        
+    def __len__(self):
+        return len(self.results)
+    
+    def __repr__(self):
+        return (f"RadiativeTransferCache(size={len(self)}/{self.max_size}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+def radiative_transfer_cache_key(initial_intensity, source_function, cross_section_array,
+                                 density, depth, number_of_steps, method):
+    """
+    Builds a hashable cache key from solver inputs. The cross section array
+    is represented by a hash of its values.
+    """
+    cross_section_array = np.ascontiguousarray(cross_section_array, dtype=float)
+    cross_section_hash = hashlib.sha1(cross_section_array.tobytes()).hexdigest()
+    return (float(initial_intensity), float(source_function), cross_section_hash,
+            cross_section_array.shape, float(density), float(depth), number_of_steps, method)
+
+intensity_cache = RadiativeTransferCache(max_size=32)
+
+@instrumentation.timed("final_intensity_list_cached")
+def final_intensity_list_cached(initial_intensity, source_function, cross_section_array, density, depth,
+                                method="euler", number_of_steps=100000, cache=intensity_cache,
+                                progress_callback=None):
+    """
+    Calculates the final specific intensity of every frequency channel with
+    specific_intensity_calculator_batch, reusing the result of an earlier
+    call with the same inputs if the cache still holds it
+    
+    params:
+    (same as specific_intensity_calculator_batch, with a scalar initial intensity and source function)
+    cache (RadiativeTransferCache): cache to look the result up in
+    progress_callback (callable): see specific_intensity_calculator, only called on a cache miss
+    
+    returns:
+    final_intensity_array (numpy array): read-only specific intensity leaving the object, per channel
+    """
+    key = radiative_transfer_cache_key(initial_intensity, source_function, cross_section_array,
+                                       density, depth, number_of_steps, method)
+    return cache.get_or_calculate(key, lambda: specific_intensity_calculator_batch(initial_intensity,
+                                                                                   source_function,
+                                                                                   cross_section_array,
+                                                                                   density, depth,
+                                                                                   method=method,
+                                                                                   number_of_steps=number_of_steps,
+                                                                                   progress_callback=progress_callback))
+
+class BackgroundCalculation:
+    """
+    Runs a calculation in a worker thread so the Tk window stays responsive.
+    Progress and the result are passed back through a queue that the Tk event
+    loop polls with after(), so on_progress and on_done always run on the Tk thread.
+    """
+    
+    def __init__(self, window, calculate, on_done, on_progress=None, poll_interval=50):
+        """
+        params:
+        window (tk.Tk): window whose event loop receives the results
+        calculate (callable): called in the worker thread with a progress_callback
+                              to pass on to the solver, returns the result
+        on_done (callable): called with the result when the calculation finishes
+        on_progress (callable): called with the fraction done, or with None when
+                                the calculation is cancelled or fails
+        poll_interval (int): milliseconds between checks of the queue
+        """
+        self.window = window
+        self.calculate = calculate
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.poll_interval = poll_interval
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
+        self.finished = False
+        
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.window.after(self.poll_interval, self.poll)
+        
+    def report_progress(self, fraction):
+        if self.cancel_event.is_set():
+            raise CalculationCancelled()
+        self.messages.put(("progress", fraction))
+        
+    def run(self):
+        try:
+            result = self.calculate(self.report_progress)
+        except CalculationCancelled:
+            self.messages.put(("cancelled", None))
+        except Exception as error:
+            self.messages.put(("error", error))
+        else:
+            self.messages.put(("done", result))
+            
+    def poll(self):
+        latest_progress = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            
+            if kind == "progress":
+                latest_progress = value
+                continue
+            
+            self.finished = True
+            if self.cancel_event.is_set() or kind == "cancelled":
+                return
+            if kind == "error":
+                if self.on_progress is not None:
+                    self.on_progress(None)
+                raise value
+            self.on_done(value)
+            return
+        
+        if latest_progress is not None and self.on_progress is not None and not self.cancel_event.is_set():
+            self.on_progress(latest_progress)
+        self.window.after(self.poll_interval, self.poll)
+        
+    def cancel(self):
+        self.cancel_event.set()
+
+def start_background_calculation(jobs, window, lbl_progress, calculate, on_done):
+    """
+    Starts a BackgroundCalculation for a window, cancelling the window's
+    previous one if it has not finished, and shows its progress in lbl_progress
+    
+    params:
+    jobs {str: BackgroundCalculation}: holds the window's current calculation under "current"
+    window (tk.Tk): window whose event loop receives the results
+    lbl_progress (tk.Label): label to show the progress in
+    calculate (callable): see BackgroundCalculation
+    on_done (callable): see BackgroundCalculation
+    """
+    cancel_background_calculation(jobs, lbl_progress)
+    
+    def show_progress(fraction):
+        lbl_progress["text"] = "Failed" if fraction is None else f"Calculating... {fraction:.0%}"
+        
+    def finish(result):
+        lbl_progress["text"] = ""
+        on_done(result)
+    
+    lbl_progress["text"] = "Calculating..."
+    jobs["current"] = BackgroundCalculation(window, calculate, finish, on_progress=show_progress)
+
+def cancel_background_calculation(jobs, lbl_progress):
+    current_job = jobs.get("current")
+    if current_job is not None and not current_job.finished:
+        current_job.cancel()
+        lbl_progress["text"] = "Cancelled"
+    jobs["current"] = None
 
 def generate_cross_section_list_gaussian(frequency_list, gaussian_maximum_frequency,
                                     gaussian_maximum_cross_section, gaussian_width):
+    """
+    Calculates a Gaussian cross section at every frequency in one array operation.
+    See line_profiles.py for Lorentzian and Voigt profiles and sums of many lines.
     
-    gaussian_cross_section_list = []
+    params:
+    frequency_list [float]: frequencies in Hz
+    gaussian_maximum_frequency (float): frequency of the peak in Hz
+    gaussian_maximum_cross_section (float): cross section at the peak
+    gaussian_width (float): standard deviation of the Gaussian in Hz
     
-    for frequency in frequency_list:
-        cross_section = calculate_gaussian(frequency,
-                                          gaussian_maximum_cross_section,
-                                          gaussian_maximum_frequency,
-                                          gaussian_width)
-        
-        gaussian_cross_section_list.append(cross_section)
+    returns:
+    gaussian_cross_section_list (numpy array): cross section at each frequency
+    """
+    
+    gaussian_cross_section_list = gaussian_profile(frequency_list,
+                                                   gaussian_maximum_frequency,
+                                                   gaussian_maximum_cross_section,
+                                                   gaussian_width)
         
     return gaussian_cross_section_list
 
@@ -107,6 +686,7 @@ def calculate_gaussian(x, a, b, c):
     return a * math.exp(-((x-b)**2)/(2*c**2))
 
 def main_menu():
+    load_gui_modules()
     
     window_main_menu = tk.Tk()
     window_main_menu.lift()
@@ -146,6 +726,7 @@ def main_menu():
     window_main_menu.mainloop()
 
 def problem_1():
+    load_gui_modules()
     window_problem_1=tk.Tk()
     window_problem_1.lift()
     
@@ -309,6 +890,7 @@ def depress_button(button):
     button.config(relief=tk.SUNKEN)
     
 def problem_2():
+    load_gui_modules()
     window_problem_1=tk.Tk()
     window_problem_1.lift()
     
@@ -482,7 +1064,7 @@ def problem_2():
     frm_calculations.grid(row=2, column=0)
     
     lbl_final_intensity = tk.Label(master=frm_calculations,
-                                  text=f"Final Intensity (W/cm^2) = {specific_intensity_calculator(1,1,1E-19,1,1)[-1]}")
+                                  text=f"Final Intensity (W/cm^2) = {specific_intensity_calculator(1,1,1E-19,1,1,output='final')[-1]}")
     lbl_final_intensity.grid(row=0, column=0)
    
     #start buttons code
@@ -490,15 +1072,24 @@ def problem_2():
                               command=lambda:[window_problem_1.destroy(), main_menu()])
     btn_main_menu.grid(row=3, column=1)
     
+    lbl_progress = tk.Label(master=frm_calculations, text="")
+    lbl_progress.grid(row=1, column=0)
+    
+    jobs = {}
     btn_calculate = tk.Button(master=window_problem_1, text="Calculate",
                               command=lambda:[calculate_problem_2(lbl_final_intensity,
                                                                   scl_depth, lbl_depth_multiplier,
                                                                   scl_density, lbl_density_multiplier,
                                                                   scl_cross, lbl_cross_multiplier,
                                                                   scl_intensity, lbl_intensity_multiplier,
-                                                                  scl_source, lbl_source_multiplier)])
+                                                                  scl_source, lbl_source_multiplier,
+                                                                  window_problem_1, lbl_progress, jobs)])
     btn_calculate.grid(row=3, column=0)
     
+    btn_cancel = tk.Button(master=window_problem_1, text="Cancel",
+                           command=lambda:[cancel_background_calculation(jobs, lbl_progress)])
+    btn_cancel.grid(row=3, column=2)
+    
     window_problem_1.mainloop()
     
 def calculate_problem_2(lbl_final_intensity,
@@ -506,7 +1097,8 @@ def calculate_problem_2(lbl_final_intensity,
                         scl_density, lbl_density_multiplier,
                         scl_cross, lbl_cross_multiplier,
                         scl_intensity, lbl_intensity_multiplier,
-                        scl_source, lbl_source_multiplier):
+                        scl_source, lbl_source_multiplier,
+                        window, lbl_progress, jobs):
     
     depth = scl_depth.get() * float(lbl_depth_multiplier["text"]) 
     density = scl_density.get() * float(lbl_density_multiplier["text"]) 
@@ -514,12 +1106,18 @@ def calculate_problem_2(lbl_final_intensity,
     intensity = scl_intensity.get() * float(lbl_intensity_multiplier["text"]) 
     source = scl_source.get() * float(lbl_source_multiplier["text"]) 
     
-    final_intensity = specific_intensity_calculator(intensity, source, cross, density, depth)
+    def calculate(progress_callback):
+        return specific_intensity_calculator(intensity, source, cross, density, depth, output="final",
+                                             progress_callback=progress_callback)
+    
+    def show_final_intensity(final_intensity):
+        lbl_final_intensity["text"] = f"Final Intensity (W/cm^2) = {final_intensity[-1]}"
     
-    lbl_final_intensity["text"] = f"Final Intensity (W/cm^2) = {final_intensity[-1]}"
+    start_background_calculation(jobs, window, lbl_progress, calculate, show_final_intensity)
         
     
 def problem_3():
+    load_gui_modules()
     frequency_list = []
     
     for i in range(0,100):
@@ -603,9 +1201,11 @@ def calculate_problem_3(frequency_list, scl_cross, scl_gauss_max, scl_gauss_widt
     ax.set_ylabel("Cross Section (cm^2)")
     ax.set_xlabel("Frequency (Hz)")
     ax.plot(frequency_list, cross_list)
-    canvas.draw()
+    with instrumentation.span("problem_3.draw"):
+        canvas.draw()
     
 def problem_4():
+    load_gui_modules()
     depth = 1
     density = 1
     frequency_list = []
@@ -613,9 +1213,7 @@ def problem_4():
     for i in range(0,100):
         frequency_list.append(i)
     
-    low_cross_list = make_low_cross_list(frequency_list, depth, density)
-    high_cross_list = make_high_cross_list(frequency_list, depth, density)
-    gauss_cross_list = generate_cross_section_list_gaussian(frequency_list, 0, high_cross_list[0], 10) 
+    cross_lists = make_problem_4_cross_lists(frequency_list, depth, density)
     fig = Figure(figsize=(6,6))
  
     window_problem_4=tk.Tk()
@@ -628,6 +1226,10 @@ def problem_4():
     lbl_problem_4 = tk.Label(master=window_problem_4, text = """Press a Button to change the plot parameters! Loading takes a few seconds!""")
     lbl_problem_4.grid(row=0, column=0)
     
+    lbl_progress = tk.Label(master=window_problem_4, text="")
+    lbl_progress.grid(row=3, column=0)
+    jobs = {}
+    
     canvas = FigureCanvasTkAgg(fig, master=window_problem_4)
     canvas.draw()
     canvas.get_tk_widget().grid(row=1, column=0)
@@ -635,56 +1237,44 @@ def problem_4():
     frm_button = tk.Frame(master=window_problem_4)
     frm_button.grid(row=2, column=0)
     
-    btn_a = tk.Button(master=frm_button, text="   A   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  low_cross_list,
-                                                                  0, 1, depth, density,
-                                                                  fig, canvas)])
-    btn_a.grid(row=0, column=0)
-    
-    btn_b = tk.Button(master=frm_button, text="   B   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  low_cross_list,
-                                                                  10, 1, depth, density,
-                                                                  fig, canvas)])
-    btn_b.grid(row=0, column=1)
-    
-    btn_c = tk.Button(master=frm_button, text="   C   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  low_cross_list,
-                                                                  1, 10, depth, density,
-                                                                  fig, canvas)])
-    btn_c.grid(row=0, column=2)
-    
-    btn_d = tk.Button(master=frm_button, text="   D   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  high_cross_list,
-                                                                  10, 1, depth, density,
-                                                                  fig, canvas)])
-    btn_d.grid(row=0, column=3)
-    
-    btn_e = tk.Button(master=frm_button, text="   E   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  gauss_cross_list,
-                                                                  1, 10, depth, density,
-                                                                  fig, canvas)])
-    btn_e.grid(row=0, column=4)
-    
-    btn_f = tk.Button(master=frm_button, text="   F   ",
-                              command=lambda:[calculate_problem_4(frequency_list, 
-                                                                  gauss_cross_list,
-                                                                  10, 1, depth, density,
-                                                                  fig, canvas)])
-    btn_f.grid(row=0, column=5)
-    
+    for column, (label, (cross_name, intensity, source)) in enumerate(PROBLEM_4_SCENARIOS.items()):
+        btn_scenario = tk.Button(master=frm_button, text=f"   {label}   ",
+                                 command=lambda cross_name=cross_name, intensity=intensity, source=source:
+                                     [calculate_problem_4(frequency_list,
+                                                          cross_lists[cross_name],
+                                                          intensity, source, depth, density,
+                                                          fig, canvas,
+                                                          window_problem_4, lbl_progress, jobs)])
+        btn_scenario.grid(row=0, column=column)
     
+    btn_cancel = tk.Button(master=frm_button, text="Cancel",
+                           command=lambda:[cancel_background_calculation(jobs, lbl_progress)])
+    btn_cancel.grid(row=0, column=len(PROBLEM_4_SCENARIOS))
     
     btn_main_menu = tk.Button(master=frm_button, text="Main Menu",
-                              command=lambda:[window_problem_4.destroy(), main_menu()])
-    btn_main_menu.grid(row=0, column=6)
+                              command=lambda:[cancel_background_calculation(jobs, lbl_progress),
+                                              window_problem_4.destroy(), main_menu()])
+    btn_main_menu.grid(row=0, column=len(PROBLEM_4_SCENARIOS) + 1)
     
     window_problem_4.mainloop()
 
+def make_problem_4_cross_lists(frequency_list, depth, density):
+    """
+    Makes the cross section lists used by the problem 4 scenarios
+    
+    params:
+    frequency_list [float]: frequencies in Hz
+    depth (float): Depth of object in parsecs
+    density (float): density of object in cm^-3
+    
+    returns:
+    cross_lists {str: [float]}: "low", "high" and "gauss" cross section lists
+    """
+    low_cross_list = make_low_cross_list(frequency_list, depth, density)
+    high_cross_list = make_high_cross_list(frequency_list, depth, density)
+    gauss_cross_list = generate_cross_section_list_gaussian(frequency_list, 0, high_cross_list[0], 10)
+    return {"low": low_cross_list, "high": high_cross_list, "gauss": gauss_cross_list}
+
 def make_low_cross_list(frequency_list, depth, density):
     new_cross_list = []
     for frequency in frequency_list:
@@ -701,20 +1291,24 @@ def make_high_cross_list(frequency_list, depth, density):
     
     return new_cross_list
     
-def calculate_problem_4(frequency_list, cross_list, intensity, source, depth, density, fig, canvas):
-    final_intensity_list = []
+def calculate_problem_4(frequency_list, cross_list, intensity, source, depth, density, fig, canvas,
+                        window, lbl_progress, jobs):
     
-    for i in range (0, len(frequency_list)):
-        final_intensity = specific_intensity_calculator(intensity, source, cross_list[i], density, depth)[-1]
-        final_intensity_list.append(final_intensity)
+    def calculate(progress_callback):
+        return final_intensity_list_cached(intensity, source, cross_list, density, depth,
+                                           progress_callback=progress_callback)
     
-    fig.clear()
-    ax = fig.add_subplot(111)
-    ax.set_title(f"Intensity = {intensity}, Source = {source}")
-    ax.set_ylabel("Specific Intensity (at D)")
-    ax.set_xlabel("Frequency (Hz)")
-    ax.plot(frequency_list, final_intensity_list)
-    canvas.draw() 
+    def plot_final_intensities(final_intensity_list):
+        fig.clear()
+        ax = fig.add_subplot(111)
+        ax.set_title(f"Intensity = {intensity}, Source = {source}")
+        ax.set_ylabel("Specific Intensity (at D)")
+        ax.set_xlabel("Frequency (Hz)")
+        ax.plot(frequency_list, final_intensity_list)
+        with instrumentation.span("problem_4.draw"):
+            canvas.draw()
+    
+    start_background_calculation(jobs, window, lbl_progress, calculate, plot_final_intensities)
     
 if __name__ == "__main__":
     main_menu()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Benchmark suite for the HW2 radiative transfer kernels. Every case records
+wall time, peak memory and the error against the analytic solution
+I = S + (I0 - S) * exp(-optical_depth), over step counts, frequency channel
+counts and optical depth regimes. Results are saved as JSON so runs on
+different commits can be compared, and any new fast path should be added
+here and beat the cases it replaces.
+
+Run as "python benchmark_HW2.py" from the HW2 folder, see --help for options.
+"--channel-scaling" prints the per-frequency loop against the batched solver."""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+from PHYS239_HW2 import (convert_parsec_to_cm,
+                         specific_intensity_calculator,
+                         specific_intensity_calculator_batch,
+                         generate_cross_section_list_gaussian)
+
+INITIAL_INTENSITY = 10
+SOURCE_FUNCTION = 1
+DENSITY = 1
+DEPTH = 1
+
+OPTICAL_DEPTH_REGIMES = {"thin": 1E-2, "moderate": 1, "thick": 1E2}
+
+#steps used by the batched Euler cases, so channel counts up to 10^5 stay affordable
+BATCH_NUMBER_OF_STEPS = 1000
+
+def analytic_intensity(optical_depth):
+    return SOURCE_FUNCTION + (INITIAL_INTENSITY - SOURCE_FUNCTION) * np.exp(-np.asarray(optical_depth))
+
+def cross_section_for(optical_depth):
+    return np.asarray(optical_depth) / (convert_parsec_to_cm(DEPTH) * DENSITY)
+
+def channel_optical_depths(number_of_channels, optical_depth):
+    #spread the channels over a decade around the regime's optical depth
+    return optical_depth * np.logspace(-0.5, 0.5, number_of_channels)
+
+def euler_profile_case(number_of_steps, optical_depth):
+    cross_section = cross_section_for(optical_depth)
+    final_intensity = specific_intensity_calculator(INITIAL_INTENSITY, SOURCE_FUNCTION, cross_section,
+                                                    DENSITY, DEPTH, number_of_steps=number_of_steps)[-1]
+    return final_intensity, analytic_intensity(optical_depth)
+
+def euler_final_case(number_of_steps, optical_depth):
+    cross_section = cross_section_for(optical_depth)
+    final_intensity = specific_intensity_calculator(INITIAL_INTENSITY, SOURCE_FUNCTION, cross_section,
+                                                    DENSITY, DEPTH, output="final",
+                                                    number_of_steps=number_of_steps)[-1]
+    return final_intensity, analytic_intensity(optical_depth)
+
+def exact_case(optical_depth):
+    cross_section = cross_section_for(optical_depth)
+    final_intensity = specific_intensity_calculator(INITIAL_INTENSITY, SOURCE_FUNCTION, cross_section,
+                                                    DENSITY, DEPTH, method="exact")[-1]
+    return final_intensity, analytic_intensity(optical_depth)
+
+def problem_4_loop_case(number_of_channels, optical_depth):
+    optical_depth_list = channel_optical_depths(number_of_channels, optical_depth)
+    final_intensity_list = [specific_intensity_calculator(INITIAL_INTENSITY, SOURCE_FUNCTION, cross_section,
+                                                          DENSITY, DEPTH,
+                                                          number_of_steps=BATCH_NUMBER_OF_STEPS)[-1]
+                            for cross_section in cross_section_for(optical_depth_list)]
+    return np.array(final_intensity_list), analytic_intensity(optical_depth_list)
+
+def batch_euler_case(number_of_channels, optical_depth):
+    optical_depth_list = channel_optical_depths(number_of_channels, optical_depth)
+    final_intensity_array = specific_intensity_calculator_batch(INITIAL_INTENSITY, SOURCE_FUNCTION,
+                                                                cross_section_for(optical_depth_list),
+                                                                DENSITY, DEPTH,
+                                                                number_of_steps=BATCH_NUMBER_OF_STEPS)
+    return final_intensity_array, analytic_intensity(optical_depth_list)
+
+def batch_exact_case(number_of_channels, optical_depth):
+    optical_depth_list = channel_optical_depths(number_of_channels, optical_depth)
+    final_intensity_array = specific_intensity_calculator_batch(INITIAL_INTENSITY, SOURCE_FUNCTION,
+                                                                cross_section_for(optical_depth_list),
+                                                                DENSITY, DEPTH, method="exact")
+    return final_intensity_array, analytic_intensity(optical_depth_list)
+
+def gaussian_cross_section_case(number_of_channels):
+    frequency_list = np.arange(number_of_channels)
+    generate_cross_section_list_gaussian(frequency_list, number_of_channels / 2, 1, number_of_channels / 10)
+    return None, None
+
+def measure(case, parameters, repeats):
+    """
+    Times a benchmark case and measures its peak memory and accuracy
+
+    params:
+    case (callable): benchmark case, returns (result, analytic result) or (None, None)
+    parameters (dict): keyword arguments of the case
+    repeats (int): number of timed runs, the fastest is kept
+
+    returns:
+    measurement (dict): wall_time in seconds, peak_memory in bytes and
+                        max_relative_error against the analytic solution
+    """
+    wall_time_list = []
+    for repeat in range(repeats):
+        start_time = time.perf_counter()
+        result, analytic_result = case(**parameters)
+        wall_time_list.append(time.perf_counter() - start_time)
+
+    #memory is measured in a separate run because tracing slows the kernels down
+    tracemalloc.start()
+    case(**parameters)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    max_relative_error = None
+    if result is not None:
+        max_relative_error = float(np.max(np.abs(np.asarray(result) - analytic_result) / np.abs(analytic_result)))
+
+    return {"wall_time": min(wall_time_list), "peak_memory": peak_memory,
+            "max_relative_error": max_relative_error}
+
+def build_cases(step_counts, channel_counts, max_profile_steps, max_loop_channels):
+    """
+    Lists every (kernel name, case, parameters) combination of the suite
+    """
+    cases = []
+    for regime, optical_depth in OPTICAL_DEPTH_REGIMES.items():
+        for number_of_steps in step_counts:
+            if number_of_steps <= max_profile_steps:
+                cases.append(("euler_profile", euler_profile_case,
+                              {"number_of_steps": number_of_steps, "optical_depth": optical_depth}, regime))
+            cases.append(("euler_final", euler_final_case,
+                          {"number_of_steps": number_of_steps, "optical_depth": optical_depth}, regime))
+        cases.append(("exact", exact_case, {"optical_depth": optical_depth}, regime))
+
+        for number_of_channels in channel_counts:
+            if number_of_channels <= max_loop_channels:
+                cases.append(("problem_4_loop", problem_4_loop_case,
+                              {"number_of_channels": number_of_channels, "optical_depth": optical_depth}, regime))
+            cases.append(("batch_euler", batch_euler_case,
+                          {"number_of_channels": number_of_channels, "optical_depth": optical_depth}, regime))
+            cases.append(("batch_exact", batch_exact_case,
+                          {"number_of_channels": number_of_channels, "optical_depth": optical_depth}, regime))
+
+    for number_of_channels in channel_counts:
+        cases.append(("gaussian_cross_sections", gaussian_cross_section_case,
+                      {"number_of_channels": number_of_channels}, None))
+    return cases
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(step_counts, channel_counts, repeats=3, max_profile_steps=10**6, max_loop_channels=100,
+              verbose=True):
+    """
+    Runs every benchmark case
+
+    params:
+    step_counts [int]: Euler step counts for the single-frequency cases
+    channel_counts [int]: frequency channel counts for the multi-frequency cases
+    repeats (int): number of timed runs per case
+    max_profile_steps (int): largest step count that keeps the whole profile in memory
+    max_loop_channels (int): largest channel count timed with the per-frequency loop
+    verbose (bool): print each case as it finishes
+
+    returns:
+    report (dict): run metadata and a list of results, ready to be saved as JSON
+    """
+    results = []
+    for kernel, case, parameters, regime in build_cases(step_counts, channel_counts,
+                                                        max_profile_steps, max_loop_channels):
+        measurement = measure(case, parameters, repeats)
+        result = dict(kernel=kernel, regime=regime, **parameters, **measurement)
+        results.append(result)
+        if verbose:
+            print(format_result(result))
+
+    return {"commit": get_git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "batch_number_of_steps": BATCH_NUMBER_OF_STEPS,
+            "results": results}
+
+def result_key(result):
+    return (result["kernel"], result["regime"], result.get("number_of_steps"), result.get("number_of_channels"))
+
+def format_result(result):
+    size = (f"steps={result['number_of_steps']}" if "number_of_steps" in result
+            else f"channels={result['number_of_channels']}" if "number_of_channels" in result else "")
+    error = "-" if result["max_relative_error"] is None else f"{result['max_relative_error']:.2e}"
+    return (f"{result['kernel']:<24} {str(result['regime']):<9} {size:<18} "
+            f"{result['wall_time']:>10.4f} s {result['peak_memory'] / 2**20:>10.2f} MiB  error {error}")
+
+def compare_reports(old_report, new_report):
+    """
+    Prints the wall time and peak memory ratio new / old of every case found in both reports
+    """
+    old_results = {result_key(result): result for result in old_report["results"]}
+    print(f"Comparing {new_report.get('commit')} against {old_report.get('commit')} (ratio new / old)")
+    for result in new_report["results"]:
+        old_result = old_results.get(result_key(result))
+        if old_result is None:
+            continue
+        time_ratio = result["wall_time"] / old_result["wall_time"]
+        memory_ratio = result["peak_memory"] / max(old_result["peak_memory"], 1)
+        print(f"{format_result(result)}   time x{time_ratio:.2f}  memory x{memory_ratio:.2f}")
+
+def time_per_frequency_loop(cross_list, intensity, source, density, depth):
+    """
+    Times the original problem 4 approach of one solver call per frequency
+
+    params:
+    cross_list [float]: cross section of each frequency channel in cm^2
+    intensity (float): specific radiative intensity entering the object
+    source (float): radiative source function of the object
+    density (float): density of the object in cm^-3
+    depth (float): distance light passes through in object in parsec
+
+    returns:
+    elapsed_time (float): wall time in seconds
+    final_intensity_list [float]: final intensity of each frequency channel
+    """
+    start_time = time.perf_counter()
+    final_intensity_list = []
+    for cross_section in cross_list:
+        final_intensity = specific_intensity_calculator(intensity, source, cross_section, density, depth)[-1]
+        final_intensity_list.append(final_intensity)
+    elapsed_time = time.perf_counter() - start_time
+    return elapsed_time, final_intensity_list
+
+def time_batch(cross_list, intensity, source, density, depth):
+    """
+    Times the batched solver advancing every frequency channel together
+
+    params:
+    (same as time_per_frequency_loop)
+
+    returns:
+    elapsed_time (float): wall time in seconds
+    final_intensity_array (numpy array): final intensity of each frequency channel
+    """
+    start_time = time.perf_counter()
+    final_intensity_array = specific_intensity_calculator_batch(intensity, source, cross_list, density, depth)
+    elapsed_time = time.perf_counter() - start_time
+    return elapsed_time, final_intensity_array
+
+def run_channel_scaling(channel_counts, max_reference_channels, intensity=10, source=1,
+                        density=1, depth=1):
+    """
+    Benchmarks both solvers over a list of channel counts and prints a table
+
+    params:
+    channel_counts [int]: numbers of frequency channels to time
+    max_reference_channels (int): largest channel count the per-frequency loop is timed at
+    intensity (float): specific radiative intensity entering the object
+    source (float): radiative source function of the object
+    density (float): density of the object in cm^-3
+    depth (float): distance light passes through in object in parsec
+    """
+    print(f"{'channels':>10} {'loop (s)':>12} {'batch (s)':>12} {'speedup':>10} {'max |diff|':>12}")
+    for number_of_channels in channel_counts:
+        optical_depth_list = np.logspace(-2, 2, number_of_channels)
+        cross_list = optical_depth_list / (convert_parsec_to_cm(depth) * density)
+
+        batch_time, batch_result = time_batch(cross_list, intensity, source, density, depth)
+
+        if number_of_channels <= max_reference_channels:
+            loop_time, loop_result = time_per_frequency_loop(cross_list, intensity, source, density, depth)
+            max_difference = np.max(np.abs(np.asarray(loop_result) - batch_result))
+            print(f"{number_of_channels:>10} {loop_time:>12.3f} {batch_time:>12.3f} "
+                  f"{loop_time / batch_time:>10.1f} {max_difference:>12.3e}")
+        else:
+            print(f"{number_of_channels:>10} {'-':>12} {batch_time:>12.3f} {'-':>10} {'-':>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HW2 radiative transfer kernels")
+    parser.add_argument("--steps", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6, 10**7],
+                        help="Euler step counts to benchmark")
+    parser.add_argument("--channels", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000],
+                        help="frequency channel counts to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--quick", action="store_true",
+                        help="only run step counts up to 10^5 and channel counts up to 10^3")
+    parser.add_argument("--output", help="JSON file to save the results to, "
+                                         "defaults to benchmark_results/HW2_<commit>_<date>.json")
+    parser.add_argument("--compare", help="earlier JSON results to compare this run against")
+    parser.add_argument("--channel-scaling", action="store_true",
+                        help="only print the per-frequency loop against the batched solver")
+    parser.add_argument("--max-reference-channels", type=int, default=100,
+                        help="largest channel count to also time with the per-frequency loop")
+    args = parser.parse_args()
+
+    if args.channel_scaling:
+        run_channel_scaling(args.channels, args.max_reference_channels)
+    else:
+        step_counts = [steps for steps in args.steps if not args.quick or steps <= 10**5]
+        channel_counts = [channels for channels in args.channels if not args.quick or channels <= 10**3]
+        report = run_suite(step_counts, channel_counts, repeats=args.repeats,
+                           max_loop_channels=args.max_reference_channels)
+
+        output_path = args.output
+        if output_path is None:
+            date = report["date"].replace(":", "-")
+            output_path = os.path.join("benchmark_results", f"HW2_{report['commit']}_{date}.json")
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Saved results to {output_path}")
+
+        if args.compare:
+            with open(args.compare) as old_report_file:
+                compare_reports(json.load(old_report_file), report)
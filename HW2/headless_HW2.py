@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Runs the HW2 problem 1-4 calculations without opening a window and writes
+the numbers (as JSON) and plots (as PNG) to files. Neither tkinter nor the Tk
+matplotlib backend is imported, so this works on machines without a display.
+
+Examples:
+python headless_HW2.py problem2 --depth 10 --density 100 --cross-section 1e-19
+python headless_HW2.py problem4 --scenarios A D F --output-dir results
+python headless_HW2.py --config runs.json --output-dir results
+python headless_HW2.py --profile profile.json problem2 --number-of-steps 1000000
+
+A config file holds a list of runs, each with the same keys as the command line options:
+{"runs": [{"problem": "problem1", "depth": 1, "density": 10, "optical_depth": 1},
+          {"problem": "problem4", "scenarios": ["A", "B"]}]}"""
+
+import argparse
+import json
+import os
+import numpy as np
+
+import instrumentation
+from PHYS239_HW2 import (PROBLEM_4_SCENARIOS,
+                         column_density_calculator,
+                         cross_section_calculator,
+                         specific_intensity_calculator,
+                         generate_cross_section_list_gaussian,
+                         make_problem_4_cross_lists,
+                         final_intensity_list_cached)
+
+PROBLEM_DEFAULTS = {"problem1": {"depth": 1, "density": 1, "optical_depth": 1},
+                    "problem2": {"depth": 1, "density": 1, "cross_section": 1E-19,
+                                 "intensity": 1, "source": 1, "method": "euler",
+                                 "number_of_steps": 100000, "decimation": 1000},
+                    "problem3": {"max_cross_section": 1, "max_frequency": 1, "width": 1,
+                                 "number_of_frequencies": 100},
+                    "problem4": {"scenarios": list(PROBLEM_4_SCENARIOS), "depth": 1, "density": 1,
+                                 "method": "euler", "number_of_frequencies": 100}}
+
+def run_problem_1(depth, density, optical_depth):
+    column_density = column_density_calculator(depth, density)
+    cross_section = cross_section_calculator(optical_depth, depth, density)
+    return {"column_density": column_density, "cross_section": cross_section}, None
+
+def run_problem_2(depth, density, cross_section, intensity, source, method, number_of_steps, decimation):
+    #both curves end at the full depth, so their last point is the final intensity
+    if method == "euler":
+        intensity_list = specific_intensity_calculator(intensity, source, cross_section, density, depth,
+                                                       output="decimated", decimation=decimation,
+                                                       number_of_steps=number_of_steps)
+        step_list = list(range(0, number_of_steps + 1, decimation))
+        if step_list[-1] != number_of_steps:
+            step_list.append(number_of_steps)
+        depth_list = [step * depth / number_of_steps for step in step_list]
+    else:
+        depth_list = list(np.linspace(0, depth, 201))
+        intensity_list = specific_intensity_calculator(intensity, source, cross_section, density, depth,
+                                                       method="exact", depths=depth_list)
+    results = {"final_intensity": float(intensity_list[-1])}
+
+    plot = {"title": f"Intensity = {intensity}, Source = {source}",
+            "xlabel": "Depth (parsec)", "ylabel": "Specific Intensity (W/cm^2)",
+            "lines": [(depth_list, intensity_list, None)]}
+    return results, plot
+
+def run_problem_3(max_cross_section, max_frequency, width, number_of_frequencies):
+    frequency_list = np.arange(number_of_frequencies)
+    cross_list = generate_cross_section_list_gaussian(frequency_list, max_frequency, max_cross_section, width)
+    results = {"frequencies": frequency_list.tolist(), "cross_sections": np.asarray(cross_list).tolist()}
+    plot = {"title": "Gaussian Cross Section", "xlabel": "Frequency (Hz)",
+            "ylabel": "Cross Section (cm^2 * 10^-19)", "lines": [(frequency_list, cross_list, None)]}
+    return results, plot
+
+def run_problem_4(scenarios, depth, density, method, number_of_frequencies):
+    frequency_list = list(range(number_of_frequencies))
+    cross_lists = make_problem_4_cross_lists(frequency_list, depth, density)
+
+    results = {"frequencies": frequency_list}
+    lines = []
+    for label in scenarios:
+        if label not in PROBLEM_4_SCENARIOS:
+            raise ValueError(f"Unknown problem 4 scenario '{label}', expected one of {list(PROBLEM_4_SCENARIOS)}")
+        cross_name, intensity, source = PROBLEM_4_SCENARIOS[label]
+        final_intensity_list = final_intensity_list_cached(intensity, source, cross_lists[cross_name],
+                                                           density, depth, method=method)
+        results[label] = {"intensity": intensity, "source": source,
+                          "final_intensities": final_intensity_list.tolist()}
+        lines.append((frequency_list, final_intensity_list, f"{label}: Intensity = {intensity}, Source = {source}"))
+
+    plot = {"title": "Problem 4", "xlabel": "Frequency (Hz)",
+            "ylabel": "Specific Intensity (at D)", "lines": lines}
+    return results, plot
+
+PROBLEM_RUNNERS = {"problem1": run_problem_1,
+                   "problem2": run_problem_2,
+                   "problem3": run_problem_3,
+                   "problem4": run_problem_4}
+
+@instrumentation.timed("save_plot")
+def save_plot(plot, plot_path):
+    """
+    Draws a plot description returned by a run_problem function into a PNG file
+    with the non-interactive Agg backend
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(6,6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_title(plot["title"])
+    ax.set_xlabel(plot["xlabel"])
+    ax.set_ylabel(plot["ylabel"])
+    for x, y, label in plot["lines"]:
+        ax.plot(x, y, label=label)
+    if any(label is not None for _, _, label in plot["lines"]):
+        ax.legend()
+    fig.savefig(plot_path)
+
+def run(problem, output_dir, name=None, make_plots=True, **parameters):
+    """
+    Runs one problem and writes its results to "<name>.json" and "<name>.png"
+
+    params:
+    problem (str): "problem1", "problem2", "problem3" or "problem4"
+    output_dir (str): directory to write the files to
+    name (str): base name of the files, defaults to problem
+    make_plots (bool): also write the plot
+    **parameters: parameters of the problem, missing ones take the values in PROBLEM_DEFAULTS
+
+    returns:
+    results (dict): the numbers written to the JSON file
+    """
+    if problem not in PROBLEM_RUNNERS:
+        raise ValueError(f"Unknown problem '{problem}', expected one of {list(PROBLEM_RUNNERS)}")
+    unknown_parameters = set(parameters) - set(PROBLEM_DEFAULTS[problem])
+    if unknown_parameters:
+        raise ValueError(f"Unknown parameters for {problem}: {sorted(unknown_parameters)}")
+
+    full_parameters = dict(PROBLEM_DEFAULTS[problem], **parameters)
+    results, plot = PROBLEM_RUNNERS[problem](**full_parameters)
+
+    name = name or problem
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, f"{name}.json"), "w") as results_file:
+        json.dump({"problem": problem, "parameters": full_parameters, "results": results},
+                  results_file, indent=2)
+    if make_plots and plot is not None:
+        save_plot(plot, os.path.join(output_dir, f"{name}.png"))
+    return results
+
+def add_output_arguments(parser, with_defaults=True):
+    """
+    Adds the options that say where the results go. They are added to the main parser and
+    to every problem, so they work before or after the problem name; only the main parser
+    has defaults, so a problem does not overwrite an option given before its name.
+    """
+    defaults = {"output_dir": "hw2_output", "no_plots": False, "profile": None}
+    if not with_defaults:
+        defaults = dict.fromkeys(defaults, argparse.SUPPRESS)
+    parser.add_argument("--output-dir", default=defaults["output_dir"], help="directory to write results to")
+    parser.add_argument("--no-plots", action="store_true", default=defaults["no_plots"],
+                        help="only write the numbers")
+    parser.add_argument("--profile", default=defaults["profile"],
+                        help="write timings of the calculations and plots to this JSON file, "
+                             "in Chrome trace format if it ends in .trace.json")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the HW2 calculations without a GUI")
+    parser.add_argument("--config", help="JSON file with a list of runs")
+    add_output_arguments(parser)
+    subparsers = parser.add_subparsers(dest="problem")
+
+    problem_1_parser = subparsers.add_parser("problem1", help="column density and cross section")
+    problem_1_parser.add_argument("--depth", type=float, help="depth in parsec")
+    problem_1_parser.add_argument("--density", type=float, help="density in cm^-3")
+    problem_1_parser.add_argument("--optical-depth", type=float, help="optical depth")
+
+    problem_2_parser = subparsers.add_parser("problem2", help="final specific intensity")
+    problem_2_parser.add_argument("--depth", type=float, help="depth in parsec")
+    problem_2_parser.add_argument("--density", type=float, help="density in cm^-3")
+    problem_2_parser.add_argument("--cross-section", type=float, help="cross section in cm^2")
+    problem_2_parser.add_argument("--intensity", type=float, help="initial intensity in W/cm^2")
+    problem_2_parser.add_argument("--source", type=float, help="source function")
+    problem_2_parser.add_argument("--method", choices=["euler", "exact"], help="solver method")
+    problem_2_parser.add_argument("--number-of-steps", type=int, help="number of Euler steps")
+    problem_2_parser.add_argument("--decimation", type=int, help="Euler steps between plotted points")
+
+    problem_3_parser = subparsers.add_parser("problem3", help="Gaussian cross section")
+    problem_3_parser.add_argument("--max-cross-section", type=float, help="maximum cross section (cm^2 * 10^-19)")
+    problem_3_parser.add_argument("--max-frequency", type=float, help="frequency of the maximum in Hz")
+    problem_3_parser.add_argument("--width", type=float, help="Gaussian width in Hz")
+    problem_3_parser.add_argument("--number-of-frequencies", type=int, help="number of frequencies")
+
+    problem_4_parser = subparsers.add_parser("problem4", help="final intensity against frequency")
+    problem_4_parser.add_argument("--scenarios", nargs="+", help="scenarios A-F to run")
+    problem_4_parser.add_argument("--depth", type=float, help="depth in parsec")
+    problem_4_parser.add_argument("--density", type=float, help="density in cm^-3")
+    problem_4_parser.add_argument("--method", choices=["euler", "exact"], help="solver method")
+    problem_4_parser.add_argument("--number-of-frequencies", type=int, help="number of frequencies")
+
+    for problem_parser in (problem_1_parser, problem_2_parser, problem_3_parser, problem_4_parser):
+        add_output_arguments(problem_parser, with_defaults=False)
+    return parser
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config) as config_file:
+            run_list = json.load(config_file)["runs"]
+    elif args.problem:
+        parameters = {key: value for key, value in vars(args).items()
+                      if key not in ("config", "output_dir", "no_plots", "profile", "problem") and value is not None}
+        run_list = [dict(parameters, problem=args.problem)]
+    else:
+        parser.error("give a problem or a --config file")
+    if args.profile:
+        instrumentation.enable(args.profile)
+
+    for run_number, run_parameters in enumerate(run_list):
+        run_parameters = dict(run_parameters)
+        problem = run_parameters.pop("problem")
+        name = run_parameters.pop("name", f"{problem}_{run_number}" if len(run_list) > 1 else problem)
+        run(problem, args.output_dir, name=name, make_plots=not args.no_plots, **run_parameters)
+        print(f"{name}: wrote {os.path.join(args.output_dir, name)}.json")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Vectorized line profiles for building cross section spectra on NumPy frequency grids.
+Every profile is scaled so that its peak equals the given amplitude, the same
+convention as calculate_gaussian in PHYS239_HW2.py."""
+
+import numpy as np
+
+PROFILES = ("gaussian", "lorentzian", "voigt")
+#most (line, frequency) pairs sum_line_profiles evaluates in one array operation
+MAX_PAIRS_PER_CHUNK = 2**16
+
+def gaussian_profile(frequencies, center, amplitude, width):
+    """
+    Evaluates a Gaussian line profile
+
+    params:
+    frequencies (array): frequencies to evaluate the profile at in Hz
+    center (float): frequency of the line peak in Hz
+    amplitude (float): value at the line peak
+    width (float): standard deviation of the line in Hz
+
+    returns:
+    profile (numpy array): profile at each frequency
+    """
+    offsets = np.asarray(frequencies, dtype=float) - center
+    return amplitude * np.exp(-(offsets**2) / (2 * width**2))
+
+def lorentzian_profile(frequencies, center, amplitude, half_width):
+    """
+    Evaluates a Lorentzian line profile
+
+    params:
+    frequencies (array): frequencies to evaluate the profile at in Hz
+    center (float): frequency of the line peak in Hz
+    amplitude (float): value at the line peak
+    half_width (float): half width at half maximum of the line in Hz
+
+    returns:
+    profile (numpy array): profile at each frequency
+    """
+    offsets = np.asarray(frequencies, dtype=float) - center
+    return amplitude * half_width**2 / (offsets**2 + half_width**2)
+
+def voigt_profile(frequencies, center, amplitude, width, half_width):
+    """
+    Evaluates a Voigt line profile, the convolution of a Gaussian and a Lorentzian,
+    using the Faddeeva function. Needs scipy.
+
+    params:
+    frequencies (array): frequencies to evaluate the profile at in Hz
+    center (float): frequency of the line peak in Hz
+    amplitude (float): value at the line peak
+    width (float): standard deviation of the Gaussian part in Hz
+    half_width (float): half width at half maximum of the Lorentzian part in Hz
+
+    returns:
+    profile (numpy array): profile at each frequency
+    """
+    from scipy.special import wofz
+
+    offsets = np.asarray(frequencies, dtype=float) - center
+    scale = width * np.sqrt(2)
+    profile = wofz((offsets + 1j * half_width) / scale).real
+    peak = wofz(1j * half_width / scale).real
+    return amplitude * profile / peak
+
+def evaluate_profile(profile, frequencies, center, amplitude, width=None, half_width=None):
+    """
+    Evaluates one of the profiles in PROFILES by name
+
+    params:
+    profile (str): "gaussian", "lorentzian" or "voigt"
+    frequencies (array): frequencies to evaluate the profile at in Hz
+    center (float): frequency of the line peak in Hz
+    amplitude (float): value at the line peak
+    width (float): standard deviation of the Gaussian part in Hz
+    half_width (float): half width at half maximum of the Lorentzian part in Hz
+
+    returns:
+    profile (numpy array): profile at each frequency
+    """
+    if profile == "gaussian":
+        return gaussian_profile(frequencies, center, amplitude, width)
+    elif profile == "lorentzian":
+        return lorentzian_profile(frequencies, center, amplitude, half_width)
+    elif profile == "voigt":
+        return voigt_profile(frequencies, center, amplitude, width, half_width)
+    raise ValueError(f"Unknown profile '{profile}', expected one of {PROFILES}")
+
+class LineProfileTable:
+    """
+    A line shape sampled once on a fine grid of offsets from the line center,
+    so lines that share a shape are evaluated by interpolation instead of
+    recomputing the profile. The table is zero beyond half_range.
+    """
+
+    def __init__(self, profile, width=None, half_width=None, half_range=None, number_of_points=4097):
+        """
+        params:
+        profile (str): "gaussian", "lorentzian" or "voigt"
+        width (float): standard deviation of the Gaussian part in Hz
+        half_width (float): half width at half maximum of the Lorentzian part in Hz
+        half_range (float): largest offset from the line center kept in the table in Hz,
+                            defaults to 8 Gaussian widths or 50 Lorentzian half widths
+        number_of_points (int): number of samples in the table
+        """
+        if half_range is None:
+            half_range = max(8 * (width or 0), 50 * (half_width or 0))
+        self.profile = profile
+        self.width = width
+        self.half_width = half_width
+        self.offsets = np.linspace(-half_range, half_range, number_of_points)
+        self.values = evaluate_profile(profile, self.offsets, 0.0, 1.0, width, half_width)
+
+    def __call__(self, frequencies, center, amplitude):
+        """
+        Evaluates the tabulated line shape at the given frequencies
+
+        params:
+        frequencies (array): frequencies to evaluate the profile at in Hz
+        center (float): frequency of the line peak in Hz
+        amplitude (float): value at the line peak
+
+        returns:
+        profile (numpy array): profile at each frequency
+        """
+        offsets = np.asarray(frequencies, dtype=float) - center
+        return amplitude * np.interp(offsets, self.offsets, self.values, left=0.0, right=0.0)
+
+def sum_line_profiles(frequencies, centers, amplitudes, profile="gaussian", widths=None,
+                      half_widths=None, cutoff=None, table=None):
+    """
+    Adds up many lines on one frequency grid. The lines are evaluated together in
+    array operations, and with a cutoff only on the part of the grid that is within
+    cutoff of each line center.
+
+    params:
+    frequencies (array): frequencies to evaluate the spectrum at in Hz
+    centers (array): frequency of each line peak in Hz
+    amplitudes (array): value at each line peak
+    profile (str): "gaussian", "lorentzian" or "voigt"
+    widths (float or array): standard deviation of the Gaussian part of each line in Hz
+    half_widths (float or array): half width at half maximum of the Lorentzian part of each line in Hz
+    cutoff (float): lines are ignored further than this from their center in Hz
+    table (LineProfileTable): precomputed shape shared by every line, used instead of
+                              profile, widths and half_widths. Its half_range is the
+                              cutoff unless one is given
+
+    returns:
+    spectrum (numpy array): sum of all lines at each frequency
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    centers = np.atleast_1d(np.asarray(centers, dtype=float))
+    amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=float), centers.shape)
+    widths = np.broadcast_to(np.asarray(widths if widths is not None else np.nan, dtype=float), centers.shape)
+    half_widths = np.broadcast_to(np.asarray(half_widths if half_widths is not None else np.nan, dtype=float),
+                                  centers.shape)
+
+    if table is not None and cutoff is None:
+        cutoff = table.offsets[-1]
+    order = None
+    if cutoff is not None:
+        #the windows are found by bisection, which needs the grid in increasing order
+        if np.any(np.diff(frequencies) < 0):
+            order = np.argsort(frequencies, kind="stable")
+            frequencies = frequencies[order]
+        lower_indices = np.searchsorted(frequencies, centers - cutoff, side="left")
+        upper_indices = np.searchsorted(frequencies, centers + cutoff, side="right")
+    else:
+        lower_indices = np.zeros(len(centers), dtype=int)
+        upper_indices = np.full(len(centers), len(frequencies))
+
+    #lines are evaluated a chunk at a time as rows of a 2D array, each row padded to the widest window
+    window = int(np.max(upper_indices - lower_indices, initial=0))
+    lines_per_chunk = max(1, MAX_PAIRS_PER_CHUNK // max(window, 1))
+    spectrum = np.zeros_like(frequencies)
+    for first in range(0, len(centers) if window > 0 else 0, lines_per_chunk):
+        lines = slice(first, first + lines_per_chunk)
+        if cutoff is None:
+            indices = np.arange(len(frequencies))
+        else:
+            indices = lower_indices[lines, np.newaxis] + np.arange(window)
+            outside = indices >= upper_indices[lines, np.newaxis]
+            indices[outside] = 0
+        if table is not None:
+            values = table(frequencies[indices], centers[lines, np.newaxis], amplitudes[lines, np.newaxis])
+        else:
+            values = evaluate_profile(profile, frequencies[indices], centers[lines, np.newaxis],
+                                      amplitudes[lines, np.newaxis], widths[lines, np.newaxis],
+                                      half_widths[lines, np.newaxis])
+        if cutoff is None:
+            spectrum += values.sum(axis=0)
+        else:
+            values[outside] = 0.0
+            spectrum += np.bincount(indices.ravel(), weights=values.ravel(), minlength=len(frequencies))
+
+    if order is not None:
+        unsorted_spectrum = np.empty_like(spectrum)
+        unsorted_spectrum[order] = spectrum
+        spectrum = unsorted_spectrum
+    return spectrum
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Evaluates the HW2 slab model over a Cartesian grid of depth, density,
+cross section (or optical depth), initial intensity and source function.
+The grid is split into chunks that are evaluated across a process pool and
+written straight into a memory-mapped .npy file, so the grid never has to fit in RAM.
+
+Example:
+python sweep_HW2.py --depths 1e-3:1e3:100:log --densities 1:1000:100:log
+                    --cross-sections 1e-22:1e-16:100:log --initial-intensities 0 1 10
+                    --source-functions 1 10 --output sweep.npy"""
+
+import argparse
+import multiprocessing
+import time
+import numpy as np
+
+import instrumentation
+from PHYS239_HW2 import (column_density_calculator,
+                         cross_section_calculator,
+                         specific_intensity_calculator_batch)
+
+SWEEP_DTYPE = np.dtype([("column_density", float),
+                        ("cross_section", float),
+                        ("optical_depth", float),
+                        ("final_intensity", float)])
+
+#set in each worker process by init_sweep_worker
+worker_state = {}
+
+def parse_axis(values):
+    """
+    Parses the values of one grid axis from the command line
+
+    params:
+    values [str]: either a list of numbers or a single "start:stop:num" range,
+                  with ":log" appended for logarithmic spacing
+
+    returns:
+    axis (numpy array): values of the axis
+    """
+    if len(values) == 1 and ":" in values[0]:
+        parts = values[0].split(":")
+        if len(parts) not in (3, 4) or (len(parts) == 4 and parts[3] not in ("lin", "log")):
+            raise argparse.ArgumentTypeError(f"Cannot parse axis range '{values[0]}'")
+        start, stop, num = float(parts[0]), float(parts[1]), int(parts[2])
+        if len(parts) == 4 and parts[3] == "log":
+            return np.logspace(np.log10(start), np.log10(stop), num)
+        return np.linspace(start, stop, num)
+    return np.array([float(value) for value in values])
+
+def build_cross_section_table(depths, densities, cross_sections=None, optical_depths=None):
+    """
+    Calculates the column density of every (depth, density) pair and the cross
+    section of every (depth, density, third axis) triple of the grid
+
+    params:
+    depths (array): depth axis in parsec
+    densities (array): density axis in cm^-3
+    cross_sections (array): cross section axis in cm^2
+    optical_depths (array): optical depth axis, used instead of cross_sections
+
+    returns:
+    column_density_table (numpy array): column density in cm^-2, shape (depths, densities)
+    cross_section_table (numpy array): cross section in cm^2, shape (depths, densities, third axis)
+    """
+    if (cross_sections is None) == (optical_depths is None):
+        raise ValueError("Exactly one of cross_sections and optical_depths must be given")
+
+    third_axis = cross_sections if optical_depths is None else optical_depths
+    column_density_table = np.empty((len(depths), len(densities)))
+    cross_section_table = np.empty((len(depths), len(densities), len(third_axis)))
+    for i, depth in enumerate(depths):
+        for j, density in enumerate(densities):
+            column_density_table[i, j] = column_density_calculator(depth, density)
+            if optical_depths is None:
+                cross_section_table[i, j] = cross_sections
+            else:
+                cross_section_table[i, j] = cross_section_calculator(np.asarray(optical_depths), depth, density)
+    return column_density_table, cross_section_table
+
+def init_sweep_worker(output_path, axes, column_density_table, cross_section_table, method,
+                      record_instrumentation=False):
+    if record_instrumentation:
+        instrumentation.enable()
+    worker_state["results"] = np.load(output_path, mmap_mode="r+").reshape(-1)
+    worker_state["axes"] = axes
+    worker_state["shape"] = tuple(len(axis) for axis in axes)
+    worker_state["column_density_table"] = column_density_table
+    worker_state["cross_section_table"] = cross_section_table
+    worker_state["method"] = method
+
+@instrumentation.timed("evaluate_sweep_chunk")
+def evaluate_sweep_chunk(bounds):
+    """
+    Evaluates one chunk of the flattened grid and writes it into the memory-mapped results
+
+    params:
+    bounds (int, int): first and one past last flat grid index of the chunk
+
+    returns:
+    number_of_points (int): number of grid points evaluated
+    """
+    start, stop = bounds
+    depths, densities, _, initial_intensities, source_functions = worker_state["axes"]
+    i, j, k, l, m = np.unravel_index(np.arange(start, stop), worker_state["shape"])
+
+    depth = depths[i]
+    density = densities[j]
+    cross_section = worker_state["cross_section_table"][i, j, k]
+    column_density = worker_state["column_density_table"][i, j]
+
+    chunk = np.empty(stop - start, dtype=SWEEP_DTYPE)
+    chunk["column_density"] = column_density
+    chunk["cross_section"] = cross_section
+    chunk["optical_depth"] = cross_section * column_density
+    chunk["final_intensity"] = specific_intensity_calculator_batch(initial_intensities[l],
+                                                                   source_functions[m],
+                                                                   cross_section, density, depth,
+                                                                   method=worker_state["method"])
+
+    results = worker_state["results"]
+    results[start:stop] = chunk
+    results.flush()
+    return stop - start
+
+def evaluate_sweep_chunk_worker(bounds):
+    """
+    Runs evaluate_sweep_chunk in a pool worker
+
+    params:
+    bounds (int, int): first and one past last flat grid index of the chunk
+
+    returns:
+    number_of_points (int): number of grid points evaluated
+    recorded (dict): the worker's instrumentation.snapshot() since the last chunk, or None
+    """
+    number_of_points = evaluate_sweep_chunk(bounds)
+    #timings recorded in the worker travel back with the result, see sweep_parameter_grid
+    recorded = None
+    if instrumentation.ENABLED:
+        recorded = instrumentation.snapshot()
+        instrumentation.reset()
+    return number_of_points, recorded
+
+def sweep_parameter_grid(depths, densities, initial_intensities, source_functions, output_path,
+                         cross_sections=None, optical_depths=None, chunk_size=1000000,
+                         processes=None, method="exact", verbose=False):
+    """
+    Evaluates the slab model on every point of a Cartesian parameter grid and
+    streams the results into a memory-mapped .npy file
+
+    params:
+    depths (array): depth axis in parsec
+    densities (array): density axis in cm^-3
+    initial_intensities (array): initial intensity axis
+    source_functions (array): source function axis
+    output_path (str): .npy file to write. The axes are saved next to it in "<name>_axes.npz"
+    cross_sections (array): cross section axis in cm^2
+    optical_depths (array): optical depth axis, used instead of cross_sections
+    chunk_size (int): number of grid points per chunk handed to a worker
+    processes (int): number of worker processes, defaults to the number of cores
+    method (str): "euler" or "exact", see specific_intensity_calculator
+    verbose (bool): print progress as chunks finish
+
+    returns:
+    results (numpy memmap): structured results of shape (depths, densities, cross sections
+                            or optical depths, initial intensities, source functions)
+                            with the fields of SWEEP_DTYPE
+    """
+    third_axis = cross_sections if optical_depths is None else optical_depths
+    axes = [np.asarray(axis, dtype=float) for axis in (depths, densities, third_axis,
+                                                       initial_intensities, source_functions)]
+    shape = tuple(len(axis) for axis in axes)
+    number_of_points = int(np.prod(shape))
+
+    column_density_table, cross_section_table = build_cross_section_table(axes[0], axes[1],
+                                                                          cross_sections, optical_depths)
+
+    results = np.lib.format.open_memmap(output_path, mode="w+", dtype=SWEEP_DTYPE, shape=shape)
+    del results
+    axes_path = output_path[:-4] + "_axes.npz" if output_path.endswith(".npy") else output_path + "_axes.npz"
+    np.savez(axes_path, depths=axes[0], densities=axes[1],
+             **{"optical_depths" if optical_depths is not None else "cross_sections": axes[2]},
+             initial_intensities=axes[3], source_functions=axes[4])
+
+    chunk_bounds = [(start, min(start + chunk_size, number_of_points))
+                    for start in range(0, number_of_points, chunk_size)]
+
+    start_time = time.perf_counter()
+    points_done = 0
+    with multiprocessing.Pool(processes, initializer=init_sweep_worker,
+                              initargs=(output_path, axes, column_density_table,
+                                        cross_section_table, method, instrumentation.ENABLED)) as pool:
+        for number_of_chunk_points, recorded in pool.imap_unordered(evaluate_sweep_chunk_worker, chunk_bounds):
+            if recorded is not None:
+                instrumentation.merge(recorded)
+            points_done += number_of_chunk_points
+            if verbose:
+                elapsed_time = time.perf_counter() - start_time
+                print(f"{points_done}/{number_of_points} points ({elapsed_time:.1f} s)")
+
+    return np.load(output_path, mmap_mode="r")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the HW2 slab model over a parameter grid")
+    parser.add_argument("--depths", nargs="+", required=True, help="depth axis in parsec")
+    parser.add_argument("--densities", nargs="+", required=True, help="density axis in cm^-3")
+    third_axis_group = parser.add_mutually_exclusive_group(required=True)
+    third_axis_group.add_argument("--cross-sections", nargs="+", help="cross section axis in cm^2")
+    third_axis_group.add_argument("--optical-depths", nargs="+",
+                                  help="optical depth axis, converted with cross_section_calculator")
+    parser.add_argument("--initial-intensities", nargs="+", required=True, help="initial intensity axis")
+    parser.add_argument("--source-functions", nargs="+", required=True, help="source function axis")
+    parser.add_argument("--output", required=True, help=".npy file to write the results to")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="grid points per chunk")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--method", choices=["exact", "euler"], default="exact",
+                        help="intensity solver method")
+    parser.add_argument("--profile", help="write timings of the chunks to this JSON file, "
+                                          "in Chrome trace format if it ends in .trace.json")
+    args = parser.parse_args()
+    if args.profile:
+        instrumentation.enable(args.profile)
+
+    sweep_parameter_grid(parse_axis(args.depths), parse_axis(args.densities),
+                         parse_axis(args.initial_intensities), parse_axis(args.source_functions),
+                         args.output,
+                         cross_sections=parse_axis(args.cross_sections) if args.cross_sections else None,
+                         optical_depths=parse_axis(args.optical_depths) if args.optical_depths else None,
+                         chunk_size=args.chunk_size, processes=args.processes,
+                         method=args.method, verbose=True)
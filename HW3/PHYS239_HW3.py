@@ -6,20 +6,168 @@ Created on Mon Dec 14 02:44:56 2020
 """
 
 import math
-import cmath
-import matplotlib.pyplot as plt 
+import functools
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
 from scipy import signal
 import numpy as np
-import tkinter as tk
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.figure import Figure
+
+import instrumentation
+
+#tkinter and matplotlib are only imported by load_gui_modules when a window is opened,
+#so the calculations can run on machines without a display (see sweep_HW3.py)
+tk = None
+FigureCanvasTkAgg = None
+Figure = None
 
 ELECTRON_MASS = 9.109E-31
 ELECTRON_CHARGE = 1.602E-19
 COULOMB_CONSTANT = 8.987E9
+SPEED_OF_LIGHT = 2.998E8
+NUCLEUS_RADIUS = 1E-15
+
+#Larmor formula: radiated power = LARMOR_CONSTANT * acceleration^2
+LARMOR_CONSTANT = 2 * COULOMB_CONSTANT * ELECTRON_CHARGE**2 / (3 * SPEED_OF_LIGHT**3)
+
+#samples per Welch segment used for every PSD
+PSD_NPERSEG = 2**7
+#acceleration samples collected before they are handed to a StreamingWelch
+PSD_CHUNK_SIZE = 2**14
+#series are reduced to a min and max per bin before plotting; a 6 inch figure is
+#about 600 pixels wide, so this draws roughly 3 points per pixel
+PLOT_BINS = 1000
+#fixed steps between calls to a progress_callback
+PROGRESS_INTERVAL = 20000
+#fixed steps between checkpoints of a run written to a TrajectoryFile
+CHECKPOINT_INTERVAL = 10**6
+#states checked for energy drift in the field of many ions
+DIAGNOSTIC_SAMPLES = 1000
+
+class CalculationCancelled(Exception):
+    """Raised by a progress_callback to stop a calculation early"""
+
+def load_gui_modules():
+    global tk, FigureCanvasTkAgg, Figure
+    if tk is not None:
+        return
+    
+    import tkinter
+    import matplotlib
+    matplotlib.use("TkAgg")
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as figure_canvas_tk_agg
+    from matplotlib.figure import Figure as figure
+    
+    tk = tkinter
+    FigureCanvasTkAgg = figure_canvas_tk_agg
+    Figure = figure
+
+class ElectronTrajectory:
+    """
+    Time, position, velocity and acceleration of an electron at every step,
+    stored as preallocated numpy arrays of length number_of_steps + 1.
+    """
+    __slots__ = ("t", "x", "y", "vx", "vy", "ax", "ay")
+    
+    def __init__(self, number_of_steps):
+        size = number_of_steps + 1
+        self.t = np.zeros(size)
+        self.x = np.zeros(size)
+        self.y = np.zeros(size)
+        self.vx = np.zeros(size)
+        self.vy = np.zeros(size)
+        self.ax = np.zeros(size)
+        self.ay = np.zeros(size)
+        
+    def __len__(self):
+        return len(self.t)
+        
+    def trim(self, length):
+        """Drops the unused tail of the arrays after a run that stopped early"""
+        if length >= len(self.t):
+            return
+        for name in self.__slots__:
+            values = getattr(self, name)[:length]
+            #arrays on disk are only cut down, copying them would load them into memory
+            setattr(self, name, values if isinstance(values, np.memmap) else values.copy())
+            
+    def grow(self, number_of_steps):
+        """Extends the arrays with zeros to hold number_of_steps + 1 entries"""
+        for name in self.__slots__:
+            values = getattr(self, name)
+            grown = np.zeros(number_of_steps + 1)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+            
+    def endpoints(self):
+        """A two entry trajectory with only the first and last state of this one"""
+        trajectory = ElectronTrajectory(1)
+        for name in self.__slots__:
+            getattr(trajectory, name)[:] = getattr(self, name)[[0, -1]]
+        return trajectory
+
+class TrajectoryFile:
+    """
+    Keeps a run's trajectory on disk instead of in memory: a (7, number_of_steps + 1)
+    .npy file opened as a memmap, one row per ElectronTrajectory array, so the arrays
+    handed to get_total_acc_list, get_psd and the plots are views of the file.
+    Fixed-step runs also write the integrator state to "<path>.checkpoint.json" every
+    checkpoint_interval steps, and fire_electron(..., resume=True) carries on from there.
+    """
+    
+    def __init__(self, path, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.checkpoint_path = path + ".checkpoint.json"
+        self.checkpoint_interval = checkpoint_interval
+        self.array = None
+        
+    def create(self, number_of_steps):
+        self.array = np.lib.format.open_memmap(self.path, mode="w+", dtype=float,
+                                               shape=(len(ElectronTrajectory.__slots__), number_of_steps + 1))
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.trajectory()
+        
+    def open(self):
+        self.array = np.load(self.path, mmap_mode="r+")
+        return self.trajectory()
+        
+    def trajectory(self):
+        trajectory = ElectronTrajectory(0)
+        for row, name in enumerate(trajectory.__slots__):
+            setattr(trajectory, name, self.array[row])
+        return trajectory
+        
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.path):
+            return None
+        with open(self.checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+        
+    def save_checkpoint(self, settings, step, state, termination=None):
+        """
+        Flushes the memmap, then records how far the run got. The checkpoint is replaced
+        in one step so an interrupted write never leaves a broken one behind.
+        """
+        self.array.flush()
+        checkpoint = {"settings": settings, "step": step, "state": [float(value) for value in state],
+                      "termination": termination}
+        with open(self.checkpoint_path + ".tmp", "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+        
+    def write(self, trajectory, settings, termination):
+        """Copies a finished in-memory trajectory to the file and returns the on-disk one"""
+        stored_trajectory = self.create(len(trajectory) - 1)
+        for name in trajectory.__slots__:
+            getattr(stored_trajectory, name)[:] = getattr(trajectory, name)
+        last_state = [getattr(trajectory, name)[-1] for name in ("x", "y", "vx", "vy", "ax", "ay")]
+        self.save_checkpoint(settings, len(trajectory) - 1, last_state, termination)
+        return stored_trajectory
 
 class Electron:
     
@@ -28,62 +176,704 @@ class Electron:
         self.initial_velocity = initial_velocity
         self.impact_parameter = impact_parameter
         
-        self.time_list = [0]
-        self.position_dict = {"x": [initial_distance], "y": [impact_parameter]}
-        self.velocity_dict = {"x": [-initial_velocity], "y": [0]}
-        
-        self.acceleration_dict = {"x": [], "y":[]}
-        
-    def reset_electron(self):
-        self.time_list = [0]
-        self.position_dict = {"x": [self.initial_distance], "y": [self.impact_parameter]}
-        self.velocity_dict = {"x": [self.initial_velocity], "y": [0]}
-        
-        self.acceleration_dict = {"x": [], "y":[]}
-        
-def fire_electron(electron, nucleus_charge, run_time, step_time):
-    
-    electron.reset_electron()
-    number_of_steps = int(run_time / step_time)
-    initial_x_acc, initial_y_acc = calculate_acceleration(nucleus_charge,
-                                                          electron.initial_distance,
-                                                          electron.impact_parameter)
-    
-    electron.acceleration_dict["x"].append(initial_x_acc)
-    electron.acceleration_dict["y"].append(initial_y_acc)
-    
-    for step in range(1, number_of_steps + 1):
-        current_time = step * step_time
-        current_x_position = electron.position_dict["x"][step-1]
-        current_y_position = electron.position_dict["y"][step-1]
-        current_x_velocity = electron.velocity_dict["x"][step-1]
-        current_y_velocity = electron.velocity_dict["y"][step-1]
-        current_x_acc = electron.acceleration_dict["x"][step-1]
-        current_y_acc = electron.acceleration_dict["y"][step-1]
-        
-        new_x_position = current_x_position + (current_x_velocity * step_time)
-        new_y_position = current_y_position + (current_y_velocity * step_time)
-        new_x_velocity = current_x_velocity + (current_x_acc * step_time)
-        new_y_velocity = current_y_velocity + (current_y_acc * step_time)
-        new_x_acc, new_y_acc = calculate_acceleration(nucleus_charge,
-                                                      current_x_position,
-                                                      current_y_position)
-        
-        
-        electron.time_list.append(current_time)
-        electron.position_dict["x"].append(new_x_position)
-        electron.position_dict["y"].append(new_y_position)
-        electron.velocity_dict["x"].append(new_x_velocity)
-        electron.velocity_dict["y"].append(new_y_velocity)
-        electron.acceleration_dict["x"].append(new_x_acc)
-        electron.acceleration_dict["y"].append(new_y_acc)
-        
-        if new_x_position == 0 and new_y_position == 0:
-            return
+        self.reset_electron()
+        
+    def reset_electron(self, number_of_steps=0):
+        self.trajectory = ElectronTrajectory(number_of_steps)
+        self.trajectory.x[0] = self.initial_distance
+        self.trajectory.y[0] = self.impact_parameter
+        self.trajectory.vx[0] = -self.initial_velocity
+        
+    #list-style views of the trajectory for older callers
+    @property
+    def time_list(self):
+        return self.trajectory.t
+    
+    @property
+    def position_dict(self):
+        return {"x": self.trajectory.x, "y": self.trajectory.y}
+    
+    @property
+    def velocity_dict(self):
+        return {"x": self.trajectory.vx, "y": self.trajectory.vy}
+    
+    @property
+    def acceleration_dict(self):
+        return {"x": self.trajectory.ax, "y": self.trajectory.ay}
+        
+def euler_step(acceleration_function, x, y, vx, vy, ax, ay, dt):
+    """Forward Euler as first written for HW3: the new acceleration is taken at the old position"""
+    new_ax, new_ay = acceleration_function(x, y)
+    return x + vx * dt, y + vy * dt, vx + ax * dt, vy + ay * dt, new_ax, new_ay
+
+def verlet_step(acceleration_function, x, y, vx, vy, ax, ay, dt):
+    """Velocity Verlet (kick-drift-kick leapfrog), symplectic and second order"""
+    half_vx = vx + 0.5 * ax * dt
+    half_vy = vy + 0.5 * ay * dt
+    new_x = x + half_vx * dt
+    new_y = y + half_vy * dt
+    new_ax, new_ay = acceleration_function(new_x, new_y)
+    return new_x, new_y, half_vx + 0.5 * new_ax * dt, half_vy + 0.5 * new_ay * dt, new_ax, new_ay
+
+def rk4_step(acceleration_function, x, y, vx, vy, ax, ay, dt):
+    """Classical fourth order Runge-Kutta, ax and ay are the acceleration at (x, y)"""
+    half_dt = 0.5 * dt
+    
+    x2, y2 = x + vx * half_dt, y + vy * half_dt
+    vx2, vy2 = vx + ax * half_dt, vy + ay * half_dt
+    ax2, ay2 = acceleration_function(x2, y2)
+    
+    x3, y3 = x + vx2 * half_dt, y + vy2 * half_dt
+    vx3, vy3 = vx + ax2 * half_dt, vy + ay2 * half_dt
+    ax3, ay3 = acceleration_function(x3, y3)
+    
+    x4, y4 = x + vx3 * dt, y + vy3 * dt
+    vx4, vy4 = vx + ax3 * dt, vy + ay3 * dt
+    ax4, ay4 = acceleration_function(x4, y4)
+    
+    new_x = x + (vx + 2 * vx2 + 2 * vx3 + vx4) * dt / 6
+    new_y = y + (vy + 2 * vy2 + 2 * vy3 + vy4) * dt / 6
+    new_vx = vx + (ax + 2 * ax2 + 2 * ax3 + ax4) * dt / 6
+    new_vy = vy + (ay + 2 * ay2 + 2 * ay3 + ay4) * dt / 6
+    new_ax, new_ay = acceleration_function(new_x, new_y)
+    return new_x, new_y, new_vx, new_vy, new_ax, new_ay
+
+#fixed step integrators and the acceleration evaluations each of their steps costs
+INTEGRATORS = {"euler": (euler_step, 1),
+               "verlet": (verlet_step, 1),
+               "rk4": (rk4_step, 4)}
+
+#number of steps per run used by calculate; rk45 chooses its own steps and analytic
+#takes none, for them this only sets how finely the path is sampled for the PSD.
+#verlet and rk4 take at least this many, more on close or high charge passes (see run_settings)
+STEPS_PER_RUN = {"euler": 10**6,
+                 "verlet": 10**4,
+                 "rk4": 10**4,
+                 "rk45": 10**4,
+                 "analytic": 10**4}
+#steps verlet and rk4 take per periapsis time (periapsis distance / speed there), enough
+#for an energy drift and deflection error of about 1E-4 (verlet) and 1E-7 (rk4)
+STEPS_PER_PERIAPSIS_TIME = {"verlet": 100,
+                            "rk4": 20}
+#most steps run_settings gives a fixed step run; a run that needs more is flagged as
+#step_capped in its diagnostics and should be repeated with rk45
+MAX_STEPS_PER_RUN = 10**6
+
+#Dormand-Prince 5(4) coefficients
+DOPRI_C = (0, 1/5, 3/10, 4/5, 8/9, 1, 1)
+DOPRI_A = ((),
+           (1/5,),
+           (3/40, 9/40),
+           (44/45, -56/15, 32/9),
+           (19372/6561, -25360/2187, 64448/6561, -212/729),
+           (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+           (35/384, 0, 500/1113, 125/192, -2187/6784, 11/84))
+DOPRI_B5 = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DOPRI_B4 = np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+class RunEvents:
+    """
+    Conditions that end a run of fire_electron before run_time, or keep it going past
+    run_time until one of them happens. Each one is optional:
+    
+    collision_radius: the electron came closer than this to the nucleus (m)
+    escape_radius: the electron is moving away and is further than this from the nucleus (m)
+    power_threshold: the electron is moving away and radiates less Larmor power than this (W)
+    max_run_time: a run that reaches run_time without an event is extended, doubling its
+                  length each time, until an event happens or max_run_time is reached (s)
+    check_interval: fixed-step integrators only check every this many steps, so they can
+                    overshoot an event by up to check_interval - 1 steps
+    """
+    
+    def __init__(self, collision_radius=None, escape_radius=None, power_threshold=None,
+                 max_run_time=None, check_interval=10):
+        self.collision_radius = collision_radius
+        self.escape_radius = escape_radius
+        self.power_threshold = power_threshold
+        self.max_run_time = max_run_time
+        self.check_interval = check_interval
+        
+    def fired(self, x, y, vx, vy, ax, ay):
+        """
+        Returns (name, fired) for every event in the order collision, escape, radiated_power.
+        Works on a single state or on arrays of states.
+        """
+        r_squared = x * x + y * y
+        receding = x * vx + y * vy > 0
+        fired = []
+        if self.collision_radius is not None:
+            fired.append(("collision", r_squared < self.collision_radius**2))
+        if self.escape_radius is not None:
+            fired.append(("escape", receding & (r_squared > self.escape_radius**2)))
+        if self.power_threshold is not None:
+            fired.append(("radiated_power", receding & (LARMOR_CONSTANT * (ax * ax + ay * ay)
+                                                        < self.power_threshold)))
+        return fired
+        
+    def check(self, x, y, vx, vy, ax, ay):
+        """Name of the first event that has happened at a single state, None if there is none"""
+        for name, fired in self.fired(x, y, vx, vy, ax, ay):
+            if fired:
+                return name
+        return None
+        
+    def first_event(self, x, y, vx, vy, ax, ay):
+        """Index and name of the earliest event in arrays of states, (None, None) if there is none"""
+        first_index, first_name = None, None
+        for name, fired in self.fired(x, y, vx, vy, ax, ay):
+            if fired.any():
+                index = int(np.argmax(fired))
+                if first_index is None or index < first_index:
+                    first_index, first_name = index, name
+        return first_index, first_name
+
+def extended_number_of_steps(number_of_steps, max_steps):
+    return min(max(2 * number_of_steps, 1), max_steps)
+
+def fire_electron(electron, nucleus_charge, run_time, step_time, integrator="euler", tolerance=1E-9,
+                  psd_accumulator=None, store_trajectory=True, events=None, progress_callback=None,
+                  trajectory_file=None, resume=False, ion_field=None):
+    """
+    Integrates the electron's path past the nucleus and stores it in electron.trajectory
+    at every multiple of step_time.
+    
+    integrator is one of "euler", "verlet", "rk4", "rk45" or "analytic". "rk45" takes adaptive
+    Dormand-Prince steps with relative error tolerance and is resampled onto the
+    uniform step_time grid so get_psd still sees evenly spaced samples. "analytic" does
+    not integrate at all and samples the exact Kepler orbit instead (see kepler_orbit).
+    
+    With a psd_accumulator (a StreamingWelch) the size of the acceleration is fed to it
+    as the run goes. With store_trajectory=False electron.trajectory only keeps the first
+    and last state, so fixed-step and analytic runs take constant memory however long
+    they are (rk45 still holds its accepted steps while it runs). The diagnostics then
+    only compare the first and last state.
+    
+    events (a RunEvents) can stop the run early or extend it. The event that ended the
+    run is stored as diagnostics["termination"], which is "run_time" if none happened.
+    
+    progress_callback is called now and then with the fraction of the run done and the
+    number of entries of electron.trajectory filled in so far (0 while they are not known
+    yet). With events.max_run_time the fraction is of max_run_time, so it never goes back
+    when the run is extended. It may raise CalculationCancelled to stop the run.
+    
+    With a trajectory_file (a TrajectoryFile) the trajectory is written to disk instead of
+    memory. Fixed-step runs checkpoint as they go, and with resume=True a run with the
+    same settings continues from the file's last checkpoint instead of starting over.
+    
+    With an ion_field (an IonField from ion_field.py) the electron moves through the field
+    of many ions instead of the single nucleus, and nucleus_charge is not used. Events
+    still measure distances from the origin. The analytic integrator needs the single nucleus.
+    
+    Returns the conservation diagnostics of the run, also stored in electron.diagnostics.
+    """
+    #rounding first keeps floating point noise in run_time / step_time from dropping a step
+    number_of_steps = int(round(run_time / step_time, 6))
+    max_steps = number_of_steps
+    if events is not None and events.max_run_time is not None:
+        max_steps = max(number_of_steps, int(round(events.max_run_time / step_time, 6)))
+    if ion_field is None:
+        acceleration_function = instrumentation.wrap("calculate_acceleration",
+                                                     functools.partial(calculate_acceleration, nucleus_charge))
+    elif integrator == "analytic":
+        raise ValueError("The analytic integrator only works for a single nucleus, not an ion_field")
+    else:
+        acceleration_function = instrumentation.wrap("IonField.acceleration", ion_field.acceleration)
+    
+    settings = None
+    if trajectory_file is not None:
+        if not store_trajectory or max_steps != number_of_steps:
+            raise ValueError("A trajectory_file needs store_trajectory=True and no max_run_time")
+        settings = {"integrator": integrator, "nucleus_charge": float(nucleus_charge),
+                    "initial_distance": float(electron.initial_distance),
+                    "impact_parameter": float(electron.impact_parameter),
+                    "initial_velocity": float(electron.initial_velocity),
+                    "number_of_steps": number_of_steps, "step_time": float(step_time),
+                    "tolerance": float(tolerance), "ion_field": ion_field is not None}
+    
+    with instrumentation.span(f"fire_electron.{integrator}") as run_span:
+        if integrator == "rk45":
+            force_evaluations, termination = fire_electron_adaptive(electron, acceleration_function,
+                                                                    number_of_steps, step_time, tolerance,
+                                                                    events, max_steps, progress_callback)
+            if psd_accumulator is not None:
+                psd_accumulator.update(np.sqrt(electron.trajectory.ax**2 + electron.trajectory.ay**2))
+            if not store_trajectory:
+                electron.trajectory = electron.trajectory.endpoints()
+            if trajectory_file is not None:
+                electron.trajectory = trajectory_file.write(electron.trajectory, settings, termination)
+        elif integrator == "analytic":
+            termination = fire_electron_analytic(electron, nucleus_charge, number_of_steps, step_time,
+                                                 psd_accumulator, store_trajectory, events, max_steps,
+                                                 progress_callback)
+            force_evaluations = 0
+            if trajectory_file is not None:
+                electron.trajectory = trajectory_file.write(electron.trajectory, settings, termination)
+        elif integrator in INTEGRATORS:
+            stepper, evaluations_per_step = INTEGRATORS[integrator]
+            last_step, termination = fire_electron_fixed_step(electron, stepper, acceleration_function,
+                                                              number_of_steps, step_time, psd_accumulator,
+                                                              store_trajectory, events, max_steps,
+                                                              progress_callback, trajectory_file,
+                                                              settings, resume)
+            force_evaluations = 1 + last_step * evaluations_per_step
+        else:
+            raise ValueError(f"Unknown integrator '{integrator}', expected one of {list(STEPS_PER_RUN)}")
+        run_span.add_steps(int(round(float(electron.trajectory.t[-1]) / step_time)))
+    
+    electron.diagnostics = conservation_diagnostics(electron.trajectory, nucleus_charge, ion_field)
+    electron.diagnostics["integrator"] = integrator
+    electron.diagnostics["force_evaluations"] = force_evaluations
+    electron.diagnostics["termination"] = termination
+    electron.diagnostics["run_time"] = float(electron.trajectory.t[-1])
+    return electron.diagnostics
+
+def fire_electron_fixed_step(electron, stepper, acceleration_function, number_of_steps, step_time,
+                             psd_accumulator=None, store_trajectory=True, events=None, max_steps=None,
+                             progress_callback=None, trajectory_file=None, settings=None, resume=False):
+    
+    if max_steps is None:
+        max_steps = number_of_steps
+    check_interval = events.check_interval if events is not None else 0
+    checkpoint_interval = trajectory_file.checkpoint_interval if trajectory_file is not None else 0
+    
+    checkpoint = trajectory_file.load_checkpoint() if trajectory_file is not None and resume else None
+    if checkpoint is not None and checkpoint["settings"] != settings:
+        checkpoint = None
+    
+    if checkpoint is not None:
+        electron.trajectory = trajectory_file.open()
+    elif trajectory_file is not None:
+        electron.trajectory = trajectory_file.create(number_of_steps)
+        electron.trajectory.x[0] = electron.initial_distance
+        electron.trajectory.y[0] = electron.impact_parameter
+        electron.trajectory.vx[0] = -electron.initial_velocity
+    else:
+        electron.reset_electron(number_of_steps if store_trajectory else 1)
+    trajectory = electron.trajectory
+    x_list, y_list = trajectory.x, trajectory.y
+    vx_list, vy_list = trajectory.vx, trajectory.vy
+    ax_list, ay_list = trajectory.ax, trajectory.ay
+    
+    if checkpoint is not None:
+        step = checkpoint["step"]
+        (current_x_position, current_y_position,
+         current_x_velocity, current_y_velocity,
+         current_x_acc, current_y_acc) = checkpoint["state"]
+    else:
+        step = 0
+        current_x_position = electron.initial_distance
+        current_y_position = electron.impact_parameter
+        current_x_velocity = -electron.initial_velocity
+        current_y_velocity = 0.0
+        current_x_acc, current_y_acc = acceleration_function(current_x_position, current_y_position)
+        
+        ax_list[0] = current_x_acc
+        ay_list[0] = current_y_acc
+    
+    if psd_accumulator is not None:
+        acc_buffer = np.empty(PSD_CHUNK_SIZE)
+        #a resumed run first passes on what is already in the file
+        for start in range(0, step, PSD_CHUNK_SIZE):
+            stop = min(start + PSD_CHUNK_SIZE, step)
+            psd_accumulator.update(get_total_acc_list(ax_list[start:stop], ay_list[start:stop]))
+        acc_buffer[0] = math.sqrt(current_x_acc**2 + current_y_acc**2)
+        buffered_samples = 1
+    
+    termination = "run_time"
+    if checkpoint is not None and checkpoint["termination"] is not None:
+        #the run had already finished, nothing left to integrate
+        termination = checkpoint["termination"]
+        number_of_steps = max_steps = step
+    while True:
+        for step in range(step + 1, number_of_steps + 1):
+            (current_x_position, current_y_position,
+             current_x_velocity, current_y_velocity,
+             current_x_acc, current_y_acc) = stepper(acceleration_function,
+                                                     current_x_position, current_y_position,
+                                                     current_x_velocity, current_y_velocity,
+                                                     current_x_acc, current_y_acc, step_time)
+            
+            if store_trajectory:
+                x_list[step] = current_x_position
+                y_list[step] = current_y_position
+                vx_list[step] = current_x_velocity
+                vy_list[step] = current_y_velocity
+                ax_list[step] = current_x_acc
+                ay_list[step] = current_y_acc
+            
+            if psd_accumulator is not None:
+                acc_buffer[buffered_samples] = math.sqrt(current_x_acc**2 + current_y_acc**2)
+                buffered_samples += 1
+                if buffered_samples == PSD_CHUNK_SIZE:
+                    psd_accumulator.update(acc_buffer)
+                    buffered_samples = 0
+            
+            if current_x_position == 0 and current_y_position == 0:
+                termination = "collision"
+                break
+            
+            if check_interval and step % check_interval == 0:
+                event = events.check(current_x_position, current_y_position,
+                                     current_x_velocity, current_y_velocity,
+                                     current_x_acc, current_y_acc)
+                if event is not None:
+                    termination = event
+                    break
+            
+            if progress_callback is not None and step % PROGRESS_INTERVAL == 0:
+                if store_trajectory:
+                    trajectory.t[:step + 1] = np.arange(step + 1) * step_time
+                progress_callback(step / max_steps, step + 1 if store_trajectory else 0)
+            
+            if checkpoint_interval and step % checkpoint_interval == 0:
+                trajectory_file.save_checkpoint(settings, step, (current_x_position, current_y_position,
+                                                                 current_x_velocity, current_y_velocity,
+                                                                 current_x_acc, current_y_acc))
+        
+        if termination != "run_time" or number_of_steps >= max_steps:
+            break
+        #no event yet, keep going
+        number_of_steps = extended_number_of_steps(number_of_steps, max_steps)
+        if store_trajectory:
+            trajectory.grow(number_of_steps)
+            x_list, y_list = trajectory.x, trajectory.y
+            vx_list, vy_list = trajectory.vx, trajectory.vy
+            ax_list, ay_list = trajectory.ax, trajectory.ay
+    last_step = step
+    
+    if psd_accumulator is not None and buffered_samples:
+        psd_accumulator.update(acc_buffer[:buffered_samples])
+    
+    if store_trajectory:
+        trajectory.t[:] = np.arange(len(trajectory)) * step_time
+        if trajectory_file is not None:
+            trajectory_file.save_checkpoint(settings, last_step, (current_x_position, current_y_position,
+                                                                  current_x_velocity, current_y_velocity,
+                                                                  current_x_acc, current_y_acc), termination)
+        trajectory.trim(last_step + 1)
+    else:
+        trajectory.t[1] = last_step * step_time
+        x_list[1], y_list[1] = current_x_position, current_y_position
+        vx_list[1], vy_list[1] = current_x_velocity, current_y_velocity
+        ax_list[1], ay_list[1] = current_x_acc, current_y_acc
+    return last_step, termination
+
+def fire_electron_adaptive(electron, acceleration_function, number_of_steps, step_time, tolerance,
+                           events=None, max_steps=None, progress_callback=None):
+    """
+    Integrates with adaptive Dormand-Prince 5(4) steps, then resamples the accepted
+    steps onto the uniform step_time grid with cubic Hermite interpolation.
+    Events are checked after every accepted step.
+    Returns the number of acceleration evaluations taken by the integration and the
+    event that ended it.
+    """
+    if max_steps is None:
+        max_steps = number_of_steps
+    run_time = number_of_steps * step_time
+    state = np.array([electron.initial_distance, electron.impact_parameter, -electron.initial_velocity, 0.0])
+    error_scale = tolerance * np.array([abs(state[0]) + abs(state[1]), abs(state[0]) + abs(state[1]),
+                                        abs(state[2]), abs(state[2])])
+    
+    def derivative(state):
+        ax, ay = acceleration_function(state[0], state[1])
+        return np.array([state[2], state[3], ax, ay])
+    
+    time_list = [0.0]
+    state_list = [state]
+    slope = derivative(state)
+    slope_list = [slope]
+    force_evaluations = 1
+    
+    termination = "run_time"
+    current_time = 0.0
+    dt = step_time
+    while True:
+        if current_time >= run_time:
+            if number_of_steps >= max_steps:
+                break
+            #no event yet, keep going
+            number_of_steps = extended_number_of_steps(number_of_steps, max_steps)
+            run_time = number_of_steps * step_time
+        dt = min(dt, run_time - current_time)
+        if current_time + dt == current_time:
+            raise RuntimeError(f"rk45 step size underflow at t = {current_time} s, the electron hit the nucleus")
+        stages = [slope]
+        for stage in range(1, 7):
+            stage_state = state + dt * sum(a * k for a, k in zip(DOPRI_A[stage], stages))
+            stages.append(derivative(stage_state))
+        force_evaluations += 6
+        stages = np.array(stages)
+        
+        new_state = state + dt * DOPRI_B5 @ stages
+        error = np.max(np.abs(dt * (DOPRI_B5 - DOPRI_B4) @ stages)
+                       / (error_scale + tolerance * np.maximum(np.abs(state), np.abs(new_state))))
+        
+        if error <= 1:
+            current_time += dt
+            state = new_state
+            #first same as last: the seventh stage is the slope at the new state
+            slope = stages[6]
+            time_list.append(current_time)
+            state_list.append(state)
+            slope_list.append(slope)
+            
+            if progress_callback is not None and len(time_list) % PROGRESS_INTERVAL == 0:
+                progress_callback(current_time / (max_steps * step_time), 0)
+            
+            if events is not None:
+                event = events.check(*state, *slope[2:])
+                if event is not None:
+                    termination = event
+                    #the resampled path ends at the last grid time before the event
+                    number_of_steps = int(math.floor(round(current_time / step_time, 6)))
+                    break
+        
+        dt *= min(5.0, max(0.2, 0.9 * error**-0.2)) if error > 0 else 5.0
+    
+    times = np.arange(number_of_steps + 1) * step_time
+    x, y, vx, vy = hermite_resample(np.array(time_list), np.array(state_list), np.array(slope_list), times)
+    
+    electron.reset_electron(number_of_steps)
+    trajectory = electron.trajectory
+    trajectory.t[:] = times
+    trajectory.x[:], trajectory.y[:] = x, y
+    trajectory.vx[:], trajectory.vy[:] = vx, vy
+    trajectory.ax[:], trajectory.ay[:] = acceleration_function(x, y)
+    return force_evaluations, termination
+
+def hermite_resample(sample_times, states, slopes, times):
+    indices = np.clip(np.searchsorted(sample_times, times, side="right") - 1, 0, len(sample_times) - 2)
+    dt = sample_times[indices + 1] - sample_times[indices]
+    s = ((times - sample_times[indices]) / dt)[:, np.newaxis]
+    
+    h00 = 2 * s**3 - 3 * s**2 + 1
+    h10 = s**3 - 2 * s**2 + s
+    h01 = -2 * s**3 + 3 * s**2
+    h11 = s**3 - s**2
+    
+    resampled = (h00 * states[indices] + h10 * dt[:, np.newaxis] * slopes[indices]
+                 + h01 * states[indices + 1] + h11 * dt[:, np.newaxis] * slopes[indices + 1])
+    return resampled.T
+
+def fire_electron_analytic(electron, nucleus_charge, number_of_steps, step_time,
+                           psd_accumulator=None, store_trajectory=True, events=None, max_steps=None,
+                           progress_callback=None):
+    
+    if max_steps is None:
+        max_steps = number_of_steps
+    electron.reset_electron(number_of_steps if store_trajectory else 1)
+    trajectory = electron.trajectory
+    
+    termination = "run_time"
+    start = 0
+    while True:
+        while start <= number_of_steps:
+            #without a stored trajectory the orbit is sampled a chunk at a time
+            stop = number_of_steps + 1 if store_trajectory else min(start + PSD_CHUNK_SIZE, number_of_steps + 1)
+            times = np.arange(start, stop) * step_time
+            x, y, vx, vy = kepler_orbit(nucleus_charge, electron.initial_distance, electron.impact_parameter,
+                                        -electron.initial_velocity, 0.0, times)
+            ax, ay = calculate_acceleration(nucleus_charge, x, y)
+            
+            if events is not None:
+                index, event = events.first_event(x, y, vx, vy, ax, ay)
+                if event is not None:
+                    termination = event
+                    stop = start + index + 1
+                    times, x, y, vx, vy, ax, ay = [values[:index + 1] for values in (times, x, y, vx, vy, ax, ay)]
+            
+            if store_trajectory:
+                trajectory.t[start:stop] = times
+                trajectory.x[start:stop], trajectory.y[start:stop] = x, y
+                trajectory.vx[start:stop], trajectory.vy[start:stop] = vx, vy
+                trajectory.ax[start:stop], trajectory.ay[start:stop] = ax, ay
+            if psd_accumulator is not None:
+                psd_accumulator.update(np.sqrt(ax**2 + ay**2))
+            start = stop
+            if termination != "run_time":
+                break
+            if progress_callback is not None:
+                progress_callback((start - 1) / max_steps, start if store_trajectory else 0)
+        
+        if termination != "run_time" or number_of_steps >= max_steps:
+            break
+        #no event yet, keep going
+        number_of_steps = extended_number_of_steps(number_of_steps, max_steps)
+        if store_trajectory:
+            trajectory.grow(number_of_steps)
+    last_step = start - 1
+    
+    if store_trajectory:
+        trajectory.trim(last_step + 1)
+    else:
+        trajectory.t[:] = 0.0, last_step * step_time
+        trajectory.x[:], trajectory.y[:], trajectory.vx[:], trajectory.vy[:] = kepler_orbit(
+            nucleus_charge, electron.initial_distance, electron.impact_parameter,
+            -electron.initial_velocity, 0.0, trajectory.t)
+        trajectory.ax[:], trajectory.ay[:] = calculate_acceleration(nucleus_charge, trajectory.x, trajectory.y)
+    return termination
+
+def orbit_elements(nucleus_charge, x, y, vx, vy):
+    """
+    Elements of the exact orbit through the state (x, y, vx, vy) about the nucleus:
+    semi-major axis (magnitude), eccentricity, mean motion, mean anomaly at that state,
+    periapsis direction and sense of rotation. The orbit is a hyperbola when the
+    electron is unbound and an ellipse when it is bound.
+    """
+    coulomb_parameter = COULOMB_CONSTANT * nucleus_charge * ELECTRON_CHARGE**2 / ELECTRON_MASS
+    r = math.hypot(x, y)
+    speed_squared = vx**2 + vy**2
+    radial_velocity = x * vx + y * vy
+    energy = 0.5 * speed_squared - coulomb_parameter / r
+    angular_momentum = x * vy - y * vx
+    if angular_momentum == 0:
+        raise ValueError("The electron is fired straight at the nucleus, its orbit has no analytic form")
+    if energy == 0:
+        raise ValueError("Parabolic orbits are not supported by the analytic solver")
+    
+    eccentricity_x = ((speed_squared - coulomb_parameter / r) * x - radial_velocity * vx) / coulomb_parameter
+    eccentricity_y = ((speed_squared - coulomb_parameter / r) * y - radial_velocity * vy) / coulomb_parameter
+    eccentricity = math.hypot(eccentricity_x, eccentricity_y)
+    semi_major_axis = coulomb_parameter / (2 * abs(energy))
+    mean_motion = math.sqrt(coulomb_parameter / semi_major_axis**3)
+    
+    if energy > 0:
+        #r = a (e cosh H - 1) and r.v = sqrt(mu a) e sinh H
+        anomaly = math.asinh(radial_velocity / (math.sqrt(coulomb_parameter * semi_major_axis) * eccentricity))
+        mean_anomaly = eccentricity * math.sinh(anomaly) - anomaly
+    else:
+        #r = a (1 - e cos E) and r.v = sqrt(mu a) e sin E
+        anomaly = math.atan2(radial_velocity / math.sqrt(coulomb_parameter * semi_major_axis),
+                             1 - r / semi_major_axis)
+        mean_anomaly = anomaly - eccentricity * math.sin(anomaly)
+    
+    if eccentricity > 0:
+        periapsis_direction = (eccentricity_x / eccentricity, eccentricity_y / eccentricity)
+    else:
+        periapsis_direction = (x / r, y / r)
+    
+    return {"bound": energy < 0,
+            "semi_major_axis": semi_major_axis,
+            "eccentricity": eccentricity,
+            "mean_motion": mean_motion,
+            "mean_anomaly": mean_anomaly,
+            "periapsis_direction": periapsis_direction,
+            "rotation": math.copysign(1.0, angular_momentum)}
+
+def asymptotic_direction(nucleus_charge, x, y, vx, vy, outgoing=True):
+    """
+    Direction of motion at infinity on the hyperbola through a state, on the way out
+    or (outgoing=False) on the way in. Taken from the last state of a run, it carries
+    any error the integrator made into the deflection angle.
+    """
+    elements = orbit_elements(nucleus_charge, x, y, vx, vy)
+    true_anomaly = math.acos(-1 / elements["eccentricity"])
+    if not outgoing:
+        true_anomaly = -true_anomaly
+    px, py = elements["periapsis_direction"]
+    qx, qy = -elements["rotation"] * py, elements["rotation"] * px
+    direction_x = math.cos(true_anomaly) * px + math.sin(true_anomaly) * qx
+    direction_y = math.cos(true_anomaly) * py + math.sin(true_anomaly) * qy
+    #coming in, the electron moves against the position direction of the incoming branch
+    return (direction_x, direction_y) if outgoing else (-direction_x, -direction_y)
+
+def kepler_orbit(nucleus_charge, x, y, vx, vy, times, tolerance=1E-13, max_iterations=200):
+    """
+    Position and velocity on the exact orbit through the state (x, y, vx, vy) at each of
+    times (seconds after that state). Kepler's equation is solved for every time at once
+    with Newton iterations on numpy arrays, falling back to bisection whenever a Newton
+    step leaves the bracket around the root (near-parabolic orbits need this).
+    """
+    elements = orbit_elements(nucleus_charge, x, y, vx, vy)
+    a = elements["semi_major_axis"]
+    e = elements["eccentricity"]
+    mean_anomaly = elements["mean_anomaly"] + elements["mean_motion"] * np.asarray(times, dtype=float)
+    
+    if elements["bound"]:
+        mean_anomaly = np.mod(mean_anomaly, 2 * math.pi)
+        #|e sin E| <= e, so E is within e of the mean anomaly
+        lower, upper = mean_anomaly - e, mean_anomaly + e
+        kepler_equation = lambda anomaly: anomaly - e * np.sin(anomaly) - mean_anomaly
+        kepler_slope = lambda anomaly: 1 - e * np.cos(anomaly)
+    else:
+        #(e - 1) |sinh H| <= |e sinh H - H| <= e |sinh H| on the side of the mean anomaly
+        inner = np.arcsinh(mean_anomaly / e)
+        outer = np.arcsinh(mean_anomaly / (e - 1))
+        lower, upper = np.minimum(inner, outer), np.maximum(inner, outer)
+        kepler_equation = lambda anomaly: e * np.sinh(anomaly) - anomaly - mean_anomaly
+        kepler_slope = lambda anomaly: e * np.cosh(anomaly) - 1
+    
+    anomaly = 0.5 * (lower + upper)
+    for _ in range(max_iterations):
+        residual = kepler_equation(anomaly)
+        upper = np.where(residual > 0, anomaly, upper)
+        lower = np.where(residual > 0, lower, anomaly)
+        new_anomaly = anomaly - residual / kepler_slope(anomaly)
+        outside = ~((new_anomaly > lower) & (new_anomaly < upper))
+        new_anomaly[outside] = 0.5 * (lower[outside] + upper[outside])
+        
+        correction = np.max(np.abs(new_anomaly - anomaly), initial=0)
+        anomaly = new_anomaly
+        if correction <= tolerance * (1 + np.max(np.abs(anomaly), initial=0)):
+            break
+    else:
+        raise RuntimeError(f"Kepler's equation did not converge in {max_iterations} iterations")
+    
+    #position and velocity along (p) and perpendicular to (q) the periapsis direction
+    anomaly_rate = elements["mean_motion"] / kepler_slope(anomaly)
+    if elements["bound"]:
+        minor_axis_factor = a * math.sqrt(1 - e**2)
+        p = a * (np.cos(anomaly) - e)
+        q = minor_axis_factor * np.sin(anomaly)
+        vp = -a * np.sin(anomaly) * anomaly_rate
+        vq = minor_axis_factor * np.cos(anomaly) * anomaly_rate
+    else:
+        minor_axis_factor = a * math.sqrt(e**2 - 1)
+        p = a * (e - np.cosh(anomaly))
+        q = minor_axis_factor * np.sinh(anomaly)
+        vp = -a * np.sinh(anomaly) * anomaly_rate
+        vq = minor_axis_factor * np.cosh(anomaly) * anomaly_rate
+    
+    px, py = elements["periapsis_direction"]
+    qx, qy = -elements["rotation"] * py, elements["rotation"] * px
+    return p * px + q * qx, p * py + q * qy, vp * px + vq * qx, vp * py + vq * qy
+
+@instrumentation.timed("conservation_diagnostics")
+def conservation_diagnostics(trajectory, nucleus_charge, ion_field=None):
+    """
+    Returns the largest drift of the specific energy and angular momentum of a trajectory.
+    Energy drift is relative to the initial kinetic plus the magnitude of the potential
+    energy, so it stays meaningful for near-parabolic orbits.
+    
+    In an ion_field angular momentum is not conserved and its drift is None. The potential
+    of many ions is costly, so the energy is only checked at DIAGNOSTIC_SAMPLES states
+    spread over the run.
+    """
+    if ion_field is None:
+        x, y, vx, vy = trajectory.x, trajectory.y, trajectory.vx, trajectory.vy
+        coulomb_parameter = COULOMB_CONSTANT * nucleus_charge * ELECTRON_CHARGE**2 / ELECTRON_MASS
+        potential_energy = -coulomb_parameter / np.hypot(x, y)
+    else:
+        samples = np.unique(np.linspace(0, len(trajectory.t) - 1, DIAGNOSTIC_SAMPLES).astype(int))
+        x, y = trajectory.x[samples], trajectory.y[samples]
+        vx, vy = trajectory.vx[samples], trajectory.vy[samples]
+        potential_energy = ion_field.potential(x, y)
+    kinetic_energy = 0.5 * (vx**2 + vy**2)
+    energy = kinetic_energy + potential_energy
+    
+    energy_scale = kinetic_energy[0] + abs(potential_energy[0])
+    diagnostics = {"energy_drift": float(np.max(np.abs(energy - energy[0])) / energy_scale),
+                   "angular_momentum_drift": None}
+    if ion_field is None:
+        angular_momentum = x * vy - y * vx
+        diagnostics["angular_momentum_drift"] = float(np.max(np.abs(angular_momentum - angular_momentum[0]))
+                                                      / abs(angular_momentum[0]))
+    return diagnostics
         
 def calculate_acceleration(nucleus_charge, current_x_position, current_y_position):
     r_squared = current_x_position**2 + current_y_position**2
-    r = math.sqrt(r_squared)
+    #math.sqrt for single positions, np.sqrt when whole arrays of positions are passed
+    r = np.sqrt(r_squared) if isinstance(r_squared, np.ndarray) else math.sqrt(r_squared)
     r_cube = r**3
 
     force_x = -(COULOMB_CONSTANT * nucleus_charge * ELECTRON_CHARGE**2 / r_cube) * current_x_position
@@ -95,48 +885,624 @@ def calculate_acceleration(nucleus_charge, current_x_position, current_y_positio
     return acceleration_x, acceleration_y
             
 def graph_electron_path(electron):
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(10,10))
     electron_x_path = electron.position_dict["x"]
     electron_y_path = electron.position_dict["y"]
     
-    r_list = []
-    theta_list = []
-    for position in range(0, len(electron_x_path)):
-        current_x_pos = electron_x_path[position]
-        current_y_pos = electron_y_path[position]
-        
-        c = complex(current_x_pos, current_y_pos)
-        r,theta = cmath.polar(c)
-        
-        r_list.append(r)
-        theta_list.append(theta)
+    r_list = np.hypot(electron_x_path, electron_y_path)
+    theta_list = np.arctan2(electron_y_path, electron_x_path)
+    
+    plt.polar(*downsample_min_max(theta_list, r_list))
     
-    plt.polar(theta_list,r_list)
+def downsample_min_max(x_values, y_values, number_of_bins=PLOT_BINS):
+    """
+    Shrinks a series for plotting by keeping only the smallest and largest y value of
+    each of number_of_bins equal slices (plus both ends), in their original order.
+    Peaks survive, so the line looks the same at screen resolution however long the run was.
+    """
+    x_values = np.asarray(x_values)
+    y_values = np.asarray(y_values)
+    length = len(y_values)
+    if length <= 2 * number_of_bins:
+        return x_values, y_values
     
+    bin_size = -(-length // number_of_bins)
+    number_of_full_bins = length // bin_size
+    #a view of the full bins, so memory-mapped series are not copied
+    full_bins = y_values[:number_of_full_bins * bin_size].reshape(number_of_full_bins, bin_size)
+    bin_starts = np.arange(number_of_full_bins) * bin_size
+    indices = [[0, length - 1], bin_starts + np.argmin(full_bins, axis=1), bin_starts + np.argmax(full_bins, axis=1)]
+    tail_start = number_of_full_bins * bin_size
+    if tail_start < length:
+        tail = y_values[tail_start:]
+        indices.append([tail_start + np.argmin(tail), tail_start + np.argmax(tail)])
+    indices = np.unique(np.concatenate(indices))
+    return x_values[indices], y_values[indices]
+    
+@instrumentation.timed("get_psd")
 def get_psd(times, data):
     fsample = 1/np.nanmedian(np.diff(times))
     detrend = 'constant'
-    nperseg = 2**7
-    fs, Pxx = signal.welch(data, nperseg=nperseg, fs=fsample, detrend=detrend)
+    nperseg = PSD_NPERSEG
+    fs, Pxx = signal.welch(np.asarray(data), nperseg=nperseg, fs=fsample, detrend=detrend)
     return fs, Pxx
 
+class StreamingWelch:
+    """
+    Welch's PSD estimate built up from samples as they arrive, so the signal never has
+    to be held in memory. Every completed segment of nperseg samples (overlapping the
+    previous one by noverlap) is detrended, windowed and FFT'd into a running sum.
+    result() gives the same one-sided density as signal.welch with the same settings.
+    """
+    
+    def __init__(self, sample_rate, nperseg=PSD_NPERSEG, noverlap=None, window="hann"):
+        if noverlap is None:
+            noverlap = nperseg // 2
+        if not 0 <= noverlap < nperseg:
+            raise ValueError(f"noverlap must be between 0 and nperseg - 1, got {noverlap}")
+        self.sample_rate = sample_rate
+        self.nperseg = nperseg
+        self.noverlap = noverlap
+        self.window = signal.get_window(window, nperseg)
+        
+        self.buffer = np.empty(0)
+        self.power_sum = np.zeros(nperseg // 2 + 1)
+        self.number_of_segments = 0
+        self.number_of_samples = 0
+        
+    @instrumentation.timed("StreamingWelch.update")
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=float).ravel()
+        self.number_of_samples += len(samples)
+        data = np.concatenate((self.buffer, samples))
+        
+        segment_step = self.nperseg - self.noverlap
+        number_of_new_segments = 0
+        if len(data) >= self.nperseg:
+            number_of_new_segments = (len(data) - self.nperseg) // segment_step + 1
+            segments = np.lib.stride_tricks.sliding_window_view(data, self.nperseg)[::segment_step]
+            segments = segments[:number_of_new_segments]
+            segments = segments - segments.mean(axis=1, keepdims=True)
+            spectra = np.fft.rfft(segments * self.window, axis=1)
+            self.power_sum += np.sum(spectra.real**2 + spectra.imag**2, axis=0)
+            self.number_of_segments += number_of_new_segments
+        
+        #keep what the next segment still needs
+        self.buffer = data[number_of_new_segments * segment_step:].copy()
+        
+    def result(self):
+        if self.number_of_segments == 0:
+            raise ValueError(f"Need at least nperseg = {self.nperseg} samples, got {self.number_of_samples}")
+        Pxx = self.power_sum / (self.number_of_segments * self.sample_rate * np.sum(self.window**2))
+        #one-sided: fold the negative frequencies in, except at DC and Nyquist
+        if self.nperseg % 2 == 0:
+            Pxx[1:-1] *= 2
+        else:
+            Pxx[1:] *= 2
+        fs = np.fft.rfftfreq(self.nperseg, 1 / self.sample_rate)
+        return fs, Pxx
+
 def convert_bohr_to_meter(distance):
     return distance * (5.29E-11)
 
+@instrumentation.timed("get_total_acc_list")
 def get_total_acc_list(x_acc_list, y_acc_list):
-    acc_list = []
-    for i in range(0, len(x_acc_list)):
-        x_acc = x_acc_list[i]
-        y_acc = y_acc_list[i]
+    x_acc_list = np.asarray(x_acc_list, dtype=float)
+    y_acc_list = np.asarray(y_acc_list, dtype=float)
+    return np.sqrt(x_acc_list**2 + y_acc_list**2)
+
+class ElectronEnsemble:
+    """
+    Many electrons fired at the same nucleus, integrated together as numpy arrays.
+    Only the size of the acceleration of each electron is kept at every step,
+    in an array of shape (number of electrons, number_of_steps + 1).
+    """
+    
+    def __init__(self, initial_distances, initial_velocities, impact_parameters, weights=None):
+        (self.initial_distances,
+         self.initial_velocities,
+         self.impact_parameters) = [np.array(values, dtype=float) for values in
+                                    np.broadcast_arrays(initial_distances, initial_velocities,
+                                                        impact_parameters)]
+        if weights is None:
+            weights = np.ones(len(self))
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), (len(self),))
         
-        acc = math.sqrt(x_acc**2 + y_acc**2)
-        acc_list.append(acc)
+        self.reset_ensemble(0, np.zeros(len(self)))
         
-    return acc_list
+    def __len__(self):
+        return len(self.initial_distances)
+        
+    def reset_ensemble(self, number_of_steps, step_times):
+        self.step_times = np.broadcast_to(np.asarray(step_times, dtype=float), (len(self),)).copy()
+        self.acceleration = np.zeros((len(self), number_of_steps + 1))
+        self.finished_step = np.full(len(self), number_of_steps)
+        self.x = self.initial_distances.copy()
+        self.y = self.impact_parameters.copy()
+        self.vx = -self.initial_velocities
+        self.vy = np.zeros(len(self))
+
+def impact_parameter_weights(impact_parameters):
+    """Weights 2 pi b db, so a uniform beam is represented by electrons on a grid of impact parameters"""
+    impact_parameters = np.asarray(impact_parameters, dtype=float)
+    if len(impact_parameters) < 2:
+        return 2 * math.pi * impact_parameters
+    return 2 * math.pi * impact_parameters * np.abs(np.gradient(impact_parameters))
+
+def fire_electron_ensemble(ensemble, nucleus_charge, run_times, number_of_steps, integrator="verlet",
+                           escape_radius_factor=2.0, collision_radius=1E-15, ion_field=None):
+    """
+    Integrates every electron of an ensemble with the same fixed-step integrator,
+    one vectorized step for all still active electrons at a time. Electron i takes
+    number_of_steps steps of run_times[i] / number_of_steps.
+    
+    An electron is finished and masked out once it moves away from the nucleus beyond
+    escape_radius_factor times its initial distance, or comes within collision_radius
+    of it. Its acceleration is zero from then on.
+    
+    With an ion_field the electrons move through the field of its ions instead of the
+    nucleus (see fire_electron); the escape and collision checks still use the origin.
+    """
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Unknown ensemble integrator '{integrator}', expected one of {list(INTEGRATORS)}")
+    stepper = INTEGRATORS[integrator][0]
+    if ion_field is None:
+        acceleration_function = instrumentation.wrap("calculate_acceleration",
+                                                     functools.partial(calculate_acceleration, nucleus_charge))
+    else:
+        acceleration_function = instrumentation.wrap("IonField.acceleration", ion_field.acceleration)
+    
+    ensemble.reset_ensemble(number_of_steps, np.asarray(run_times, dtype=float) / number_of_steps)
+    escape_radius = escape_radius_factor * np.hypot(ensemble.initial_distances, ensemble.impact_parameters)
+    
+    #state of the active electrons only, active_indices maps them back to the ensemble
+    active_indices = np.arange(len(ensemble))
+    x, y = ensemble.x.copy(), ensemble.y.copy()
+    vx, vy = ensemble.vx.copy(), ensemble.vy.copy()
+    ax, ay = acceleration_function(x, y)
+    step_times = ensemble.step_times.copy()
+    escape_radius_squared = escape_radius**2
+    ensemble.acceleration[:, 0] = np.hypot(ax, ay)
+    
+    with instrumentation.span(f"fire_electron_ensemble.{integrator}") as run_span:
+        for step in range(1, number_of_steps + 1):
+            x, y, vx, vy, ax, ay = stepper(acceleration_function, x, y, vx, vy, ax, ay, step_times)
+            ensemble.acceleration[active_indices, step] = np.hypot(ax, ay)
+        
+            r_squared = x**2 + y**2
+            finished = (((r_squared > escape_radius_squared) & (x * vx + y * vy > 0))
+                        | (r_squared < collision_radius**2))
+            if finished.any():
+                finished_indices = active_indices[finished]
+                ensemble.finished_step[finished_indices] = step
+                ensemble.x[finished_indices], ensemble.y[finished_indices] = x[finished], y[finished]
+                ensemble.vx[finished_indices], ensemble.vy[finished_indices] = vx[finished], vy[finished]
+            
+                active = ~finished
+                active_indices = active_indices[active]
+                x, y, vx, vy, ax, ay = x[active], y[active], vx[active], vy[active], ax[active], ay[active]
+                step_times = step_times[active]
+                escape_radius_squared = escape_radius_squared[active]
+                if len(active_indices) == 0:
+                    break
+        run_span.add_steps(int(ensemble.finished_step.sum()))
+    
+    ensemble.x[active_indices], ensemble.y[active_indices] = x, y
+    ensemble.vx[active_indices], ensemble.vy[active_indices] = vx, vy
+    return ensemble
+
+@instrumentation.timed("get_ensemble_psd")
+def get_ensemble_psd(ensemble, number_of_frequencies=512):
+    """
+    Adds the weighted PSDs of every electron in an ensemble into a total emission spectrum.
+    Each PSD only covers the electron's own run, up to the step it finished at, so the
+    zero acceleration after it does not dilute the average. Electrons have different
+    sample rates, so every PSD is interpolated onto a common logarithmic frequency grid
+    (and is zero outside its own frequency range).
+    """
+    #a sample rate of 1 / step_time scales frequencies up and the density down
+    sample_rates = 1 / ensemble.step_times
+    lengths = ensemble.finished_step + 1
+    frequency_lists, psd_lists = [None] * len(ensemble), [None] * len(ensemble)
+    #electrons that ran for the same number of steps share one welch call
+    for length in np.unique(lengths):
+        electrons = np.flatnonzero(lengths == length)
+        unit_fs, unit_Pxx = signal.welch(ensemble.acceleration[electrons, :length], nperseg=min(PSD_NPERSEG, length),
+                                         fs=1.0, detrend='constant', axis=-1)
+        for electron, electron_Pxx in zip(electrons, unit_Pxx):
+            frequency_lists[electron] = unit_fs * sample_rates[electron]
+            psd_lists[electron] = electron_Pxx / sample_rates[electron]
+    return combine_psds(frequency_lists, psd_lists, ensemble.weights, number_of_frequencies)
+
+def combine_psds(frequency_lists, psd_lists, weights, number_of_frequencies=512):
+    """
+    Weighted sum of PSDs that were taken at different sample rates. Every PSD is
+    interpolated onto one logarithmic frequency grid spanning all of them, and is
+    zero outside its own frequency range.
+    """
+    #the PSDs may have different lengths, so they are only turned into arrays one at a time
+    frequency_lists = [np.asarray(frequency_list, dtype=float) for frequency_list in frequency_lists]
+    psd_lists = [np.asarray(psd_list, dtype=float) for psd_list in psd_lists]
+    lowest_frequency = min(frequency_list[1] for frequency_list in frequency_lists)
+    highest_frequency = max(frequency_list[-1] for frequency_list in frequency_lists)
+    fs = np.logspace(np.log10(lowest_frequency), np.log10(highest_frequency), number_of_frequencies)
+    
+    total_Pxx = np.zeros(number_of_frequencies)
+    for frequency_list, psd_list, weight in zip(frequency_lists, psd_lists, weights):
+        total_Pxx += weight * np.interp(fs, frequency_list, psd_list, left=0.0, right=0.0)
+    return fs, total_Pxx
+
+def periapsis_time(initial_distance, impact_parameter, initial_velocity, nucleus_charge):
+    """
+    Periapsis distance over the speed there, r_p^2 / L, for the electron's exact orbit:
+    the time scale of the closest pass, which sets the step a fixed step integrator
+    needs. None for a head on electron, which has no periapsis.
+    """
+    try:
+        elements = orbit_elements(nucleus_charge, initial_distance, impact_parameter, -initial_velocity, 0.0)
+    except ValueError:
+        return None
+    if elements["bound"]:
+        periapsis_distance = elements["semi_major_axis"] * (1 - elements["eccentricity"])
+    else:
+        periapsis_distance = elements["semi_major_axis"] * (elements["eccentricity"] - 1)
+    return periapsis_distance**2 / (impact_parameter * initial_velocity)
+
+def run_settings(initial_distance, impact_parameter, initial_velocity, nucleus_charge, integrator):
+    """
+    Run time, step time and events used for one electron by the GUI and the sweeps, and
+    whether verlet or rk4 needed more than MAX_STEPS_PER_RUN steps to resolve the closest
+    pass and got a coarser step than that needs (step_capped)
+    """
+    radius = math.sqrt(initial_distance**2 + impact_parameter**2)
+    rough_orbit_time = 2 * math.pi * radius / initial_velocity
+    
+    run_time = rough_orbit_time * 3
+    step_time = run_time / STEPS_PER_RUN[integrator]
+    step_capped = False
+    if integrator in STEPS_PER_PERIAPSIS_TIME:
+        pass_time = periapsis_time(initial_distance, impact_parameter, initial_velocity, nucleus_charge)
+        if pass_time is not None:
+            step_time = min(step_time, pass_time / STEPS_PER_PERIAPSIS_TIME[integrator])
+        step_capped = step_time < run_time / MAX_STEPS_PER_RUN
+        step_time = max(step_time, run_time / MAX_STEPS_PER_RUN)
+    #stop once the electron has left twice as far as it started, the interaction is over by then
+    events = RunEvents(collision_radius=NUCLEUS_RADIUS, escape_radius=2 * radius)
+    return run_time, step_time, events, step_capped
+
+class TrajectoryCache:
+    """
+    Least recently used cache of finished runs (trajectory, diagnostics and PSD), so
+    going back to earlier slider settings skips both the integration and the PSD.
+    With a spill_directory, runs evicted from memory are saved there as .npz files
+    and loaded back from disk on a later miss. Arrays are stored read-only.
+    """
+    
+    def __init__(self, max_size=16, spill_directory=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.spill_directory = spill_directory
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+    def get_or_calculate(self, key, calculate):
+        """
+        Returns the cached result for key, or calls calculate() and caches its result,
+        evicting (and spilling) the least recently used entry if the cache is full
+        """
+        result = self.get(key)
+        if result is None:
+            result = self.put(key, calculate())
+        return result
+    
+    def get(self, key):
+        """Returns the cached result for key from memory or the spill directory, None on a miss"""
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                self.results.move_to_end(key)
+                return self.results[key]
+        
+        result = self.load_spilled(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        return self.put(key, result)
+    
+    def put(self, key, result):
+        trajectory, diagnostics, fs, Pxx = result
+        for values in [getattr(trajectory, name) for name in trajectory.__slots__] + [fs, Pxx]:
+            values.flags.writeable = False
+        
+        with self.lock:
+            self.results[key] = result
+            evicted = self.results.popitem(last=False) if len(self.results) > self.max_size else None
+        if evicted is not None:
+            self.spill(*evicted)
+        return result
+    
+    def spill_path(self, key):
+        key_hash = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.spill_directory, f"{key_hash}.npz")
+    
+    def spill(self, key, result):
+        if self.spill_directory is None:
+            return
+        trajectory, diagnostics, fs, Pxx = result
+        os.makedirs(self.spill_directory, exist_ok=True)
+        np.savez(self.spill_path(key), fs=fs, psd=Pxx, diagnostics=json.dumps(diagnostics),
+                 **{name: getattr(trajectory, name) for name in trajectory.__slots__})
+    
+    def load_spilled(self, key):
+        if self.spill_directory is None or not os.path.exists(self.spill_path(key)):
+            return None
+        with np.load(self.spill_path(key)) as spilled:
+            trajectory = ElectronTrajectory(0)
+            for name in trajectory.__slots__:
+                setattr(trajectory, name, spilled[name])
+            return trajectory, json.loads(str(spilled["diagnostics"])), spilled["fs"], spilled["psd"]
+    
+    def clear(self):
+        """Empties the memory cache and resets the counters; runs spilled to disk are kept"""
+        with self.lock:
+            self.results.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+        
+    def __len__(self):
+        return len(self.results)
+    
+    def __repr__(self):
+        return (f"TrajectoryCache(size={len(self)}/{self.max_size}, hits={self.hits}, "
+                f"disk_hits={self.disk_hits}, misses={self.misses})")
+
+def trajectory_cache_key(initial_distance, impact_parameter, initial_velocity, nucleus_charge,
+                         integrator, run_time, step_time, tolerance, events):
+    """Builds a hashable cache key from everything that changes the result of fire_electron"""
+    event_settings = tuple(sorted(vars(events).items())) if events is not None else None
+    return (float(initial_distance), float(impact_parameter), float(initial_velocity), float(nucleus_charge),
+            integrator, float(run_time), float(step_time), float(tolerance), event_settings)
+
+trajectory_cache = TrajectoryCache(max_size=16)
+
+@instrumentation.timed("simulate_electron")
+def simulate_electron(initial_distance, impact_parameter, initial_velocity, nucleus_charge,
+                      integrator="euler", tolerance=1E-9, cache=trajectory_cache, progress_callback=None):
+    """
+    Fires an electron with the run settings of the GUI and takes the PSD of its
+    acceleration, reusing an earlier run with the same inputs if the cache still holds it.
+    progress_callback is passed on to fire_electron, with the electron as first argument.
+    Returns (trajectory, diagnostics, fs, Pxx).
+    """
+    run_time, step_time, events, step_capped = run_settings(initial_distance, impact_parameter, initial_velocity,
+                                                            nucleus_charge, integrator)
+    
+    def calculate():
+        electron = Electron(initial_distance, initial_velocity, impact_parameter)
+        electron_progress_callback = None
+        if progress_callback is not None:
+            electron_progress_callback = functools.partial(progress_callback, electron)
+        diagnostics = fire_electron(electron, nucleus_charge, run_time, step_time, integrator=integrator,
+                                    tolerance=tolerance, events=events,
+                                    progress_callback=electron_progress_callback)
+        diagnostics["step_capped"] = step_capped
+        trajectory = electron.trajectory
+        fs, Pxx = get_psd(trajectory.t, get_total_acc_list(trajectory.ax, trajectory.ay))
+        return trajectory, diagnostics, fs, Pxx
+    
+    if cache is None:
+        return calculate()
+    return cache.get_or_calculate(simulation_cache_key(initial_distance, impact_parameter, initial_velocity,
+                                                       nucleus_charge, integrator, tolerance), calculate)
+
+def simulation_cache_key(initial_distance, impact_parameter, initial_velocity, nucleus_charge,
+                         integrator="euler", tolerance=1E-9):
+    """The trajectory_cache_key simulate_electron uses for these inputs"""
+    run_time, step_time, events, _ = run_settings(initial_distance, impact_parameter, initial_velocity,
+                                                  nucleus_charge, integrator)
+    return trajectory_cache_key(initial_distance, impact_parameter, initial_velocity, nucleus_charge,
+                                integrator, run_time, step_time, tolerance, events)
+
+def run_electron_worker(messages, cancel_event, parameters, integrator, instrumented=False):
+    """
+    Runs simulate_electron in a worker process. Progress, with the part of the path
+    calculated so far ready to plot, and then the result are put on the messages queue.
+    When instrumented, what the worker recorded is sent ahead of the result.
+    """
+    if instrumented:
+        instrumentation.enable()
+    def report_progress(electron, fraction, stored_steps):
+        if cancel_event.is_set():
+            raise CalculationCancelled()
+        partial_series = None
+        if stored_steps > 1:
+            partial_series = trajectory_plot_series(electron.trajectory, stored_steps)
+        messages.put(("progress", (fraction, partial_series)))
+    
+    try:
+        result = simulate_electron(*parameters, integrator=integrator, cache=None,
+                                   progress_callback=report_progress)
+    except CalculationCancelled:
+        messages.put(("cancelled", None))
+    except Exception as error:
+        messages.put(("error", f"{type(error).__name__}: {error}"))
+    else:
+        if instrumented:
+            messages.put(("instrumentation", instrumentation.snapshot()))
+        messages.put(("done", result))
+
+class ElectronWorker:
+    """
+    Runs simulate_electron in a separate process so the Tk window never waits on the
+    integration. Progress and the result come back through a multiprocessing queue that
+    the Tk event loop polls with after(), so on_progress and on_done run on the Tk thread.
+    """
+    
+    def __init__(self, window, parameters, integrator, on_done, on_progress=None, poll_interval=50):
+        """
+        params:
+        window (tk.Tk): window whose event loop receives the results
+        parameters (float, float, float, float): initial distance (m), impact parameter (m),
+                                                 initial velocity (m/s) and nucleus charge (e-)
+        integrator (str): integrator passed to fire_electron
+        on_done (callable): called with (trajectory, diagnostics, fs, Pxx) when the run finishes
+        on_progress (callable): called with the fraction done and the plot series of the path
+                                so far (or None), or with (None, None) if the run fails
+        poll_interval (int): milliseconds between checks of the queue
+        """
+        self.window = window
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.poll_interval = poll_interval
+        self.finished = False
+        
+        #spawn, since forking a process that runs Tk is not safe
+        context = multiprocessing.get_context("spawn")
+        self.messages = context.Queue()
+        self.cancel_event = context.Event()
+        self.process = context.Process(target=run_electron_worker,
+                                       args=(self.messages, self.cancel_event, parameters, integrator,
+                                             instrumentation.ENABLED),
+                                       daemon=True)
+        self.process.start()
+        self.window.after(self.poll_interval, self.poll)
+        
+    def poll(self):
+        if self.cancel_event.is_set():
+            return
+        latest_progress = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            
+            if kind == "progress":
+                latest_progress = value
+                continue
+            if kind == "instrumentation":
+                instrumentation.merge(value)
+                continue
+            
+            self.finished = True
+            if kind == "cancelled":
+                return
+            if kind == "error":
+                if self.on_progress is not None:
+                    self.on_progress(None, None)
+                raise RuntimeError(value)
+            self.on_done(value)
+            return
+        
+        if not self.process.is_alive() and self.messages.empty():
+            self.finished = True
+            if self.on_progress is not None:
+                self.on_progress(None, None)
+            raise RuntimeError(f"The worker process stopped with exit code {self.process.exitcode}")
+        
+        if latest_progress is not None and self.on_progress is not None:
+            self.on_progress(*latest_progress)
+        self.window.after(self.poll_interval, self.poll)
+        
+    def cancel(self):
+        """
+        Stops the worker process at once. The worker only checks cancel_event when it
+        reports progress, which a long rk45 run or the PSD can keep it from doing for a
+        while, so the process is terminated and its queue, which may be left broken, closed.
+        """
+        self.cancel_event.set()
+        self.finished = True
+        self.process.terminate()
+        self.process.join()
+        self.messages.close()
+
+class PlotPanel:
+    """
+    One of the four graphs of the main menu. The axes and lines are made once and every
+    calculation only swaps the line data. The lines are animated, so while the data stays
+    inside the current limits the panel is updated by blitting the lines over a saved
+    background instead of redrawing the whole figure.
+    """
+    
+    def __init__(self, master, row, column, title, ylabel, xlabel, labels, log=False):
+        self.figure = Figure(figsize=(6,4))
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_title(title)
+        self.axes.set_ylabel(ylabel)
+        self.axes.set_xlabel(xlabel)
+        if log:
+            self.axes.set_xscale("log")
+            self.axes.set_yscale("log")
+        self.lines = [self.axes.plot([], [], label=label, animated=True)[0] for label in labels]
+        if any(label is not None for label in labels):
+            self.axes.legend(loc="upper right")
+        
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.get_tk_widget().grid(row=row, column=column)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.draw()
+        
+    @instrumentation.timed("PlotPanel.on_draw")
+    def on_draw(self, event):
+        #a full draw leaves the animated lines out, save what is under them and add them back
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_lines()
+        
+    def draw_lines(self):
+        for line in self.lines:
+            self.axes.draw_artist(line)
+        self.canvas.blit(self.figure.bbox)
+        
+    def needs_rescale(self, series):
+        """True when the data is outside the current limits or fills less than half of them"""
+        for limits, value_lists, scale in ((self.axes.get_xlim(), [x for x, _ in series], self.axes.get_xscale()),
+                                           (self.axes.get_ylim(), [y for _, y in series], self.axes.get_yscale())):
+            data_range = data_limits(value_lists, positive_only=(scale == "log"))
+            if data_range is None:
+                continue
+            (axis_min, axis_max), (data_min, data_max) = limits, data_range
+            if scale == "log":
+                axis_min, axis_max, data_min, data_max = np.log10([axis_min, axis_max, data_min, data_max])
+            if data_min < axis_min or data_max > axis_max or (data_max - data_min) < 0.5 * (axis_max - axis_min):
+                return True
+        return False
+        
+    @instrumentation.timed("PlotPanel.update")
+    def update(self, series):
+        """series is one (x values, y values) pair per line"""
+        for line, (x_values, y_values) in zip(self.lines, series):
+            line.set_data(x_values, y_values)
+        
+        if self.background is None or self.needs_rescale(series):
+            self.axes.relim()
+            self.axes.autoscale_view()
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+
+def data_limits(value_lists, positive_only=False):
+    """Smallest and largest finite value over several arrays, None if there are none"""
+    values = np.concatenate([np.ravel(values) for values in value_lists])
+    values = values[np.isfinite(values)]
+    if positive_only:
+        values = values[values > 0]
+    if len(values) == 0:
+        return None
+    return values.min(), values.max()
 
 def main_menu():
-    fig_list = []
-    canvas_list = []
+    load_gui_modules()
     
     window_main_menu = tk.Tk()
     window_main_menu.lift()
@@ -182,122 +1548,139 @@ def main_menu():
     frm_graphs_1 = tk.Frame(master=frm_left)
     frm_graphs_1.grid(row=2, column=0)
     
-    fig_position = Figure(figsize=(6,4))
-    ax_position = fig_position.add_subplot(111)
-    ax_position.set_title("Electron Position")
-    ax_position.set_ylabel("Distance from Atom (a_0)")
-    ax_position.set_xlabel("Time (s)")
-    canvas_position = FigureCanvasTkAgg(fig_position, master=frm_graphs_1)
-    canvas_position.draw()
-    canvas_position.get_tk_widget().grid(row=0, column=0)
-    fig_list.append(fig_position)
-    canvas_list.append(canvas_position)
-    
-    fig_velocity = Figure(figsize=(6,4))
-    ax_velocity = fig_velocity.add_subplot(111)
-    ax_velocity.set_title("Electron Velocity")
-    ax_velocity.set_ylabel("Velocity (m/s * 10^4)")
-    ax_velocity.set_xlabel("Time (s)")
-    canvas_velocity = FigureCanvasTkAgg(fig_velocity, master=frm_graphs_1)
-    canvas_velocity.draw()
-    canvas_velocity.get_tk_widget().grid(row=0, column=1)
-    fig_list.append(fig_velocity)
-    canvas_list.append(canvas_velocity)
-    
-    fig_acc = Figure(figsize=(6,4))
-    ax_acc = fig_acc.add_subplot(111)
-    ax_acc.set_title("Electron Acceleration")
-    ax_acc.set_ylabel("Acceleration (m/s)")
-    ax_acc.set_xlabel("Time (s)")
-    canvas_acc = FigureCanvasTkAgg(fig_acc, master=frm_graphs_1)
-    canvas_acc.draw()
-    canvas_acc.get_tk_widget().grid(row=1, column=0)
-    fig_list.append(fig_acc)
-    canvas_list.append(canvas_acc)
-    
-    fig_psd = Figure(figsize=(6,4))
-    ax_psd = fig_psd.add_subplot(111)
-    ax_psd.set_title("Electron PSD")
-    ax_psd.set_ylabel("Power / Frequency")
-    ax_psd.set_xlabel("Frequency (s)")
-    canvas_psd = FigureCanvasTkAgg(fig_psd, master=frm_graphs_1)
-    canvas_psd.draw()
-    canvas_psd.get_tk_widget().grid(row=1, column=1)
-    fig_list.append(fig_psd)
-    canvas_list.append(canvas_psd)
-    
-    btn_calculate = tk.Button(master=frm_left, text="Calculate",
-                              command=lambda:[calculate(scl_initial_distance,
-                                                       scl_impact_parameter,
-                                                       scl_initial_velocity,
-                                                       scl_nucleus_charge,
-                                                       fig_list, canvas_list)])
+    plot_panels = [PlotPanel(frm_graphs_1, 0, 0, "Electron Position", "Distance from Atom (a_0)",
+                             "Time (s)", ["x-axis", "y-axis"]),
+                   PlotPanel(frm_graphs_1, 0, 1, "Electron Velocity", "Velocity (m/s * 10^4)",
+                             "Time (s)", ["x-axis", "y-axis"]),
+                   PlotPanel(frm_graphs_1, 1, 0, "Electron Acceleration", "Acceleration (m/s)",
+                             "Time (s)", ["x-axis", "y-axis"]),
+                   PlotPanel(frm_graphs_1, 1, 1, "Electron PSD", "Power / Frequency",
+                             "Frequency (s)", [None], log=True)]
+    
+    lbl_integrator = tk.Label(master=frm_sliders, text="Integrator")
+    lbl_integrator.grid(row=4, column=0)
+    var_integrator = tk.StringVar(master=window_main_menu, value="euler")
+    opt_integrator = tk.OptionMenu(frm_sliders, var_integrator, *STEPS_PER_RUN)
+    opt_integrator.grid(row=4, column=1)
+    
+    lbl_diagnostics = tk.Label(master=frm_left, text="")
+    lbl_diagnostics.grid(row=3, column=0)
+    
+    lbl_progress = tk.Label(master=frm_left, text="")
+    lbl_progress.grid(row=4, column=0)
+    
+    jobs = {}
+    scales = [scl_initial_distance, scl_impact_parameter, scl_initial_velocity, scl_nucleus_charge]
+    btn_calculate = tk.Button(master=frm_left, text="Calculate")
+    btn_calculate["command"] = lambda:[start_calculation(jobs, window_main_menu, scales, plot_panels,
+                                                         var_integrator.get(), btn_calculate,
+                                                         lbl_progress, lbl_diagnostics)]
     btn_calculate.grid(row=1, column=0)
     
+    #the analytic orbit is fast enough to redraw while a slider is being dragged
+    def update_analytic_orbit(value):
+        if var_integrator.get() == "analytic":
+            #every slider tick gives a new orbit, keeping them would push real runs out of the cache
+            calculate(scl_initial_distance, scl_impact_parameter, scl_initial_velocity, scl_nucleus_charge,
+                      plot_panels, "analytic", lbl_diagnostics, cache=None)
+    
+    for scale in (scl_initial_distance, scl_impact_parameter, scl_initial_velocity, scl_nucleus_charge):
+        scale["command"] = update_analytic_orbit
+    
     window_main_menu.mainloop()
 
-def calculate(scl_distance, scl_impact, scl_velocity, scl_charge, fig_list, canvas_list):
-    initial_distance = convert_bohr_to_meter(scl_distance.get())
-    impact_parameter = convert_bohr_to_meter(scl_impact.get())
-    initial_velocity = scl_velocity.get() * 1E4
-    nucleus_charge = scl_charge.get()
+def slider_parameters(scl_distance, scl_impact, scl_velocity, scl_charge):
+    """Initial distance (m), impact parameter (m), initial velocity (m/s) and nucleus charge from the sliders"""
+    return (convert_bohr_to_meter(scl_distance.get()), convert_bohr_to_meter(scl_impact.get()),
+            scl_velocity.get() * 1E4, scl_charge.get())
+
+def trajectory_plot_series(trajectory, length=None):
+    """Downsampled (time, value) pairs for the position, velocity and acceleration panels"""
+    length = len(trajectory) if length is None else length
+    t = trajectory.t[:length]
+    return [[downsample_min_max(t, trajectory.x[:length]), downsample_min_max(t, trajectory.y[:length])],
+            [downsample_min_max(t, trajectory.vx[:length]), downsample_min_max(t, trajectory.vy[:length])],
+            [downsample_min_max(t, trajectory.ax[:length]), downsample_min_max(t, trajectory.ay[:length])]]
+
+def calculate(scl_distance, scl_impact, scl_velocity, scl_charge, plot_panels,
+              integrator="euler", lbl_diagnostics=None, cache=trajectory_cache):
+    result = simulate_electron(*slider_parameters(scl_distance, scl_impact, scl_velocity, scl_charge),
+                               integrator=integrator, cache=cache)
+    show_result(result, plot_panels, lbl_diagnostics)
+    return result
+
+@instrumentation.timed("show_result")
+def show_result(result, plot_panels, lbl_diagnostics=None):
+    trajectory, diagnostics, fs, p = result
+    if lbl_diagnostics is not None:
+        lbl_diagnostics["text"] = (f"Energy drift = {diagnostics['energy_drift']:.2e}, "
+                                   f"angular momentum drift = {diagnostics['angular_momentum_drift']:.2e}, "
+                                   f"force evaluations = {diagnostics['force_evaluations']}, "
+                                   f"stopped by {diagnostics['termination']}")
+        if diagnostics.get("step_capped"):
+            lbl_diagnostics["text"] += (f"\nStep count capped at {MAX_STEPS_PER_RUN:.0e}, the closest pass is "
+                                        f"not resolved: use rk45")
     
-    electron = Electron(initial_distance, initial_velocity, impact_parameter)
-    radius  = math.sqrt(initial_distance**2 + impact_parameter**2)
-    rough_orbit_time = 2 * math.pi * radius / initial_velocity
+    for plot_panel, series in zip(plot_panels, trajectory_plot_series(trajectory)):
+        plot_panel.update(series)
+    #the zero frequency bin cannot be shown on log axes
+    plot_panels[3].update([(fs[1:], p[1:])])
+
+def start_calculation(jobs, window, scales, plot_panels, integrator, btn_calculate, lbl_progress,
+                      lbl_diagnostics=None):
+    """
+    What the Calculate button does. Cached and analytic runs are shown at once, analytic
+    runs are quick enough to not be cached; anything else runs in an ElectronWorker,
+    drawing the path as it comes in, while the button reads Cancel. Pressing Cancel
+    stops the worker.
     
-    run_time = rough_orbit_time * 3
-    step_time = run_time * 10E-7
-    fire_electron(electron, nucleus_charge, run_time, step_time)
-    
-    t = electron.time_list
-    x_pos = electron.position_dict["x"]
-    y_pos = electron.position_dict["y"]
-    x_v = electron.velocity_dict["x"]
-    y_v = electron.velocity_dict["y"]
-    x_acc = electron.acceleration_dict["x"]
-    y_acc = electron.acceleration_dict["y"]
-    acc_list = get_total_acc_list(x_acc, y_acc)
-
-    fs, p = get_psd(t, acc_list)
-    
-    fig_list[0].clear()
-    ax_position = fig_list[0].add_subplot(111)
-    ax_position.set_title("Electron Position")
-    ax_position.set_ylabel("Distance from Atom (a_0)")
-    ax_position.set_xlabel("Time (s)")
-    ax_position.plot(t, x_pos, label="x-axis")
-    ax_position.plot(t, y_pos, label="y-axis")
-    ax_position.legend()
-    canvas_list[0].draw()
-    
-    fig_list[1].clear()
-    ax_velocity = fig_list[1].add_subplot(111)
-    ax_velocity.set_title("Electron Velocity")
-    ax_velocity.set_ylabel("Velocity (m/s * 10^4)")
-    ax_velocity.set_xlabel("Time (s)")
-    ax_velocity.plot(t, x_v, label="x-axis")
-    ax_velocity.plot(t, y_v, label="y-axis")
-    ax_velocity.legend()
-    canvas_list[1].draw()
-    
-    fig_list[2].clear()
-    ax_acc = fig_list[2].add_subplot(111)
-    ax_acc.set_title("Electron Acceleration")
-    ax_acc.set_ylabel("Acceleration (m/s)")
-    ax_acc.set_xlabel("Time (s)")
-    ax_acc.plot(t, x_acc, label="x-axis")
-    ax_acc.plot(t, y_acc, label="y-axis")
-    ax_acc.legend()
-    canvas_list[2].draw()
-    
-    fig_list[3].clear()
-    ax_psd = fig_list[3].add_subplot(111)
-    ax_psd.set_title("Electron PSD")
-    ax_psd.set_ylabel("Power / Frequency")
-    ax_psd.set_xlabel("Frequency (s)")
-    ax_psd.loglog(fs, p)
-    canvas_list[3].draw()
+    params:
+    jobs (dict): holds the window's running ElectronWorker under "worker"
+    window (tk.Tk): the main window
+    scales [tk.Scale]: distance, impact parameter, velocity and charge sliders
+    plot_panels [PlotPanel]: position, velocity, acceleration and PSD panels
+    integrator (str): integrator passed to fire_electron
+    btn_calculate (tk.Button): the Calculate / Cancel button
+    lbl_progress (tk.Label): label to show the progress in
+    lbl_diagnostics (tk.Label): label to show the diagnostics in
+    """
+    worker = jobs.get("worker")
+    if worker is not None and not worker.finished:
+        worker.cancel()
+        jobs["worker"] = None
+        btn_calculate["text"] = "Calculate"
+        lbl_progress["text"] = "Cancelled"
+        return
+    
+    parameters = slider_parameters(*scales)
+    key = simulation_cache_key(*parameters, integrator=integrator)
+    if integrator == "analytic":
+        result = simulate_electron(*parameters, integrator=integrator, cache=None)
+    else:
+        result = trajectory_cache.get(key)
+    if result is not None:
+        lbl_progress["text"] = ""
+        show_result(result, plot_panels, lbl_diagnostics)
+        return
+    
+    def on_progress(fraction, partial_series):
+        if fraction is None:
+            btn_calculate["text"] = "Calculate"
+            lbl_progress["text"] = "Failed"
+            return
+        lbl_progress["text"] = f"Calculating... {fraction:.0%}"
+        if partial_series is not None:
+            for plot_panel, series in zip(plot_panels, partial_series):
+                plot_panel.update(series)
+    
+    def on_done(result):
+        btn_calculate["text"] = "Calculate"
+        lbl_progress["text"] = ""
+        show_result(trajectory_cache.put(key, result), plot_panels, lbl_diagnostics)
+    
+    btn_calculate["text"] = "Cancel"
+    lbl_progress["text"] = "Calculating... 0%"
+    jobs["worker"] = ElectronWorker(window, parameters, integrator, on_done, on_progress)
     
 if __name__ == "__main__":
     main_menu()
\ No newline at end of file
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Benchmark suite for the HW3 electron integrators and PSD pipeline. Every case records
+wall time, steps per second and peak memory, and the integrator cases also record
+the physics error: the energy drift of the run and the deflection angle against the
+Rutherford value tan(theta / 2) = k Z e^2 / (m b v^2), with v and b the speed and impact
+parameter at infinity. Cases sweep the step count, impact parameter and nucleus charge.
+Results are saved as JSON so runs on different commits can be compared, and any new
+integrator or data layout should be added here and judged against the cases it replaces.
+
+Run as "python benchmark_HW3.py" from the HW3 folder, see --help for options."""
+
+import argparse
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+from PHYS239_HW3 import (COULOMB_CONSTANT,
+                         ELECTRON_CHARGE,
+                         ELECTRON_MASS,
+                         STEPS_PER_RUN,
+                         Electron,
+                         asymptotic_direction,
+                         calculate,
+                         convert_bohr_to_meter,
+                         fire_electron,
+                         get_psd,
+                         get_total_acc_list,
+                         run_settings)
+
+#reference electron, in the units of the GUI sliders
+INITIAL_DISTANCE = 100
+IMPACT_PARAMETER = 10
+INITIAL_VELOCITY = 2E6
+NUCLEUS_CHARGE = 1
+
+def coulomb_parameter(nucleus_charge):
+    return COULOMB_CONSTANT * nucleus_charge * ELECTRON_CHARGE**2 / ELECTRON_MASS
+
+def rutherford_angle(initial_distance, impact_parameter, initial_velocity, nucleus_charge):
+    """
+    Rutherford deflection angle (rad) of an electron fired from a finite distance, or
+    None if it is bound. Its speed and impact parameter at infinity follow from its
+    energy and angular momentum.
+
+    params:
+    initial_distance (float): initial distance in m
+    impact_parameter (float): impact parameter in m
+    initial_velocity (float): initial velocity in m/s
+    nucleus_charge (float): nucleus charge in e-
+    """
+    mu = coulomb_parameter(nucleus_charge)
+    speed_squared_at_infinity = initial_velocity**2 - 2 * mu / math.hypot(initial_distance, impact_parameter)
+    if speed_squared_at_infinity <= 0:
+        return None
+    impact_parameter_at_infinity = impact_parameter * initial_velocity / math.sqrt(speed_squared_at_infinity)
+    return 2 * math.atan(mu / (impact_parameter_at_infinity * speed_squared_at_infinity))
+
+def run_settings_steps(integrator, impact_parameter, nucleus_charge):
+    """Number of steps run_settings gives the reference electron at this impact parameter and charge"""
+    distance_m = convert_bohr_to_meter(INITIAL_DISTANCE)
+    impact_parameter_m = convert_bohr_to_meter(impact_parameter)
+    run_time, step_time, _, _ = run_settings(distance_m, impact_parameter_m, INITIAL_VELOCITY, nucleus_charge,
+                                             integrator)
+    return int(round(run_time / step_time))
+
+def fire_electron_case(integrator, number_of_steps, impact_parameter, nucleus_charge):
+    distance_m = convert_bohr_to_meter(INITIAL_DISTANCE)
+    impact_parameter_m = convert_bohr_to_meter(impact_parameter)
+    run_time, _, events, _ = run_settings(distance_m, impact_parameter_m, INITIAL_VELOCITY, nucleus_charge,
+                                          integrator)
+    step_time = run_time / number_of_steps
+
+    electron = Electron(distance_m, INITIAL_VELOCITY, impact_parameter_m)
+    diagnostics = fire_electron(electron, nucleus_charge, run_time, step_time, integrator=integrator,
+                                events=events)
+    trajectory = electron.trajectory
+    steps = int(round(diagnostics["run_time"] / step_time))
+
+    expected_angle = rutherford_angle(distance_m, impact_parameter_m, INITIAL_VELOCITY, nucleus_charge)
+    deflection_angle = None
+    if expected_angle is not None and diagnostics["termination"] != "collision":
+        incoming_x, incoming_y = asymptotic_direction(nucleus_charge, trajectory.x[0], trajectory.y[0],
+                                                      trajectory.vx[0], trajectory.vy[0], outgoing=False)
+        outgoing_x, outgoing_y = asymptotic_direction(nucleus_charge, trajectory.x[-1], trajectory.y[-1],
+                                                      trajectory.vx[-1], trajectory.vy[-1])
+        deflection_angle = abs(math.atan2(incoming_x * outgoing_y - incoming_y * outgoing_x,
+                                          incoming_x * outgoing_x + incoming_y * outgoing_y))
+
+    return steps, {"energy_drift": diagnostics["energy_drift"],
+                   "deflection_angle": deflection_angle,
+                   "rutherford_angle": expected_angle,
+                   "deflection_error": (abs(deflection_angle - expected_angle)
+                                        if deflection_angle is not None else None)}
+
+@functools.lru_cache(maxsize=None)
+def acceleration_samples(number_of_samples):
+    """Times and x, y accelerations of a noisy pulse, made once per size outside the timed runs"""
+    random = np.random.default_rng(239)
+    t = np.linspace(0, 1E-13, number_of_samples)
+    pulse = 1E20 / (1 + ((t - 5E-14) / 1E-15)**2)
+    return (t, pulse + random.normal(0, 1E17, number_of_samples),
+            0.5 * pulse + random.normal(0, 1E17, number_of_samples))
+
+def total_acceleration_case(number_of_samples):
+    _, ax, ay = acceleration_samples(number_of_samples)
+    get_total_acc_list(ax, ay)
+    return number_of_samples, {}
+
+def psd_case(number_of_samples):
+    t, ax, _ = acceleration_samples(number_of_samples)
+    get_psd(t, ax)
+    return number_of_samples, {}
+
+class StubScale:
+    """Stands in for a tk.Scale"""
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class StubPlotPanel:
+    """Stands in for a PlotPanel, touching every series it gets like set_data would"""
+    def update(self, series):
+        for x_values, y_values in series:
+            np.asarray(x_values), np.asarray(y_values)
+
+def calculate_pipeline_case(integrator):
+    #what the Calculate button does, without a window or the cache
+    scales = [StubScale(INITIAL_DISTANCE), StubScale(IMPACT_PARAMETER),
+              StubScale(INITIAL_VELOCITY / 1E4), StubScale(NUCLEUS_CHARGE)]
+    lbl_diagnostics = {}
+    trajectory, _, _, _ = calculate(*scales, [StubPlotPanel() for _ in range(4)], integrator=integrator,
+                                    lbl_diagnostics=lbl_diagnostics, cache=None)
+    #the run stops at its escape event, count the steps it really took
+    return len(trajectory) - 1, {}
+
+def measure(case, parameters, repeats):
+    """
+    Times a benchmark case and measures its peak memory
+
+    params:
+    case (callable): benchmark case, returns (number of steps or samples, physics error dict)
+    parameters (dict): keyword arguments of the case
+    repeats (int): number of timed runs, the fastest is kept
+
+    returns:
+    measurement (dict): wall_time in seconds, steps_per_second, peak_memory in bytes
+                        and the case's physics errors
+    """
+    wall_time_list = []
+    for repeat in range(repeats):
+        start_time = time.perf_counter()
+        steps, errors = case(**parameters)
+        wall_time_list.append(time.perf_counter() - start_time)
+
+    #memory is measured in a separate run because tracing slows the integrators down
+    tracemalloc.start()
+    case(**parameters)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    wall_time = min(wall_time_list)
+    return dict({"wall_time": wall_time, "steps": steps, "steps_per_second": steps / wall_time,
+                 "peak_memory": peak_memory}, **errors)
+
+def build_cases(integrators, step_counts, impact_parameters, nucleus_charges, sample_counts,
+                max_slow_steps):
+    """
+    Lists every (kernel name, case, parameters) combination of the suite. Step counts are
+    swept at the reference electron, impact parameters and charges at the steps of run_settings.
+    """
+    cases = []
+    for integrator in integrators:
+        for number_of_steps in step_counts:
+            #the adaptive and analytic runs spend their time per output sample in Python
+            if integrator in ("rk45", "analytic") and number_of_steps > max_slow_steps:
+                continue
+            cases.append(("fire_electron", fire_electron_case,
+                          {"integrator": integrator, "number_of_steps": number_of_steps,
+                           "impact_parameter": IMPACT_PARAMETER, "nucleus_charge": NUCLEUS_CHARGE}))
+        for impact_parameter in impact_parameters:
+            cases.append(("fire_electron_impact", fire_electron_case,
+                          {"integrator": integrator,
+                           "number_of_steps": run_settings_steps(integrator, impact_parameter, NUCLEUS_CHARGE),
+                           "impact_parameter": impact_parameter, "nucleus_charge": NUCLEUS_CHARGE}))
+        for nucleus_charge in nucleus_charges:
+            cases.append(("fire_electron_charge", fire_electron_case,
+                          {"integrator": integrator,
+                           "number_of_steps": run_settings_steps(integrator, IMPACT_PARAMETER, nucleus_charge),
+                           "impact_parameter": IMPACT_PARAMETER, "nucleus_charge": nucleus_charge}))
+        cases.append(("calculate", calculate_pipeline_case, {"integrator": integrator}))
+
+    for number_of_samples in sample_counts:
+        acceleration_samples(number_of_samples)
+        cases.append(("get_total_acc_list", total_acceleration_case, {"number_of_samples": number_of_samples}))
+        cases.append(("get_psd", psd_case, {"number_of_samples": number_of_samples}))
+    return cases
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(integrators, step_counts, impact_parameters, nucleus_charges, sample_counts, repeats=3,
+              max_slow_steps=10**5, verbose=True):
+    """
+    Runs every benchmark case
+
+    params:
+    integrators [str]: integrators passed to fire_electron
+    step_counts [int]: step counts to sweep at the reference electron
+    impact_parameters [float]: impact parameters to sweep in a_0
+    nucleus_charges [float]: nucleus charges to sweep in e-
+    sample_counts [int]: signal lengths for get_total_acc_list and get_psd
+    repeats (int): number of timed runs per case
+    max_slow_steps (int): largest step count timed for rk45 and analytic
+    verbose (bool): print each case as it finishes
+
+    returns:
+    report (dict): run metadata and a list of results, ready to be saved as JSON
+    """
+    results = []
+    for kernel, case, parameters in build_cases(integrators, step_counts, impact_parameters, nucleus_charges,
+                                                sample_counts, max_slow_steps):
+        measurement = measure(case, parameters, repeats)
+        result = dict(kernel=kernel, **parameters, **measurement)
+        results.append(result)
+        if verbose:
+            print(format_result(result))
+
+    return {"commit": get_git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "reference_electron": {"initial_distance": INITIAL_DISTANCE, "impact_parameter": IMPACT_PARAMETER,
+                                   "initial_velocity": INITIAL_VELOCITY, "nucleus_charge": NUCLEUS_CHARGE},
+            "results": results}
+
+def result_key(result):
+    return (result["kernel"], result.get("integrator"), result.get("number_of_steps"),
+            result.get("impact_parameter"), result.get("nucleus_charge"), result.get("number_of_samples"))
+
+def format_result(result):
+    if "number_of_samples" in result:
+        size = f"samples={result['number_of_samples']}"
+    elif "number_of_steps" in result:
+        size = f"steps={result['number_of_steps']} b={result['impact_parameter']:g} Z={result['nucleus_charge']:g}"
+    else:
+        size = ""
+    drift = "-" if result.get("energy_drift") is None else f"{result['energy_drift']:.2e}"
+    deflection = "-" if result.get("deflection_error") is None else f"{result['deflection_error']:.2e}"
+    return (f"{result['kernel']:<21} {str(result.get('integrator', '')):<9} {size:<28} "
+            f"{result['wall_time']:>9.4f} s {result['steps_per_second']:>10.3g} /s "
+            f"{result['peak_memory'] / 2**20:>9.2f} MiB  drift {drift:<9} deflection {deflection}")
+
+def compare_reports(old_report, new_report):
+    """
+    Prints the wall time and peak memory ratio new / old of every case found in both
+    reports, and the energy drift of both where there is one
+    """
+    old_results = {result_key(result): result for result in old_report["results"]}
+    print(f"Comparing {new_report.get('commit')} against {old_report.get('commit')} (ratio new / old)")
+    for result in new_report["results"]:
+        old_result = old_results.get(result_key(result))
+        if old_result is None:
+            continue
+        time_ratio = result["wall_time"] / old_result["wall_time"]
+        memory_ratio = result["peak_memory"] / max(old_result["peak_memory"], 1)
+        drift = ""
+        if result.get("energy_drift") is not None and old_result.get("energy_drift") is not None:
+            drift = f"  drift {old_result['energy_drift']:.2e} -> {result['energy_drift']:.2e}"
+        print(f"{format_result(result)}   time x{time_ratio:.2f}  memory x{memory_ratio:.2f}{drift}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HW3 electron integrators and PSD pipeline")
+    parser.add_argument("--integrators", nargs="+", choices=list(STEPS_PER_RUN), default=list(STEPS_PER_RUN),
+                        help="integrators to benchmark")
+    parser.add_argument("--steps", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6],
+                        help="step counts to benchmark")
+    parser.add_argument("--impact-parameters", type=float, nargs="+", default=[1, 10, 100],
+                        help="impact parameters to benchmark in a_0")
+    parser.add_argument("--charges", type=float, nargs="+", default=[1, 5, 20],
+                        help="nucleus charges to benchmark in e-, the reference electron is bound above 41")
+    parser.add_argument("--samples", type=int, nargs="+", default=[10**4, 10**5, 10**6, 10**7],
+                        help="signal lengths for get_total_acc_list and get_psd")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--quick", action="store_true",
+                        help="only run step counts and signal lengths up to 10^5")
+    parser.add_argument("--max-slow-steps", type=int, default=10**5,
+                        help="largest step count to time rk45 and analytic runs at")
+    parser.add_argument("--output", help="JSON file to save the results to, "
+                                         "defaults to benchmark_results/HW3_<commit>_<date>.json")
+    parser.add_argument("--compare", help="earlier JSON results to compare this run against")
+    args = parser.parse_args()
+
+    step_counts = [steps for steps in args.steps if not args.quick or steps <= 10**5]
+    sample_counts = [samples for samples in args.samples if not args.quick or samples <= 10**5]
+    report = run_suite(args.integrators, step_counts, args.impact_parameters, args.charges, sample_counts,
+                       repeats=args.repeats, max_slow_steps=args.max_slow_steps)
+
+    output_path = args.output
+    if output_path is None:
+        date = report["date"].replace(":", "-")
+        output_path = os.path.join("benchmark_results", f"HW3_{report['commit']}_{date}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Saved results to {output_path}")
+
+    if args.compare:
+        with open(args.compare) as old_report_file:
+            compare_reports(json.load(old_report_file), report)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Named timing spans with call counts and step rates, for finding where the time of a
+run goes without attaching a profiler. Nothing is recorded unless instrumentation is
+enabled, either with enable() (the --profile option of the command line scripts) or by
+setting the PHYS239_PROFILE environment variable to the file to write when the program
+exits:
+
+PHYS239_PROFILE=profile.json python PHYS239_HW3.py
+PHYS239_PROFILE=profile.trace.json python PHYS239_HW3.py
+
+A file name ending in ".trace.json" gets the Chrome trace event format, which
+chrome://tracing and https://ui.perfetto.dev open as a timeline. Any other name gets a
+summary of every span: calls, total, mean and longest time, and steps per second.
+
+This file is the same in HW2 and HW3 so each folder still runs on its own, and
+check_shared_code.py at the top of the repository fails when the two copies differ."""
+
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+#environment variable holding the file to write the instrumentation to at exit
+PROFILE_ENVIRONMENT_VARIABLE = "PHYS239_PROFILE"
+#spans kept for the Chrome trace; the summary keeps counting after this many
+MAX_TRACE_EVENTS = 10**6
+
+ENABLED = False
+
+#span name -> [calls, total seconds, longest seconds, steps]
+span_totals = {}
+#(name, start in s, duration in s, process id, thread id) of every span for the Chrome trace
+trace_events = []
+lock = threading.Lock()
+output_path = None
+
+def record(name, start_time, duration, steps=0):
+    with lock:
+        totals = span_totals.get(name)
+        if totals is None:
+            totals = span_totals[name] = [0, 0.0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += duration
+        totals[2] = max(totals[2], duration)
+        totals[3] += steps
+        if len(trace_events) < MAX_TRACE_EVENTS:
+            trace_events.append((name, start_time, duration, os.getpid(), threading.get_ident()))
+
+class Span:
+    """
+    Times the code inside a with block under a name. add_steps counts the steps (of an
+    integrator, solver, ...) done inside it, which the summary turns into a step rate.
+    """
+    __slots__ = ("name", "start_time", "steps")
+
+    def __init__(self, name):
+        self.name = name
+        self.steps = 0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        record(self.name, self.start_time, time.perf_counter() - self.start_time, self.steps)
+        return False
+
+    def add_steps(self, steps):
+        self.steps += steps
+
+class NullSpan:
+    """Stands in for a Span while instrumentation is disabled and does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def add_steps(self, steps):
+        pass
+
+NULL_SPAN = NullSpan()
+
+def span(name):
+    """
+    Returns a context manager timing its block under name, or a shared do-nothing one
+    when instrumentation is disabled
+    """
+    return Span(name) if ENABLED else NULL_SPAN
+
+def timed(name):
+    """
+    Decorator timing every call of a function under name. While instrumentation is
+    disabled a call only costs one extra check, so it suits functions called per run
+    or per redraw rather than per step.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, start_time, time.perf_counter() - start_time)
+        return timed_function
+    return decorator
+
+def wrap(name, function):
+    """
+    Returns function timed under name if instrumentation is enabled, and function itself
+    if not, so functions called every step (like an acceleration_function) cost nothing
+    extra unless they are being measured. Each call is one span, so a run of millions of
+    steps fills the Chrome trace quickly; the summary is not limited.
+    """
+    if not ENABLED:
+        return function
+
+    def timed_function(*args):
+        start_time = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            record(name, start_time, time.perf_counter() - start_time)
+    return timed_function
+
+def enable(path=None):
+    """
+    Starts recording
+
+    params:
+    path (str): file to write everything recorded to when the program exits, if given
+    """
+    global ENABLED, output_path
+    ENABLED = True
+    if path is not None:
+        if output_path is None:
+            atexit.register(write_at_exit)
+        output_path = path
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+def reset():
+    with lock:
+        span_totals.clear()
+        trace_events.clear()
+
+def snapshot():
+    """
+    Returns everything recorded so far as plain lists and dicts, for sending from a
+    worker process to the main process (see merge)
+    """
+    with lock:
+        return {"span_totals": {name: list(totals) for name, totals in span_totals.items()},
+                "trace_events": list(trace_events)}
+
+def merge(recorded):
+    """Adds what another process recorded, as returned by its snapshot(), to this process"""
+    with lock:
+        for name, (calls, total_seconds, longest_seconds, steps) in recorded["span_totals"].items():
+            totals = span_totals.setdefault(name, [0, 0.0, 0.0, 0])
+            totals[0] += calls
+            totals[1] += total_seconds
+            totals[2] = max(totals[2], longest_seconds)
+            totals[3] += steps
+        trace_events.extend(tuple(event) for event in
+                            recorded["trace_events"][:MAX_TRACE_EVENTS - len(trace_events)])
+
+def summary():
+    """
+    returns:
+    spans (dict): span name -> "calls", "total_seconds", "mean_seconds", "max_seconds",
+                  and "steps" and "steps_per_second" for spans that counted steps,
+                  ordered from the most to the least total time
+    """
+    with lock:
+        items = sorted(span_totals.items(), key=lambda item: item[1][1], reverse=True)
+    spans = {}
+    for name, (calls, total_seconds, longest_seconds, steps) in items:
+        spans[name] = {"calls": calls, "total_seconds": total_seconds,
+                       "mean_seconds": total_seconds / calls, "max_seconds": longest_seconds}
+        if steps:
+            spans[name]["steps"] = steps
+            spans[name]["steps_per_second"] = steps / total_seconds if total_seconds > 0 else None
+    return spans
+
+def chrome_trace():
+    """
+    returns:
+    trace (dict): the recorded spans as complete ("X") events of the Chrome trace event
+                  format in microseconds, with the summary under "otherData"
+    """
+    with lock:
+        events = list(trace_events)
+    return {"traceEvents": [{"name": name, "ph": "X", "ts": start_time * 1E6, "dur": duration * 1E6,
+                             "pid": process_id, "tid": thread_id}
+                            for name, start_time, duration, process_id, thread_id in events],
+            "displayTimeUnit": "ms",
+            "otherData": {"summary": summary()}}
+
+def write(path, trace_format=None):
+    """
+    Writes everything recorded so far to a JSON file
+
+    params:
+    path (str): file to write
+    trace_format (str): "chrome" or "summary", defaults to "chrome" for names ending in ".trace.json"
+    """
+    if trace_format is None:
+        trace_format = "chrome" if path.endswith(".trace.json") else "summary"
+    if trace_format not in ("chrome", "summary"):
+        raise ValueError(f"Unknown trace format '{trace_format}', expected 'chrome' or 'summary'")
+    data = chrome_trace() if trace_format == "chrome" else {"spans": summary()}
+    with open(path, "w") as trace_file:
+        json.dump(data, trace_file, indent=1)
+
+def write_at_exit():
+    if output_path is not None:
+        write(output_path)
+
+def print_summary():
+    for name, totals in summary().items():
+        rate = f", {totals['steps_per_second']:.3g} steps/s" if totals.get("steps_per_second") else ""
+        print(f"{name}: {totals['calls']} calls, {totals['total_seconds']:.4f} s total, "
+              f"{totals['mean_seconds'] * 1E3:.4f} ms mean{rate}")
+
+if os.environ.get(PROFILE_ENVIRONMENT_VARIABLE):
+    #worker processes inherit the variable, but only the main process writes the file,
+    #the workers send what they record back to it (see merge). A spawned worker imports
+    #this before multiprocessing.parent_process() is set, but after its name is
+    if multiprocessing.current_process().name == "MainProcess":
+        enable(os.environ[PROFILE_ENVIRONMENT_VARIABLE])
+    else:
+        enable()
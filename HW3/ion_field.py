@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Coulomb field of many ions, for electrons crossing an ion lattice or a plasma
+instead of passing a single nucleus at the origin. An IonField can be passed to
+fire_electron and fire_electron_ensemble in PHYS239_HW3.py as ion_field.
+
+With a cutoff the ions are sorted into a cell list, so each force evaluation only
+visits the ions in the cells around the electron. The rest of the ions are either
+left out (a screened, truncated field) or, with far_field=True, replaced by the
+charge and dipole moment of cells that are larger the further they are from the
+electron, so a force evaluation costs about the same for 10^3 or 10^6 ions."""
+
+import math
+import numpy as np
+
+from PHYS239_HW3 import COULOMB_CONSTANT, ELECTRON_CHARGE, ELECTRON_MASS
+
+#ion positions x ions per chunk when every ion is summed directly over arrays of positions,
+#and (position, ion or far cell) pairs per chunk with a cutoff
+DIRECT_SUM_CHUNK_SIZE = 10**6
+
+def expand_ranges(owners, starts, stops):
+    """
+    Flattens the ranges starts[k]:stops[k], each belonging to owners[k], into every
+    (owner, index) pair they hold, without a Python loop over the ranges
+
+    returns:
+    owners (numpy array): the owner of every index
+    indices (numpy array): every index of every range
+    """
+    lengths = np.maximum(stops - starts, 0)
+    range_numbers = np.repeat(np.arange(len(lengths)), lengths)
+    #position of every index inside its own range
+    range_offsets = np.arange(len(range_numbers)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners[range_numbers], starts[range_numbers] + range_offsets
+
+class IonField:
+    """
+    Acceleration and potential energy (per unit electron mass) of an electron in the
+    field of a set of ions. Ion charges are in units of e, positive ions attract.
+    """
+
+    def __init__(self, positions, charges=1.0, cutoff=None, far_field=False, cell_size=None, softening=0.0):
+        """
+        params:
+        positions (array): ion positions of shape (number of ions, 2) in m
+        charges (float or array): charge of each ion in e
+        cutoff (float): only ions within this distance are summed one by one (m), with far_field
+                        every ion in the cells within this distance. Without a cutoff every ion
+                        is summed, which costs a pass over all ions per evaluation
+        far_field (bool): add the ions beyond the near cells as multipoles of coarser and coarser cells
+        cell_size (float): side of the cells of the cell list in m, defaults to cutoff / 2
+        softening (float): distance added in quadrature to every electron-ion distance (m),
+                           keeps close passes finite
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        charges = np.broadcast_to(np.asarray(charges, dtype=float), (len(positions),))
+        if far_field and cutoff is None:
+            raise ValueError("far_field needs a cutoff")
+
+        self.number_of_ions = len(positions)
+        self.cutoff = cutoff
+        self.far_field = far_field
+        self.softening_squared = softening**2
+        #COULOMB_CONSTANT * charge * e^2 / m for every ion
+        coulomb_parameters = COULOMB_CONSTANT * charges * ELECTRON_CHARGE**2 / ELECTRON_MASS
+
+        if cutoff is None:
+            self.ion_x, self.ion_y = positions[:, 0].copy(), positions[:, 1].copy()
+            self.coulomb_parameters = coulomb_parameters
+            return
+
+        self.cell_size = cutoff / 2 if cell_size is None else cell_size
+        self.reach = int(math.ceil(cutoff / self.cell_size))
+        self.grid_origin = positions.min(axis=0)
+        cell_indices = np.floor((positions - self.grid_origin) / self.cell_size).astype(int)
+        self.grid_shape = tuple(cell_indices.max(axis=0) + 1)
+        cell_ids = cell_indices[:, 0] * self.grid_shape[1] + cell_indices[:, 1]
+
+        #ions sorted by cell, the ions of cell c are cell_starts[c]:cell_starts[c + 1]
+        order = np.argsort(cell_ids, kind="stable")
+        self.ion_x, self.ion_y = positions[order, 0], positions[order, 1]
+        self.coulomb_parameters = coulomb_parameters[order]
+        number_of_cells = self.grid_shape[0] * self.grid_shape[1]
+        self.cell_starts = np.searchsorted(cell_ids[order], np.arange(number_of_cells + 1))
+
+        if far_field:
+            self.build_multipole_levels(cell_ids, coulomb_parameters, positions)
+
+    def build_multipole_levels(self, cell_ids, coulomb_parameters, positions):
+        """
+        Charge and dipole moment (about the cell center) of every cell, on the cell grid and
+        on coarser grids of cells twice as wide, up to a single cell holding every ion.
+        levels[l] has shape (cells along x, cells along y, 5) and holds the charge, the two
+        dipole components and the center of every cell, each in units of coulomb_parameters.
+        """
+        number_of_cells = self.grid_shape[0] * self.grid_shape[1]
+        cell_x, cell_y = (self.grid_origin[:, np.newaxis]
+                          + (np.indices(self.grid_shape).reshape(2, -1) + 0.5) * self.cell_size)
+        charge = np.bincount(cell_ids, weights=coulomb_parameters, minlength=number_of_cells)
+        dipole_x = np.bincount(cell_ids, weights=coulomb_parameters * (positions[:, 0] - cell_x[cell_ids]),
+                               minlength=number_of_cells)
+        dipole_y = np.bincount(cell_ids, weights=coulomb_parameters * (positions[:, 1] - cell_y[cell_ids]),
+                               minlength=number_of_cells)
+        level = np.stack((charge, dipole_x, dipole_y, cell_x, cell_y), axis=-1).reshape(self.grid_shape + (5,))
+        self.levels = [level]
+
+        cell_size = self.cell_size
+        while level.shape[:2] != (1, 1):
+            #pad with empty cells to an even number of cells, then join every 2x2 block
+            nx, ny = level.shape[:2]
+            padded = np.zeros((nx + nx % 2, ny + ny % 2, 5))
+            padded[:nx, :ny, :3] = level[..., :3]
+            blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, 5)
+            #a child's center is half a child cell from its parent's center
+            offsets = (np.arange(2) - 0.5) * cell_size
+            charge = blocks[..., 0].sum(axis=(1, 3))
+            dipole_x = (blocks[..., 1] + blocks[..., 0] * offsets[:, np.newaxis, np.newaxis]).sum(axis=(1, 3))
+            dipole_y = (blocks[..., 2] + blocks[..., 0] * offsets).sum(axis=(1, 3))
+            cell_size *= 2
+            center_x, center_y = (self.grid_origin[:, np.newaxis, np.newaxis]
+                                  + (np.indices(charge.shape) + 0.5) * cell_size)
+            level = np.stack((charge, dipole_x, dipole_y, center_x, center_y), axis=-1)
+            self.levels.append(level)
+
+        #the cells of every level one after the other, for gathering the far cells of many positions
+        self.level_starts = np.cumsum([0] + [level.shape[0] * level.shape[1] for level in self.levels])
+        self.level_cells = np.concatenate([level.reshape(-1, 5) for level in self.levels])
+
+    def far_cells(self, i, j):
+        """
+        Multipole cells standing in for every ion outside the near block of cell (i, j).
+        On each level these are the children of the cells near the parent cell that are
+        not near the cell itself, so each level adds at most (4 reach + 2)^2 cells and the
+        cost grows with the logarithm of the number of ions.
+        """
+        far_cells = []
+        for level_number, level in enumerate(self.levels):
+            nx, ny = level.shape[:2]
+            i_level, j_level = i >> level_number, j >> level_number
+            near_i = (max(i_level - self.reach, 0), min(i_level + self.reach + 1, nx))
+            near_j = (max(j_level - self.reach, 0), min(j_level + self.reach + 1, ny))
+            if near_i == (0, nx) and near_j == (0, ny):
+                break
+
+            if level_number + 1 < len(self.levels):
+                parent_i, parent_j = i_level >> 1, j_level >> 1
+                block_i = (max(2 * (parent_i - self.reach), 0), min(2 * (parent_i + self.reach + 1), nx))
+                block_j = (max(2 * (parent_j - self.reach), 0), min(2 * (parent_j + self.reach + 1), ny))
+            else:
+                block_i, block_j = (0, nx), (0, ny)
+            if block_i[0] >= block_i[1] or block_j[0] >= block_j[1]:
+                continue
+
+            outside_near = np.ones((block_i[1] - block_i[0], block_j[1] - block_j[0]), dtype=bool)
+            outside_near[max(near_i[0] - block_i[0], 0):max(near_i[1] - block_i[0], 0),
+                         max(near_j[0] - block_j[0], 0):max(near_j[1] - block_j[0], 0)] = False
+            far_cells.append(level[block_i[0]:block_i[1], block_j[0]:block_j[1]][outside_near])
+        return np.concatenate(far_cells) if far_cells else np.empty((0, 5))
+
+    def far_cell_pairs(self, i, j):
+        """
+        far_cells for many cells at once
+
+        params:
+        i, j (int arrays): cell of every position
+
+        returns:
+        positions (numpy array): position number of every (position, far cell) pair
+        cells (numpy array): far cell of every pair, as a row of level_cells
+        """
+        positions = np.arange(len(i))
+        active = np.ones(len(i), dtype=bool)
+        position_parts, cell_parts = [], []
+        for level_number, level in enumerate(self.levels):
+            nx, ny = level.shape[:2]
+            i_level, j_level = i >> level_number, j >> level_number
+            near_i_start, near_i_stop = np.maximum(i_level - self.reach, 0), np.minimum(i_level + self.reach + 1, nx)
+            near_j_start, near_j_stop = np.maximum(j_level - self.reach, 0), np.minimum(j_level + self.reach + 1, ny)
+            #once the near cells cover a level they cover every coarser level too
+            active &= ~((near_i_start == 0) & (near_i_stop == nx) & (near_j_start == 0) & (near_j_stop == ny))
+            if not active.any():
+                break
+
+            if level_number + 1 < len(self.levels):
+                parent_i, parent_j = i_level >> 1, j_level >> 1
+                block_i_start = np.maximum(2 * (parent_i - self.reach), 0)
+                block_i_stop = np.minimum(2 * (parent_i + self.reach + 1), nx)
+                block_j_start = np.maximum(2 * (parent_j - self.reach), 0)
+                block_j_stop = np.minimum(2 * (parent_j + self.reach + 1), ny)
+            else:
+                block_i_start, block_i_stop = np.zeros_like(i), np.full_like(i, nx)
+                block_j_start, block_j_stop = np.zeros_like(j), np.full_like(j, ny)
+            block_i_stop = np.where(active, block_i_stop, block_i_start)
+            block_j_stop = np.maximum(block_j_stop, block_j_start)
+
+            #every row of the block is one range of cells, or two around the near cells
+            row_positions, rows = expand_ranges(positions, block_i_start, block_i_stop)
+            row_start, row_stop = block_j_start[row_positions], block_j_stop[row_positions]
+            in_near_rows = (rows >= near_i_start[row_positions]) & (rows < near_i_stop[row_positions])
+            first_stop = np.where(in_near_rows, np.clip(near_j_start[row_positions], row_start, row_stop), row_stop)
+            second_start = np.where(in_near_rows, np.clip(near_j_stop[row_positions], row_start, row_stop), row_stop)
+            second_start = np.maximum(second_start, first_stop)
+            row_offsets = self.level_starts[level_number] + rows * ny
+            for starts, stops in ((row_start, first_stop), (second_start, row_stop)):
+                pair_positions, pair_cells = expand_ranges(row_positions, row_offsets + starts, row_offsets + stops)
+                position_parts.append(pair_positions)
+                cell_parts.append(pair_cells)
+        if not position_parts:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        return np.concatenate(position_parts), np.concatenate(cell_parts)
+
+    def cell_index(self, x, y):
+        return (int(math.floor((x - self.grid_origin[0]) / self.cell_size)),
+                int(math.floor((y - self.grid_origin[1]) / self.cell_size)))
+
+    def near_ions(self, x, y):
+        """
+        Positions and Coulomb parameters of the ions in the block of cells within reach of (x, y)
+        """
+        i, j = self.cell_index(x, y)
+        i_start, i_stop = max(i - self.reach, 0), min(i + self.reach + 1, self.grid_shape[0])
+        j_start, j_stop = max(j - self.reach, 0), min(j + self.reach + 1, self.grid_shape[1])
+        if i_start >= i_stop or j_start >= j_stop:
+            return np.empty(0), np.empty(0), np.empty(0)
+
+        #the cells of one row of the block are next to each other in the sorted ions
+        slices = [slice(self.cell_starts[row * self.grid_shape[1] + j_start],
+                        self.cell_starts[row * self.grid_shape[1] + j_stop])
+                  for row in range(i_start, i_stop)]
+        return (np.concatenate([self.ion_x[part] for part in slices]),
+                np.concatenate([self.ion_y[part] for part in slices]),
+                np.concatenate([self.coulomb_parameters[part] for part in slices]))
+
+    def near_ion_pairs(self, i, j):
+        """
+        near_ions for many cells at once
+
+        params:
+        i, j (int arrays): cell of every position
+
+        returns:
+        positions (numpy array): position number of every (position, ion) pair
+        ions (numpy array): ion of every pair, as an index into the sorted ions
+        """
+        nx, ny = self.grid_shape
+        i_start, i_stop = np.clip(i - self.reach, 0, nx), np.clip(i + self.reach + 1, 0, nx)
+        j_start = np.clip(j - self.reach, 0, ny)
+        j_stop = np.maximum(np.clip(j + self.reach + 1, 0, ny), j_start)
+        positions, rows = expand_ranges(np.arange(len(i)), i_start, i_stop)
+        return expand_ranges(positions, self.cell_starts[rows * ny + j_start[positions]],
+                             self.cell_starts[rows * ny + j_stop[positions]])
+
+    def field_with_cutoff(self, x, y):
+        """
+        Evaluates the field at every one of the positions x, y (1D arrays), as field_at_point
+        does at one, by gathering the near ions and far cells of all positions together
+        """
+        number_of_positions = len(x)
+        cell_i = np.floor((x - self.grid_origin[0]) / self.cell_size).astype(int)
+        cell_j = np.floor((y - self.grid_origin[1]) / self.cell_size).astype(int)
+
+        positions, ions = self.near_ion_pairs(cell_i, cell_j)
+        dx = x[positions] - self.ion_x[ions]
+        dy = y[positions] - self.ion_y[ions]
+        r_squared = dx * dx + dy * dy + self.softening_squared
+        inverse_r = 1 / np.sqrt(r_squared)
+        if not self.far_field:
+            inverse_r[r_squared >= self.cutoff**2] = 0.0
+        coulomb_parameters = self.coulomb_parameters[ions]
+        strength = coulomb_parameters * inverse_r**3
+        ax, ay, potential = np.zeros(number_of_positions), np.zeros(number_of_positions), np.zeros(number_of_positions)
+        ax -= np.bincount(positions, strength * dx, number_of_positions)
+        ay -= np.bincount(positions, strength * dy, number_of_positions)
+        potential -= np.bincount(positions, coulomb_parameters * inverse_r, number_of_positions)
+
+        if self.far_field:
+            positions, cells = self.far_cell_pairs(cell_i, cell_j)
+            charge, dipole_x, dipole_y, center_x, center_y = self.level_cells[cells].T
+            dx = x[positions] - center_x
+            dy = y[positions] - center_y
+            inverse_r_squared = 1 / (dx * dx + dy * dy + self.softening_squared)
+            inverse_r = np.sqrt(inverse_r_squared)
+            inverse_r_cube = inverse_r * inverse_r_squared
+            dipole_dot_r = dipole_x * dx + dipole_y * dy
+            radial = (charge + 3 * dipole_dot_r * inverse_r_squared) * inverse_r_cube
+            ax += np.bincount(positions, dipole_x * inverse_r_cube - radial * dx, number_of_positions)
+            ay += np.bincount(positions, dipole_y * inverse_r_cube - radial * dy, number_of_positions)
+            potential -= np.bincount(positions, charge * inverse_r + dipole_dot_r * inverse_r_cube,
+                                     number_of_positions)
+        return ax, ay, potential
+
+    def field_at_point(self, x, y):
+        """
+        Evaluates the field at one position
+
+        params:
+        x (float): electron x position in m
+        y (float): electron y position in m
+
+        returns:
+        ax (float): x acceleration in m/s^2
+        ay (float): y acceleration in m/s^2
+        potential (float): potential energy per unit electron mass in J/kg
+        """
+        if self.cutoff is None:
+            ion_x, ion_y, coulomb_parameters = self.ion_x, self.ion_y, self.coulomb_parameters
+        else:
+            ion_x, ion_y, coulomb_parameters = self.near_ions(x, y)
+
+        dx = x - ion_x
+        dy = y - ion_y
+        r_squared = dx * dx + dy * dy + self.softening_squared
+        if self.cutoff is not None and not self.far_field:
+            within_cutoff = r_squared < self.cutoff**2
+            dx, dy, r_squared = dx[within_cutoff], dy[within_cutoff], r_squared[within_cutoff]
+            coulomb_parameters = coulomb_parameters[within_cutoff]
+        inverse_r = 1 / np.sqrt(r_squared)
+        strength = coulomb_parameters * inverse_r**3
+        ax = -np.dot(strength, dx)
+        ay = -np.dot(strength, dy)
+        potential = -np.dot(coulomb_parameters, inverse_r)
+
+        if self.far_field:
+            charge, dipole_x, dipole_y, center_x, center_y = self.far_cells(*self.cell_index(x, y)).T
+            dx = x - center_x
+            dy = y - center_y
+            inverse_r_squared = 1 / (dx * dx + dy * dy + self.softening_squared)
+            inverse_r = np.sqrt(inverse_r_squared)
+            inverse_r_cube = inverse_r * inverse_r_squared
+            dipole_dot_r = dipole_x * dx + dipole_y * dy
+            #monopole plus dipole terms of the expansion of every far cell about its center
+            radial = (charge + 3 * dipole_dot_r * inverse_r_squared) * inverse_r_cube
+            ax += np.dot(dipole_x, inverse_r_cube) - np.dot(radial, dx)
+            ay += np.dot(dipole_y, inverse_r_cube) - np.dot(radial, dy)
+            potential -= np.dot(charge, inverse_r) + np.dot(dipole_dot_r, inverse_r_cube)
+
+        return float(ax), float(ay), float(potential)
+
+    def field(self, x, y):
+        """
+        Evaluates the field at one position or at arrays of positions
+
+        returns:
+        ax, ay, potential: as field_at_point, arrays when x and y are arrays
+        """
+        if np.ndim(x) == 0:
+            return self.field_at_point(x, y)
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if self.cutoff is None:
+            return self.direct_sum(x.ravel(), y.ravel(), x.shape)
+
+        shape = x.shape
+        x, y = x.ravel(), y.ravel()
+        ax, ay, potential = np.empty(len(x)), np.empty(len(x)), np.empty(len(x))
+        #bound on the (position, ion or far cell) pairs of one position, to keep each chunk's pairs in memory
+        pairs_per_position = int(np.diff(self.cell_starts).max()) * (2 * self.reach + 1)**2
+        if self.far_field:
+            pairs_per_position += len(self.levels) * (4 * self.reach + 2)**2
+        chunk_size = max(1, DIRECT_SUM_CHUNK_SIZE // max(pairs_per_position, 1))
+        for start in range(0, len(x), chunk_size):
+            part = slice(start, start + chunk_size)
+            ax[part], ay[part], potential[part] = self.field_with_cutoff(x[part], y[part])
+        return ax.reshape(shape), ay.reshape(shape), potential.reshape(shape)
+
+    def direct_sum(self, x, y, shape):
+        ax, ay, potential = np.empty(len(x)), np.empty(len(x)), np.empty(len(x))
+        chunk_size = max(1, DIRECT_SUM_CHUNK_SIZE // max(self.number_of_ions, 1))
+        for start in range(0, len(x), chunk_size):
+            part = slice(start, start + chunk_size)
+            dx = x[part, np.newaxis] - self.ion_x
+            dy = y[part, np.newaxis] - self.ion_y
+            inverse_r = 1 / np.sqrt(dx * dx + dy * dy + self.softening_squared)
+            strength = self.coulomb_parameters * inverse_r**3
+            ax[part] = -np.sum(strength * dx, axis=1)
+            ay[part] = -np.sum(strength * dy, axis=1)
+            potential[part] = -inverse_r @ self.coulomb_parameters
+        return ax.reshape(shape), ay.reshape(shape), potential.reshape(shape)
+
+    def acceleration(self, x, y):
+        """Acceleration (m/s^2) at one position or arrays of positions, usable as an acceleration_function"""
+        ax, ay, _ = self.field(x, y)
+        return ax, ay
+
+    def potential(self, x, y):
+        """Potential energy per unit electron mass (J/kg) at one position or arrays of positions"""
+        return self.field(x, y)[2]
+
+def square_lattice(number_per_side, spacing, center=(0.0, 0.0)):
+    """
+    Positions of a square lattice of ions
+
+    params:
+    number_per_side (int): ions along each side
+    spacing (float): distance between neighbouring ions in m
+    center (float, float): center of the lattice in m
+
+    returns:
+    positions (numpy array): ion positions of shape (number_per_side^2, 2)
+    """
+    offsets = (np.arange(number_per_side) - (number_per_side - 1) / 2) * spacing
+    x, y = np.meshgrid(offsets + center[0], offsets + center[1], indexing="ij")
+    return np.column_stack((x.ravel(), y.ravel()))
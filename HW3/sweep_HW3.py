@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Fires electrons over a Cartesian grid of initial distance, impact parameter,
+initial velocity and nucleus charge across a process pool. Each worker only
+returns a compact summary of its run (PSD, peak acceleration, deflection angle
+and total radiated energy), which is appended to a JSON-lines results file as
+soon as it arrives. Running the same command again skips every point already in
+the file for the same integrator, so a sweep that was stopped part way through
+picks up where it left off.
+
+Example:
+python sweep_HW3.py --distances 100 --impact-parameters 1:1000:50:log
+                    --velocities 1e5:1e7:20:log --charges 1 10 --output sweep.jsonl"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+
+import instrumentation
+from PHYS239_HW3 import (LARMOR_CONSTANT,
+                         STEPS_PER_RUN,
+                         Electron,
+                         asymptotic_direction,
+                         combine_psds,
+                         convert_bohr_to_meter,
+                         fire_electron,
+                         get_psd,
+                         get_total_acc_list,
+                         impact_parameter_weights,
+                         orbit_elements,
+                         run_settings)
+
+PARAMETERS = ("initial_distance", "impact_parameter", "initial_velocity", "nucleus_charge")
+#numbers of every summary, None for a point that failed or has no deflection angle
+SUMMARY_NUMBERS = ("peak_acceleration", "deflection_angle", "radiated_energy")
+
+#kept the same as parse_axis in HW2/sweep_HW2.py, check_shared_code.py fails when they differ
+def parse_axis(values):
+    """
+    Parses the values of one grid axis from the command line
+
+    params:
+    values [str]: either a list of numbers or a single "start:stop:num" range,
+                  with ":log" appended for logarithmic spacing
+
+    returns:
+    axis (numpy array): values of the axis
+    """
+    if len(values) == 1 and ":" in values[0]:
+        parts = values[0].split(":")
+        if len(parts) not in (3, 4) or (len(parts) == 4 and parts[3] not in ("lin", "log")):
+            raise argparse.ArgumentTypeError(f"Cannot parse axis range '{values[0]}'")
+        start, stop, num = float(parts[0]), float(parts[1]), int(parts[2])
+        if len(parts) == 4 and parts[3] == "log":
+            return np.logspace(np.log10(start), np.log10(stop), num)
+        return np.linspace(start, stop, num)
+    return np.array([float(value) for value in values])
+
+def summarize_run(parameters, integrator="analytic"):
+    """
+    Fires one electron and reduces its run to a few numbers and its PSD
+
+    params:
+    parameters (float, float, float, float): initial distance (a_0), impact parameter (a_0),
+                                             initial velocity (m/s) and nucleus charge (e-)
+    integrator (str): any integrator accepted by fire_electron
+
+    returns:
+    summary (dict): the parameters, "peak_acceleration" (m/s^2), "deflection_angle" (rad,
+                    None if the electron hit the nucleus or ended bound), "radiated_energy" (J),
+                    "termination", "step_capped" (see run_settings), "frequencies" and "psd"
+    """
+    initial_distance, impact_parameter, initial_velocity, nucleus_charge = parameters
+    distance_m = convert_bohr_to_meter(initial_distance)
+    impact_parameter_m = convert_bohr_to_meter(impact_parameter)
+
+    electron = Electron(distance_m, initial_velocity, impact_parameter_m)
+    run_time, step_time, events, step_capped = run_settings(distance_m, impact_parameter_m, initial_velocity,
+                                                            nucleus_charge, integrator)
+    diagnostics = fire_electron(electron, nucleus_charge, run_time, step_time,
+                                integrator=integrator, events=events)
+
+    trajectory = electron.trajectory
+    acc_list = get_total_acc_list(trajectory.ax, trajectory.ay)
+    fs, Pxx = get_psd(trajectory.t, acc_list)
+    #Larmor power integrated over the run with the trapezoid rule
+    radiated_power_integral = np.sum(0.5 * (acc_list[1:]**2 + acc_list[:-1]**2) * np.diff(trajectory.t))
+    deflection_angle = get_deflection_angle(trajectory, nucleus_charge, diagnostics["termination"])
+
+    return {"initial_distance": float(initial_distance),
+            "impact_parameter": float(impact_parameter),
+            "initial_velocity": float(initial_velocity),
+            "nucleus_charge": float(nucleus_charge),
+            "integrator": integrator,
+            "peak_acceleration": float(acc_list.max()),
+            "deflection_angle": deflection_angle,
+            "radiated_energy": float(LARMOR_CONSTANT * radiated_power_integral),
+            "termination": diagnostics["termination"],
+            "step_capped": step_capped,
+            "frequencies": fs.tolist(),
+            "psd": Pxx.tolist()}
+
+def get_deflection_angle(trajectory, nucleus_charge, termination):
+    """
+    Angle between the incoming and outgoing asymptotes of a run, positive when turned
+    counterclockwise. The asymptotes come from the orbits through the first and last
+    states, so the angle does not depend on how far from the nucleus the run stopped.
+    None if the electron hit the nucleus or is still bound at the end of the run.
+    """
+    if termination == "collision":
+        return None
+    try:
+        if orbit_elements(nucleus_charge, trajectory.x[-1], trajectory.y[-1],
+                          trajectory.vx[-1], trajectory.vy[-1])["bound"]:
+            return None
+        incoming_x, incoming_y = asymptotic_direction(nucleus_charge, trajectory.x[0], trajectory.y[0],
+                                                      trajectory.vx[0], trajectory.vy[0], outgoing=False)
+        outgoing_x, outgoing_y = asymptotic_direction(nucleus_charge, trajectory.x[-1], trajectory.y[-1],
+                                                      trajectory.vx[-1], trajectory.vy[-1])
+    except ValueError:
+        #head on or parabolic, the orbit has no asymptotes to measure
+        return None
+    return math.atan2(incoming_x * outgoing_y - incoming_y * outgoing_x,
+                      incoming_x * outgoing_x + incoming_y * outgoing_y)
+
+def failed_summary(parameters, integrator, error):
+    """The summary written for a point whose run raised error, so a sweep goes on past it"""
+    summary = dict(zip(PARAMETERS, (float(value) for value in parameters)))
+    summary.update({"integrator": integrator, "termination": "error", "error": f"{type(error).__name__}: {error}",
+                    "frequencies": [], "psd": []})
+    summary.update(dict.fromkeys(SUMMARY_NUMBERS))
+    return summary
+
+def load_completed_points(output_path):
+    """
+    Reads the summaries already in a results file. An unfinished last line, left by a
+    sweep that was killed while writing, is cut off so new lines can be appended.
+
+    params:
+    output_path (str): JSON-lines results file
+
+    returns:
+    summaries (dict): (initial distance, impact parameter, initial velocity, nucleus charge,
+                       integrator) -> summary
+    """
+    summaries = {}
+    if not os.path.exists(output_path):
+        return summaries
+
+    complete_length = 0
+    with open(output_path, "rb") as results_file:
+        for line in results_file:
+            if not line.endswith(b"\n"):
+                break
+            summary = json.loads(line)
+            summaries[tuple(summary[name] for name in PARAMETERS) + (summary["integrator"],)] = summary
+            complete_length += len(line)
+
+    if complete_length != os.path.getsize(output_path):
+        with open(output_path, "rb+") as results_file:
+            results_file.truncate(complete_length)
+    return summaries
+
+def load_sweep_results(output_path):
+    """
+    Loads a results file as numpy arrays
+
+    params:
+    output_path (str): JSON-lines results file
+
+    returns:
+    results (dict): one array per parameter and summary number (NaN where a summary has
+                    None), lists of "integrator" and "termination", and lists of the
+                    "frequencies" and "psd" arrays of every point, which differ in length
+                    between runs and are empty for points that failed
+    """
+    summaries = list(load_completed_points(output_path).values())
+    results = {name: np.array([summary[name] for summary in summaries], dtype=float) for name in PARAMETERS}
+    for name in SUMMARY_NUMBERS:
+        results[name] = np.array([np.nan if summary[name] is None else summary[name] for summary in summaries])
+    results["integrator"] = [summary["integrator"] for summary in summaries]
+    results["termination"] = [summary["termination"] for summary in summaries]
+    results["frequencies"] = [np.array(summary["frequencies"]) for summary in summaries]
+    results["psd"] = [np.array(summary["psd"]) for summary in summaries]
+    return results
+
+def aggregate_spectrum(results, weights=None, number_of_frequencies=512):
+    """
+    Adds the PSDs of a sweep into one spectrum, leaving out points that failed. Without
+    weights every point is weighted by 2 pi b db over the impact parameters of the sweep,
+    as for a uniform beam.
+
+    params:
+    results (dict): as returned by load_sweep_results
+    weights (array): weight of every point
+    number_of_frequencies (int): points on the logarithmic frequency grid
+
+    returns:
+    fs (numpy array): frequencies in Hz
+    Pxx (numpy array): weighted total power spectral density
+    """
+    if weights is None:
+        impact_parameters = np.unique(results["impact_parameter"])
+        weight_table = dict(zip(impact_parameters, impact_parameter_weights(convert_bohr_to_meter(impact_parameters))))
+        weights = [weight_table[impact_parameter] for impact_parameter in results["impact_parameter"]]
+    #a PSD needs a frequency above zero to have a place on the logarithmic grid
+    kept = [point for point, frequency_list in enumerate(results["frequencies"]) if len(frequency_list) > 1]
+    return combine_psds([results["frequencies"][point] for point in kept], [results["psd"][point] for point in kept],
+                        [weights[point] for point in kept], number_of_frequencies)
+
+def summarize_run_worker(arguments):
+    """Runs summarize_run in a pool worker, from one (parameters, integrator) tuple"""
+    try:
+        summary = summarize_run(*arguments)
+    except Exception as error:
+        #one bad point should not stop a long sweep, it is written with its error instead
+        summary = failed_summary(*arguments, error)
+    #timings recorded in the worker travel back with the summary, see sweep_electrons
+    if instrumentation.ENABLED:
+        summary["instrumentation"] = instrumentation.snapshot()
+        instrumentation.reset()
+    return summary
+
+def sweep_electrons(initial_distances, impact_parameters, initial_velocities, nucleus_charges, output_path,
+                    integrator="analytic", processes=None, verbose=False):
+    """
+    Fires an electron for every point of a parameter grid that is not already in the
+    results file with this integrator and appends its summary to the file. A point
+    whose run raises is written with "termination": "error" and the error message.
+
+    params:
+    initial_distances (array): initial distance axis in a_0
+    impact_parameters (array): impact parameter axis in a_0
+    initial_velocities (array): initial velocity axis in m/s
+    nucleus_charges (array): nucleus charge axis in e-
+    output_path (str): JSON-lines results file, created if it does not exist
+    integrator (str): any integrator accepted by fire_electron
+    processes (int): number of worker processes, defaults to the number of cores
+    verbose (bool): print progress as points finish
+
+    returns:
+    number_of_points (int): number of points fired by this call
+    """
+    completed = load_completed_points(output_path)
+    points = [tuple(float(value) for value in point)
+              for point in itertools.product(initial_distances, impact_parameters,
+                                             initial_velocities, nucleus_charges)]
+    remaining_points = [point for point in points if point + (integrator,) not in completed]
+    if verbose:
+        print(f"{len(points) - len(remaining_points)}/{len(points)} points already in {output_path}")
+
+    start_time = time.perf_counter()
+    initializer = instrumentation.enable if instrumentation.ENABLED else None
+    with open(output_path, "a") as results_file, multiprocessing.Pool(processes, initializer) as pool:
+        summaries = pool.imap_unordered(summarize_run_worker, [(point, integrator) for point in remaining_points])
+        for points_done, summary in enumerate(summaries, start=1):
+            if "instrumentation" in summary:
+                instrumentation.merge(summary.pop("instrumentation"))
+            results_file.write(json.dumps(summary) + "\n")
+            results_file.flush()
+            if verbose:
+                elapsed_time = time.perf_counter() - start_time
+                print(f"{points_done}/{len(remaining_points)} points ({elapsed_time:.1f} s)")
+                if summary["termination"] == "error":
+                    print(f"    failed at {tuple(summary[name] for name in PARAMETERS)}: {summary['error']}")
+    return len(remaining_points)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep HW3 electron scattering over a parameter grid")
+    parser.add_argument("--distances", nargs="+", required=True, help="initial distance axis in a_0")
+    parser.add_argument("--impact-parameters", nargs="+", required=True, help="impact parameter axis in a_0")
+    parser.add_argument("--velocities", nargs="+", required=True, help="initial velocity axis in m/s")
+    parser.add_argument("--charges", nargs="+", required=True, help="nucleus charge axis in e-")
+    parser.add_argument("--output", required=True, help="JSON-lines file to append the results to")
+    parser.add_argument("--integrator", choices=list(STEPS_PER_RUN), default="analytic",
+                        help="integrator used for every electron")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--profile", help="write timings of the runs to this JSON file, "
+                                          "in Chrome trace format if it ends in .trace.json")
+    args = parser.parse_args()
+    if args.profile:
+        instrumentation.enable(args.profile)
+
+    sweep_electrons(parse_axis(args.distances), parse_axis(args.impact_parameters),
+                    parse_axis(args.velocities), parse_axis(args.charges), args.output,
+                    integrator=args.integrator, processes=args.processes, verbose=True)
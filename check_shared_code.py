@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Michael Randall
+mrandall@ucsd.edu
+
+Each homework folder runs on its own, so the little code HW2 and HW3 share is kept
+as a copy in both. This checks that the copies are still the same and exits with an
+error listing the ones that differ, so a change made to only one copy is caught.
+
+Run as "python check_shared_code.py" from anywhere in the repository."""
+
+import ast
+import os
+import sys
+
+REPOSITORY = os.path.dirname(os.path.abspath(__file__))
+
+#files that must be the same in every folder
+SHARED_FILES = [("HW2/instrumentation.py", "HW3/instrumentation.py")]
+#(file, function) pairs whose function must have the same source in every file
+SHARED_FUNCTIONS = [(("HW2/sweep_HW2.py", "HW3/sweep_HW3.py"), "parse_axis")]
+
+def function_source(path, name):
+    """
+    params:
+    path (str): Python file, relative to the repository
+    name (str): top level function in it
+
+    returns:
+    source (str): the source of the function, or None if the file has no such function
+    """
+    with open(os.path.join(REPOSITORY, path)) as source_file:
+        source = source_file.read()
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef) and node.name == name:
+            return ast.get_source_segment(source, node)
+    return None
+
+def find_differences():
+    """
+    returns:
+    differences [str]: a description of every shared copy that differs from the first
+    """
+    differences = []
+    for paths in SHARED_FILES:
+        contents = []
+        for path in paths:
+            with open(os.path.join(REPOSITORY, path), "rb") as shared_file:
+                contents.append(shared_file.read())
+        for path, content in zip(paths[1:], contents[1:]):
+            if content != contents[0]:
+                differences.append(f"{path} differs from {paths[0]}")
+    for paths, name in SHARED_FUNCTIONS:
+        sources = [function_source(path, name) for path in paths]
+        for path, source in zip(paths[1:], sources[1:]):
+            if source is None or source != sources[0]:
+                differences.append(f"{name} in {path} differs from {paths[0]}")
+    return differences
+
+if __name__ == "__main__":
+    differences = find_differences()
+    for difference in differences:
+        print(difference)
+    if differences:
+        sys.exit(1)
+    print("All shared code matches")